@@ -1,21 +1,165 @@
+import os
+
 from flask import Flask
+from .bench import init_bench
+from .cache import init_cache
+from .datagen import init_datagen
 from .db import init_db
+from .expiry import init_expiry
+from .facets import init_facets
+from .exporter import init_exporter
+from .importer import init_importer
+from .ingest import init_ingest
+from .metrics import init_metrics
+from .migrate import init_migrate
+from .plancheck import init_plancheck
+from .purge import init_purge
+from .recommend import init_recommend
+from .stats import init_stats
+from .versions import init_versions
 from .routes import main
 
 def create_app():
     app = Flask(__name__)
 
-    # Configuration for MySQL database
-    app.config['MYSQL_HOST'] = 'localhost'
-    app.config['MYSQL_USER'] = 'username'
-    app.config['MYSQL_PASSWORD'] = 'password'
-    app.config['MYSQL_DATABASE'] = 'movie_streaming'
+    # Configuration for MySQL database, from the environment (e.g. MYSQL_PASSWORD=... python run.py)
+    app.config['MYSQL_HOST'] = os.environ.get('MYSQL_HOST', 'localhost')
+    app.config['MYSQL_PORT'] = int(os.environ.get('MYSQL_PORT', 3306))
+    app.config['MYSQL_USER'] = os.environ.get('MYSQL_USER', 'root')
+    app.config['MYSQL_PASSWORD'] = os.environ.get('MYSQL_PASSWORD', '')
+    app.config['MYSQL_DATABASE'] = os.environ.get('MYSQL_DATABASE', 'movie_streaming')
+
+    # Connection pool settings
+    app.config['MYSQL_POOL_SIZE'] = 10        # maximum open connections per process
+    app.config['MYSQL_POOL_TIMEOUT'] = 5      # seconds to wait for a free connection
+    app.config['MYSQL_POOL_RECYCLE'] = 3600   # seconds before a connection is reopened
+    app.config['MYSQL_POOL_PRE_PING'] = True  # check connections before handing them out
+
+    # Read replicas (see db.py). GET requests read from them; writes, and reads that
+    # must see a client's own recent writes, use the primary. Entries are 'host' or
+    # 'host:port' strings or dicts of connection settings, e.g. MYSQL_REPLICAS=127.0.0.1:3307
+    app.config['MYSQL_REPLICAS'] = [r.strip() for r in os.environ.get('MYSQL_REPLICAS', '').split(',') if r.strip()]
+    app.config['MYSQL_REPLICA_MAX_LAG'] = 5               # seconds; a replica further behind is skipped (None: no check)
+    app.config['MYSQL_REPLICA_LAG_CHECK_INTERVAL'] = 1.0  # seconds between lag checks of a replica
+    app.config['MYSQL_REPLICA_RETRY_INTERVAL'] = 30       # seconds an unreachable replica is left alone
+    app.config['MYSQL_REPLICA_POOL_TIMEOUT'] = 1          # seconds to wait for a replica connection before using the primary
+    app.config['MYSQL_READ_YOUR_WRITES_SECONDS'] = 5      # a client reads from the primary this long after writing
+
+    # List pages are paginated by key; ?limit= may ask for up to PAGE_SIZE_MAX rows
+    app.config['PAGE_SIZE'] = 50
+    app.config['PAGE_SIZE_MAX'] = 500
+
+    # Query repository (app/queries.py): server-side prepared statements, cached per pooled connection
+    app.config['PREPARED_STATEMENTS'] = True               # False runs the same queries as plain text
+    app.config['PREPARED_STATEMENTS_PER_CONNECTION'] = 64  # statements kept prepared on each connection
+
+    # Report result cache: 'local' (per process) or 'redis' (shared, needs REPORT_CACHE_URL)
+    app.config['REPORT_CACHE_BACKEND'] = 'local'
+    app.config['REPORT_CACHE_URL'] = None
+    app.config['REPORT_CACHE_TTL'] = 300          # seconds
+    app.config['REPORT_CACHE_MAX_ENTRIES'] = 256  # local backend only
+
+    # Top movies by genre: movies per genre and ratings a movie needs to be ranked
+    app.config['REPORT_GENRE_TOP_N'] = 5
+    app.config['REPORT_GENRE_TOP_N_MAX'] = 100
+    app.config['REPORT_GENRE_MIN_RATINGS'] = 1
+
+    # Revenue report: default and longest date range of /reports/revenue
+    app.config['REPORT_REVENUE_DEFAULT_DAYS'] = 30
+    app.config['REPORT_REVENUE_MAX_DAYS'] = 3660
+    app.config['REVENUE_BACKFILL_DAYS'] = 31          # days rebuilt per backfill transaction
+
+    # Conditional GET and rendered-page cache for /movies, /genres and /ratings
+    app.config['PAGE_CACHE_ENABLED'] = True
+    app.config['PAGE_CACHE_MAX_BYTES'] = 32 * 2**20        # rendered pages kept per process
+    app.config['TABLE_VERSIONS_POLL_INTERVAL'] = 1.0       # seconds between reads of table_versions
+
+    # Bulk CSV import
+    app.config['IMPORT_BATCH_SIZE'] = 1000            # rows per INSERT transaction
+    app.config['IMPORT_MAX_REJECTS_REPORTED'] = 100   # rejected rows listed in a report
+
+    # Deleting users and subscriptions (routes and `flask purge-users`)
+    app.config['PURGE_BATCH_SIZE'] = 500              # rows deleted per transaction
+    app.config['PURGE_SELECT_WINDOW'] = 10000         # userIDs scanned per step when selecting inactive users
+
+    # Subscription expiry: the in-process scheduler is off by default (run
+    # `flask expire-subscriptions` from cron instead)
+    app.config['SUBSCRIPTION_EXPIRY_INTERVAL'] = 0               # seconds between runs; 0 disables the scheduler
+    app.config['SUBSCRIPTION_EXPIRY_BATCH_SIZE'] = 500           # subscriptions updated per transaction
+    app.config['SUBSCRIPTION_EXPIRY_MAX_ROWS_PER_SECOND'] = 2000 # 0 for no limit
+    app.config['SUBSCRIPTION_EXPIRY_MAX_ROWS'] = 0               # per run; 0 for no limit
+
+    # Rating submissions: 'sync' writes each one in the request; 'buffered' queues
+    # them for a background writer that upserts them in batches (see ingest.py)
+    app.config['RATING_INGEST_MODE'] = os.environ.get('RATING_INGEST_MODE', 'sync')
+    app.config['RATING_INGEST_QUEUE_SIZE'] = 10000      # ratings waiting at most; more get 503
+    app.config['RATING_INGEST_BATCH_SIZE'] = 500        # ratings per INSERT and commit
+    app.config['RATING_INGEST_FLUSH_INTERVAL'] = 0.2    # seconds a rating waits at most for a full batch
+    app.config['RATING_INGEST_ENQUEUE_TIMEOUT'] = 0.5   # seconds a submission waits for room in a full queue
+    app.config['RATING_INGEST_RETRY_INTERVAL'] = 1.0    # seconds between attempts while the database is failing
+
+    # Streaming export
+    app.config['EXPORT_FETCH_SIZE'] = 5000            # rows fetched from the server at a time
+    app.config['EXPORT_NET_WRITE_TIMEOUT'] = 600      # seconds the server waits on a slow reader
+
+    # User profile (/users/<id>): rows per section page (subscriptions, payments, ratings)
+    app.config['PROFILE_PAGE_SIZE'] = 20
+
+    # Faceted /movies browsing (facets.py): in-memory genre/year/rating index per process
+    app.config['FACET_REFRESH_INTERVAL'] = 30          # seconds between checks for movie/genre changes made elsewhere
+    app.config['FACET_RATING_REFRESH_INTERVAL'] = 60   # seconds between reloads of the average ratings
+
+    # Search results per query
+    app.config['SEARCH_LIMIT'] = 20
+    app.config['SEARCH_LIMIT_MAX'] = 100
+
+    # Typeahead suggestions per keystroke in the add forms
+    app.config['AUTOCOMPLETE_LIMIT'] = 10
+    app.config['AUTOCOMPLETE_LIMIT_MAX'] = 50
+
+    # JSON API: most ids accepted by one batch lookup
+    app.config['API_MAX_IDS'] = 500
+
+    # SQL instrumentation and /metrics (Prometheus text format)
+    app.config['METRICS_ENABLED'] = True
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 200       # statements at least this slow are logged
+    app.config['METRICS_MAX_STATEMENTS'] = 500        # distinct normalized statements tracked
+
+    # Similar movies and recommendations: index location and build parameters
+    app.config['RECOMMEND_INDEX_PATH'] = os.path.join(app.instance_path, 'similar_movies')
+    app.config['RECOMMEND_TOP_K'] = 50            # neighbours kept per movie
+    app.config['RECOMMEND_MIN_COMMON'] = 3        # users two movies need in common to be similar
+    app.config['RECOMMEND_SHRINKAGE'] = 10        # damps similarities backed by few common users
+    app.config['RECOMMEND_BLOCK_SIZE'] = 512      # movies compared at once while building
+    app.config['RECOMMEND_LIMIT'] = 10            # results per request unless ?limit= asks for more
+    app.config['RECOMMEND_RELOAD_INTERVAL'] = 30  # seconds between checks for a newer index
+
+    # Any setting above can be overridden from the environment with a MOVIES_ prefix,
+    # e.g. MOVIES_MYSQL_POOL_SIZE=20 or MOVIES_PAGE_CACHE_ENABLED=false (values are parsed as JSON)
+    app.config.from_prefixed_env('MOVIES')
 
     # Initialize database
     init_db(app)
+    init_stats(app)
+    init_cache(app)
+    init_versions(app)
+    init_facets(app)
+    init_importer(app)
+    init_exporter(app)
+    init_metrics(app)
+    init_datagen(app)
+    init_bench(app)
+    init_recommend(app)
+    init_purge(app)
+    init_expiry(app)
+    init_ingest(app)
+    init_migrate(app)
+    init_plancheck(app)
 
     # Register routes
     from .routes import main
     app.register_blueprint(main)
+    from .api import api
+    app.register_blueprint(api)
 
     return app
@@ -0,0 +1,174 @@
+# api.py
+#
+# Read-only JSON API, versioned under /api/v1.
+#
+#   GET /api/v1/<resource>?ids=1,2,3&fields=title,release_date
+#       batch lookup: every id is resolved by one primary-key IN query
+#   GET /api/v1/<resource>/<id>
+#   GET /api/v1/<resource>?cursor=...&limit=...
+#       keyset-paginated listing (same cursors as the HTML list pages)
+#
+# ?fields= selects a sparse fieldset (the key columns are always included) and
+# ?format=columns returns {"columns": [...], "rows": [[...], ...]} instead of
+# one object per row, which avoids repeating every field name.
+# Ratings are keyed by userID:movieid, e.g. ?ids=12:5,12:9.
+
+from flask import Blueprint, current_app, jsonify, request
+
+from .exporter import plain_value
+from .pagination import fetch_page
+from .queries import fetch_tuples, padded
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+# Secrets (users.password, payments.card_no) are never served
+RESOURCES = {
+    'movies': {
+        'table': 'movies',
+        'key': ['movieid'],
+        'fields': ['movieid', 'title', 'release_date', 'duration', 'description'],
+    },
+    'users': {
+        'table': 'users',
+        'key': ['userID'],
+        'fields': ['userID', 'userName', 'email', 'date_of_birth'],
+    },
+    'ratings': {
+        'table': 'ratings',
+        'key': ['userID', 'movieid'],
+        'fields': ['userID', 'movieid', 'ratingScore', 'review', 'ratingDate'],
+    },
+    'subscriptions': {
+        'table': 'subscriptions',
+        'key': ['subscription_id'],
+        'fields': ['subscription_id', 'userID', 'startdate', 'end_Date', 'subscription_status'],
+    },
+    'payments': {
+        'table': 'payments',
+        'key': ['payment_id'],
+        'fields': ['payment_id', 'payment_amount', 'payment_date', 'payment_method', 'subscription_id'],
+    },
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@api.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify({'error': e.message}), e.status
+
+
+def _resource(name):
+    resource = RESOURCES.get(name)
+    if resource is None:
+        raise ApiError(f"Unknown resource {name}; expected one of {', '.join(RESOURCES)}", 404)
+    return resource
+
+def _fields(resource):
+    requested = request.args.get('fields')
+    if not requested:
+        return list(resource['fields'])
+    by_name = {f.lower(): f for f in resource['fields']}
+    fields = list(resource['key'])
+    for name in requested.split(','):
+        field = by_name.get(name.strip().lower())
+        if field is None:
+            raise ApiError(f"Unknown field {name.strip()}; expected some of {', '.join(resource['fields'])}")
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+def _parse_id(resource, raw):
+    parts = raw.split(':')
+    if len(parts) != len(resource['key']):
+        raise ApiError(f"Ids must look like {':'.join(resource['key'])}")
+    try:
+        return tuple(int(p) for p in parts)
+    except ValueError:
+        raise ApiError(f"Ids must be integers: {raw}") from None
+
+def _parse_ids(resource, raw):
+    ids = []
+    seen = set()
+    for part in raw.split(','):
+        if not part.strip():
+            continue
+        key = _parse_id(resource, part.strip())
+        if key not in seen:
+            seen.add(key)
+            ids.append(key)
+    maximum = current_app.config.get('API_MAX_IDS', 500)
+    if len(ids) > maximum:
+        raise ApiError(f"At most {maximum} ids per request")
+    return ids
+
+
+def by_ids_sql(resource, fields, count):
+    # WHERE key IN (...), or (k1, k2) IN ((...), ...) for composite keys, with count ids
+    key = resource['key']
+    if len(key) == 1:
+        where = f"{key[0]} IN ({', '.join(['%s'] * count)})"
+    else:
+        row = "(" + ", ".join(["%s"] * len(key)) + ")"
+        where = f"({', '.join(key)}) IN ({', '.join([row] * count)})"
+    return f"SELECT {', '.join(fields)} FROM {resource['table']} WHERE {where}"
+
+def list_sql(resource, fields):
+    # The keyset-paginated listing (see pagination.fetch_page)
+    return f"SELECT {', '.join(fields)} FROM {resource['table']}"
+
+
+def _fetch_by_ids(resource, fields, ids):
+    # One round trip for all the ids
+    key = resource['key']
+    if not ids:
+        return [], []
+    # Padded so only a handful of distinct statements get prepared (see queries.py)
+    keys = padded(ids)
+    params = [v for k in keys for v in k]
+    rows = fetch_tuples(by_ids_sql(resource, fields, len(keys)), params)
+
+    # Return rows in the order the ids were asked for
+    key_positions = [fields.index(k) for k in key]
+    by_key = {tuple(row[i] for i in key_positions): row for row in rows}
+    found = [by_key[k] for k in ids if k in by_key]
+    missing = [':'.join(map(str, k)) for k in ids if k not in by_key]
+    return found, missing
+
+
+def _serialize(fields, rows, **extra):
+    rows = [[plain_value(v) for v in row] for row in rows]
+    if request.args.get('format') == 'columns':
+        body = {'columns': fields, 'rows': rows}
+    else:
+        body = {'data': [dict(zip(fields, row)) for row in rows]}
+    body.update(extra)
+    return jsonify(body)
+
+
+@api.route('/<string:name>')
+def list_resource(name):
+    resource = _resource(name)
+    fields = _fields(resource)
+
+    ids = request.args.get('ids')
+    if ids is not None:
+        found, missing = _fetch_by_ids(resource, fields, _parse_ids(resource, ids))
+        return _serialize(fields, found, missing=missing)
+
+    page = fetch_page(list_sql(resource, fields), resource['key'])
+    return _serialize(fields, page.rows, next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
+
+@api.route('/<string:name>/<string:id>')
+def get_resource(name, id):
+    resource = _resource(name)
+    fields = _fields(resource)
+    found, _ = _fetch_by_ids(resource, fields, [_parse_id(resource, id)])
+    if not found:
+        raise ApiError(f"{name} {id} not found", 404)
+    return jsonify({'data': {f: plain_value(v) for f, v in zip(fields, found[0])}})
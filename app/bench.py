@@ -0,0 +1,401 @@
+# bench.py
+#
+# Repeatable latency benchmark for the routes in routes.py.
+#
+#   flask bench-routes -n 200 -c 4 -o results.json
+#   flask bench-routes --base-url http://127.0.0.1:5000 -o results.json
+#   flask bench-compare baseline.json results.json --max-regression 0.2
+#
+# Every GET route of the main blueprint is requested with ids sampled from
+# the database (run `flask seed-data` first for realistic sizes). Edit forms
+# are also POSTed back with their current values when --writes is given, so
+# the data does not change. Add, delete and import routes are not run,
+# because they would change the data between runs. They are listed under
+# "skipped" in the results, so the output accounts for every route. So are
+# the status pages that only read in-process counters. /movies also runs a
+# second time with genre, year and rating filters (the "facets" variant).
+#
+# By default each route runs in its own forked process through the Flask test
+# client, so its peak RSS is measured separately from the other routes. With
+# --base-url the requests go to a running server over HTTP instead, and
+# peak RSS is not reported.
+
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+
+from .db import close_db, forget_pools, get_db, get_pool, get_replicas
+from .exporter import plain_value
+
+SKIPPED = {
+    'main.add_movie': 'creates rows (GET form is benchmarked)',
+    'main.add_user': 'creates rows (GET form is benchmarked)',
+    'main.add_genre': 'creates rows (GET form is benchmarked)',
+    'main.add_subscription': 'creates rows (GET form is benchmarked)',
+    'main.add_payment': 'creates rows (GET form is benchmarked)',
+    'main.add_rating': 'creates rows (GET form is benchmarked)',
+    'main.delete_movie': 'deletes rows',
+    'main.delete_user': 'deletes rows',
+    'main.delete_genre': 'deletes rows',
+    'main.delete_subscription': 'deletes rows',
+    'main.delete_payment': 'deletes rows',
+    'main.delete_rating': 'deletes rows',
+    'main.import_table': 'creates rows',
+    'main.edit_payment': 'card numbers are stored encrypted and cannot be posted back unchanged (GET form is benchmarked)',
+    # Status pages that only read in-process counters (no query, no rendering)
+    'main.subscription_expiry_status': 'in-process counters only',
+    'main.rating_ingest_status': 'in-process counters only',
+    'main.facet_index_status': 'in-process counters only',
+    'main.replica_status': 'in-process counters only',
+    'main.healthz': 'in-process counters only',
+}
+
+
+def _sample(cursor, sql):
+    cursor.execute(sql)
+    return cursor.fetchone()
+
+def sample_data():
+    # One existing row per table, picked from the middle of the key range so
+    # that pages and lookups do not all hit the first rows
+    cursor = get_db().cursor(dictionary=True)
+    samples = {}
+    for table, key in (('users', 'userID'), ('movies', 'movieid'), ('subscriptions', 'subscription_id'),
+                       ('payments', 'payment_id')):
+        cursor.execute(f"SELECT MIN({key}) AS lo, MAX({key}) AS hi FROM {table}")
+        bounds = cursor.fetchone()
+        if bounds['lo'] is None:
+            raise click.ClickException(f"Table {table} is empty; run `flask seed-data` first")
+        middle = (bounds['lo'] + bounds['hi']) // 2
+        cursor.execute(f"SELECT * FROM {table} WHERE {key} >= %s ORDER BY {key} LIMIT 1", (middle,))
+        samples[table] = cursor.fetchone()
+    samples['ratings'] = _sample(cursor, "SELECT * FROM ratings ORDER BY userID DESC, movieid DESC LIMIT 1")
+    samples['movie_genre'] = _sample(cursor, "SELECT * FROM movie_genre LIMIT 1")
+    if samples['ratings'] is None or samples['movie_genre'] is None:
+        raise click.ClickException("Tables ratings and movie_genre need rows; run `flask seed-data` first")
+
+    counts = {}
+    for table in ('users', 'movies', 'movie_genre', 'subscriptions', 'payments', 'ratings'):
+        counts[table] = _sample(cursor, f"SELECT COUNT(*) AS n FROM {table}")['n']
+    cursor.close()
+    return samples, counts
+
+
+def _form(row, fields):
+    return {f: '' if row[f] is None else str(plain_value(row[f])) for f in fields}
+
+def build_scenarios(samples, writes=False):
+    """Return (scenarios, skipped): one (endpoint, method, url, form[, variant]) per route run.
+
+    A variant names a second scenario of the same route (e.g. /movies with filters).
+    """
+    user, movie = samples['users'], samples['movies']
+    subscription, payment = samples['subscriptions'], samples['payments']
+    rating, genre = samples['ratings'], samples['movie_genre']
+    quote = urllib.parse.quote
+    word = quote(movie['title'].split()[0] if movie['title'] else 'a')
+    revenue_end = payment['payment_date'] or datetime.date.today()
+    revenue_start = revenue_end - datetime.timedelta(days=364)
+    decade = (movie['release_date'].year // 10 * 10) if movie['release_date'] else 2000
+
+    scenarios = [
+        ('main.dashboard', 'GET', '/', None),
+        ('main.list_movies', 'GET', '/movies', None),
+        # Served from the in-memory facet index, then the page's movies by primary key
+        ('main.list_movies', 'GET',
+         f"/movies?genre={quote(genre['movie_genre'])}&year={decade}-{decade + 9}&min_rating=3", None, 'facets'),
+        ('main.add_movie', 'GET', '/movies/add', None),
+        ('main.edit_movie', 'GET', f"/movies/edit/{movie['movieid']}", None),
+        ('main.list_users', 'GET', '/users', None),
+        ('main.add_user', 'GET', '/users/add', None),
+        ('main.edit_user', 'GET', f"/users/edit/{user['userID']}", None),
+        ('main.user_profile', 'GET', f"/users/{user['userID']}", None),
+        ('main.list_genres', 'GET', '/genres', None),
+        ('main.add_genre', 'GET', '/genres/add', None),
+        ('main.edit_genre', 'GET', f"/genres/edit/{genre['movieid']}/{quote(genre['movie_genre'])}", None),
+        ('main.list_subscriptions', 'GET', '/subscriptions', None),
+        ('main.add_subscription', 'GET', '/subscriptions/add', None),
+        ('main.edit_subscription', 'GET', f"/subscriptions/edit/{subscription['subscription_id']}", None),
+        ('main.list_payments', 'GET', '/payments', None),
+        ('main.add_payment', 'GET', '/payments/add', None),
+        ('main.edit_payment', 'GET', f"/payments/edit/{payment['payment_id']}", None),
+        ('main.list_ratings', 'GET', '/ratings', None),
+        ('main.add_rating', 'GET', '/ratings/add', None),
+        ('main.edit_rating', 'GET', f"/ratings/edit/{rating['movieid']}/{rating['userID']}", None),
+        ('main.reports', 'GET', '/reports', None),
+        ('main.top_movies_by_genre', 'GET', '/reports/genres/top?n=10', None),
+        ('main.revenue_report', 'GET', f"/reports/revenue?start={revenue_start}&end={revenue_end}&period=week", None),
+        ('main.report_cache_stats', 'GET', '/reports/cache', None),
+        # Polled by load balancers; runs SELECT 1 on the primary
+        ('main.readyz', 'GET', '/readyz', None),
+        ('main.search', 'GET', f"/search?q={word}", None),
+        ('main.search_movies_json', 'GET', f"/search/movies?q={word}", None),
+        ('main.search_users_json', 'GET', f"/search/users?q={quote(user['userName'][:3])}", None),
+        ('main.movie_rating_stats_json', 'GET', f"/movies/{movie['movieid']}/stats", None),
+        ('main.similar_movies_json', 'GET', f"/movies/{movie['movieid']}/similar", None),
+        ('main.user_recommendations_json', 'GET', f"/users/{user['userID']}/recommendations", None),
+        ('main.autocomplete_users', 'GET', f"/autocomplete/users?q={quote(user['userName'][:3])}", None),
+        ('main.autocomplete_movies', 'GET', f"/autocomplete/movies?q={word}", None),
+        ('main.autocomplete_subscriptions', 'GET', f"/autocomplete/subscriptions?q={quote(user['userName'][:3])}", None),
+        # A bounded key range keeps the export comparable as the table grows
+        ('main.export_table', 'GET', f"/export/users?upto={user['userID']}", None),
+    ]
+
+    if writes:
+        scenarios += [
+            ('main.edit_movie', 'POST', f"/movies/edit/{movie['movieid']}",
+             _form(movie, ['title', 'release_date', 'duration', 'description'])),
+            ('main.edit_user', 'POST', f"/users/edit/{user['userID']}",
+             _form(user, ['userName', 'email', 'password', 'date_of_birth'])),
+            ('main.edit_genre', 'POST', f"/genres/edit/{genre['movieid']}/{quote(genre['movie_genre'])}",
+             _form(genre, ['movie_genre'])),
+            ('main.edit_subscription', 'POST', f"/subscriptions/edit/{subscription['subscription_id']}",
+             _form(subscription, ['userID', 'startdate', 'end_Date', 'subscription_status'])),
+            ('main.edit_rating', 'POST', f"/ratings/edit/{rating['movieid']}/{rating['userID']}",
+             _form(rating, ['ratingScore', 'review', 'ratingDate'])),
+        ]
+
+    skipped = dict(SKIPPED)
+    if not writes:
+        for endpoint in ('main.edit_movie', 'main.edit_user', 'main.edit_genre',
+                         'main.edit_subscription', 'main.edit_rating'):
+            skipped[endpoint] = 'POST runs only with --writes (GET form is benchmarked)'
+    return scenarios, skipped
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB elsewhere
+
+
+def _client_request(app):
+    local = threading.local()
+
+    def send(method, url, form):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        response = client.open(url, method=method, data=form)
+        response.get_data()  # drain streamed bodies so the whole response is timed
+        response.close()
+        return response.status_code
+    return send
+
+def _http_request(base_url, timeout):
+    def send(method, url, form):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        # Redirects after a POST are not followed, as with the test client
+        opener = urllib.request.build_opener(_NoRedirect)
+        try:
+            with opener.open(urllib.request.Request(base_url + url, data=data, method=method), timeout=timeout) as response:
+                while response.read(65536):
+                    pass
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def run_scenario(send, method, url, form, requests, concurrency, warmup):
+    for _ in range(warmup):
+        send(method, url, form)
+
+    def timed(_):
+        started = time.perf_counter()
+        try:
+            status = send(method, url, form)
+        except Exception as e:
+            status = type(e).__name__
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(n for status, n in statuses.items() if not (status.isdigit() and int(status) < 400))
+    return {
+        'method': method,
+        'url': url,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'status_codes': statuses,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else None,
+    }
+
+
+def _run_isolated(app, scenario, requests, concurrency, warmup):
+    # Forked child: gets its own connection pool and its own peak RSS
+    method, url, form = scenario[1:4]
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(
+        target=_child, args=(app, method, url, form, requests, concurrency, warmup, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = f"worker exited with code {process.exitcode}"
+    process.join()
+    if isinstance(result, str):
+        raise click.ClickException(f"{scenario[0]} failed: {result}")
+    return result
+
+def _child(app, method, url, form, requests, concurrency, warmup, conn):
+    try:
+        forget_pools(app)
+        result = run_scenario(_client_request(app), method, url, form, requests, concurrency, warmup)
+        result['peak_rss_kb'] = peak_rss_kb()
+        conn.send(result)
+    except Exception as e:
+        conn.send(f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+
+
+@click.command('bench-routes')
+@click.option('--requests', '-n', type=int, default=200, show_default=True, help='Timed requests per route.')
+@click.option('--concurrency', '-c', type=int, default=1, show_default=True, help='Concurrent clients.')
+@click.option('--warmup', type=int, default=5, show_default=True, help='Untimed requests per route.')
+@click.option('--writes', is_flag=True, help='Also POST the edit forms back unchanged.')
+@click.option('--only', default=None, help='Comma separated endpoints to run (e.g. main.list_movies).')
+@click.option('--base-url', default=None, help='Benchmark a running server over HTTP instead of the test client.')
+@click.option('--timeout', type=float, default=30, show_default=True, help='HTTP timeout in seconds.')
+@click.option('--no-isolate', is_flag=True, help='Run every route in this process (peak RSS is then cumulative).')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help='Write the results as JSON.')
+def bench_command(requests, concurrency, warmup, writes, only, base_url, timeout, no_isolate, output):
+    """Measure p50/p95/p99 latency, throughput and peak RSS per route."""
+    app = current_app._get_current_object()
+    samples, counts = sample_data()
+    scenarios, skipped = build_scenarios(samples, writes)
+    if only:
+        wanted = {e.strip() for e in only.split(',')}
+        scenarios = [s for s in scenarios if s[0] in wanted]
+
+    # Every route of the blueprint must be either benchmarked or explained
+    covered = {s[0] for s in scenarios} | set(skipped)
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint.startswith('main.') and rule.endpoint not in covered and not only:
+            skipped[rule.endpoint] = 'no benchmark scenario'
+
+    isolate = base_url is None and not no_isolate and 'fork' in multiprocessing.get_all_start_methods()
+    if isolate:
+        # Children must not share the parent's sockets
+        close_db()
+        get_pool(app).close()
+        replicas = get_replicas(app)
+        for replica in replicas.replicas if replicas is not None else ():
+            replica.pool.close()
+        forget_pools(app)
+
+    send = _http_request(base_url.rstrip('/'), timeout) if base_url else _client_request(app)
+    routes = {}
+    for scenario in scenarios:
+        endpoint, method, url, form = scenario[:4]
+        name = f"{endpoint} {method}" + (f" {scenario[4]}" if len(scenario) > 4 else "")
+        if isolate:
+            result = _run_isolated(app, scenario, requests, concurrency, warmup)
+        else:
+            result = run_scenario(send, method, url, form, requests, concurrency, warmup)
+            result['peak_rss_kb'] = None if base_url else peak_rss_kb()
+        routes[name] = result
+        click.echo(f"{name:42} p50 {result['p50_ms']:9.2f}ms  p95 {result['p95_ms']:9.2f}ms  "
+                   f"p99 {result['p99_ms']:9.2f}ms  {result['throughput_rps']:8.1f} req/s  "
+                   f"errors {result['errors']}")
+
+    results = {
+        'meta': {
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'mode': 'http' if base_url else 'test-client',
+            'base_url': base_url,
+            'isolated': isolate,
+            'requests': requests,
+            'concurrency': concurrency,
+            'warmup': warmup,
+            'writes': writes,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'database': app.config['MYSQL_DATABASE'],
+            'row_counts': counts,
+        },
+        'routes': routes,
+        'skipped': skipped,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        click.echo(f"Results written to {output}")
+
+
+def compare(baseline, current, metric='p95_ms', max_regression=0.2):
+    """Return (rows, regressions) comparing metric per route between two result files."""
+    rows, regressions = [], []
+    for name, result in sorted(current['routes'].items()):
+        before = baseline['routes'].get(name, {}).get(metric)
+        after = result.get(metric)
+        if before is None or after is None:
+            rows.append((name, before, after, None))
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+        if change > max_regression:
+            regressions.append(name)
+    return rows, regressions
+
+@click.command('bench-compare')
+@click.argument('baseline', type=click.File('r'))
+@click.argument('current', type=click.File('r'))
+@click.option('--metric', default='p95_ms', show_default=True,
+              type=click.Choice(['p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'peak_rss_kb']))
+@click.option('--max-regression', type=float, default=0.2, show_default=True,
+              help='Fail when a route gets worse by more than this fraction.')
+def bench_compare_command(baseline, current, metric, max_regression):
+    """Compare two bench-routes result files; exits 1 on a regression."""
+    rows, regressions = compare(json.load(baseline), json.load(current), metric, max_regression)
+    for name, before, after, change in rows:
+        if change is None:
+            click.echo(f"{name:42} {before!s:>12} -> {after!s:>12}   (not comparable)")
+        else:
+            flag = '  REGRESSION' if name in regressions else ''
+            click.echo(f"{name:42} {before:12.2f} -> {after:12.2f}   {change:+7.1%}{flag}")
+    if regressions:
+        raise click.ClickException(f"{len(regressions)} route(s) regressed by more than {max_regression:.0%} on {metric}")
+
+def init_bench(app):
+    app.cli.add_command(bench_command)
+    app.cli.add_command(bench_compare_command)
@@ -0,0 +1,193 @@
+# cache.py
+#
+# Result cache for expensive read queries (the reports page).
+# Entries expire after a TTL and are also dropped as soon as a route writes to
+# one of the tables the entry was computed from: each table has a generation
+# number that is part of the cache key, and invalidate() just bumps it.
+#
+# The default backend lives in this process. Setting REPORT_CACHE_BACKEND to
+# 'redis' shares entries (and invalidations) between worker processes.
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .db import mark_written, read_from_replica
+from .versions import bump_versions
+
+
+class LocalBackend:
+    # In-process LRU dictionary with per-entry expiry
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._counters = {}             # generation counters, never evicted
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_counters(self, names):
+        with self._lock:
+            return [self._counters.get(name, 0) for name in names]
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisBackend:
+    # Shared backend; size bounding is left to the server's maxmemory policy
+
+    def __init__(self, url, prefix='movie_streaming:'):
+        import redis  # optional dependency, only needed for this backend
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def get_counters(self, names):
+        if not names:
+            return []
+        values = self._client.mget([self.prefix + 'gen:' + name for name in names])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def incr(self, name):
+        return self._client.incr(self.prefix + 'gen:' + name)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + 'report:*'):
+            self._client.delete(key)
+
+    def size(self):
+        return sum(1 for _ in self._client.scan_iter(self.prefix + 'report:*'))
+
+
+class ResultCache:
+    def __init__(self, backend, ttl=300, replica_lag=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.replica_lag = replica_lag  # longest replica lag accepted (MYSQL_REPLICA_MAX_LAG)
+        self._invalidated_at = {}       # table -> monotonic time of this process's last invalidation
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.invalidations = 0
+
+    def get_or_compute(self, name, tables, compute, *args):
+        # Cache key: report name, its arguments and the generation of every table it reads
+        generations = self.backend.get_counters(list(tables))
+        key = "report:%s:%r:%s" % (name, args, ':'.join(map(str, generations)))
+
+        # Entries are stored as 1-tuples so that a cached None is still a hit
+        entry = self.backend.get(key)
+        if entry is not None:
+            self._count(self.hits, name)
+            return entry[0]
+
+        self._count(self.misses, name)
+        value = compute(*args)
+        self.backend.set(key, (value,), self._ttl_for(tables))
+        return value
+
+    def _ttl_for(self, tables):
+        # A value read from a replica right after a write may predate that write
+        # even though its key has the new generation; keep it only as long as
+        # the replica may lag
+        if self.replica_lag is None or not read_from_replica():
+            return self.ttl
+        now = time.monotonic()
+        with self._lock:
+            recent = any(now - self._invalidated_at.get(t, float('-inf')) < self.replica_lag for t in tables)
+        return min(self.ttl, max(1, self.replica_lag)) if recent else self.ttl
+
+    def invalidate(self, *tables):
+        for table in tables:
+            self.backend.incr(table)
+        now = time.monotonic()
+        with self._lock:
+            self.invalidations += 1
+            for table in tables:
+                self._invalidated_at[table] = now
+
+    def _count(self, counter, name):
+        with self._lock:
+            counter[name] = counter.get(name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            misses = sum(self.misses.values())
+            return {
+                'backend': type(self.backend).__name__,
+                'ttl': self.ttl,
+                'entries': self.backend.size(),
+                'evictions': self.backend.evictions,
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+                'invalidations': self.invalidations,
+                'per_report': {
+                    name: {'hits': self.hits.get(name, 0), 'misses': self.misses.get(name, 0)}
+                    for name in sorted(self.hits.keys() | self.misses.keys())
+                },
+            }
+
+
+def get_cache():
+    return current_app.extensions['report_cache']
+
+def cached(name, tables, compute, *args):
+    return get_cache().get_or_compute(name, tables, compute, *args)
+
+def invalidate(*tables):
+    # Called by the write routes after commit; also bumps the page versions
+    # (versions.py) and sends this client's next reads to the primary (db.py)
+    mark_written()
+    get_cache().invalidate(*tables)
+    bump_versions(tables)
+
+def init_cache(app):
+    if app.config.get('REPORT_CACHE_BACKEND', 'local') == 'redis':
+        backend = RedisBackend(app.config['REPORT_CACHE_URL'])
+    else:
+        backend = LocalBackend(app.config.get('REPORT_CACHE_MAX_ENTRIES', 256))
+    replica_lag = app.config.get('MYSQL_REPLICA_MAX_LAG', 5) if app.config.get('MYSQL_REPLICAS') else None
+    app.extensions['report_cache'] = ResultCache(backend, app.config.get('REPORT_CACHE_TTL', 300), replica_lag)
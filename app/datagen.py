@@ -0,0 +1,231 @@
+# datagen.py
+#
+# Seeded synthetic data for the movie_streaming schema, for load testing.
+# `flask seed-data --scale large` produces roughly 1M users, 50k movies,
+# 20M ratings and matching subscriptions and payments. The same seed and
+# --today (a fixed date by default, which every generated date is relative to)
+# always produce the same values. Ids are not part of that: new ids continue
+# after the current maximum of each table, so the same rows get the same ids
+# only when the run starts from the same tables (e.g. empty ones). Every
+# foreign key points at a row generated earlier in the run
+# (users -> movies -> movie_genre -> subscriptions -> payments -> ratings).
+#
+# Rows go in with multi-row INSERTs, batch_size rows per transaction. The
+# dashboard triggers still fire, so the metrics stay correct. Card numbers
+# are inserted in plain text and encrypted by the encrypt_cardno trigger.
+
+import datetime
+import hashlib
+import random
+import time
+
+import click
+
+from .cache import invalidate
+from .db import get_db
+
+SCALES = {
+    'tiny':   {'users': 1_000,     'movies': 200,    'ratings': 20_000},
+    'small':  {'users': 10_000,    'movies': 2_000,  'ratings': 200_000},
+    'medium': {'users': 100_000,   'movies': 10_000, 'ratings': 2_000_000},
+    'large':  {'users': 1_000_000, 'movies': 50_000, 'ratings': 20_000_000},
+}
+
+# Generated dates end here (and subscriptions ending after it are Active)
+TODAY = datetime.date(2025, 1, 1)
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama',
+          'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Mystery', 'Romance',
+          'Science Fiction', 'Thriller', 'War', 'Western']
+
+WORDS = ['night', 'river', 'last', 'city', 'shadow', 'king', 'summer', 'star', 'house',
+         'road', 'winter', 'secret', 'blue', 'iron', 'garden', 'ghost', 'empire', 'storm',
+         'island', 'heart', 'silent', 'golden', 'lost', 'wild', 'broken', 'machine']
+
+
+def _random_date(rng, start, end):
+    return start + datetime.timedelta(days=rng.randrange((end - start).days + 1))
+
+def _max_id(cursor, table, column):
+    cursor.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table}")
+    return cursor.fetchone()[0]
+
+
+class Seeder:
+    def __init__(self, db, seed, batch_size, today=TODAY, echo=click.echo):
+        self.db = db
+        self.cursor = db.cursor()
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.echo = echo
+        self.today = today
+
+    def _insert(self, table, columns, rows):
+        # rows is any iterable; it is consumed batch_size rows at a time
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        started = time.perf_counter()
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.cursor.executemany(sql, batch)
+                self.db.commit()
+                total += len(batch)
+                batch = []
+        if batch:
+            self.cursor.executemany(sql, batch)
+            self.db.commit()
+            total += len(batch)
+        seconds = time.perf_counter() - started
+        rate = total / seconds if seconds else 0
+        self.echo(f"  {table}: {total} rows in {seconds:.1f}s ({rate:.0f} rows/s)")
+        return total
+
+    def users(self, count):
+        first = _max_id(self.cursor, 'users', 'userID') + 1
+        rng = self.rng
+
+        def rows():
+            for user_id in range(first, first + count):
+                name = f"{rng.choice(WORDS)}_{user_id}"
+                yield (
+                    user_id, name, f"{name}@example.com",
+                    hashlib.sha256(f"password-{user_id}".encode()).hexdigest(),
+                    _random_date(rng, datetime.date(1950, 1, 1), datetime.date(2008, 12, 31)),
+                )
+        self._insert('users', ['userID', 'userName', 'email', 'password', 'date_of_birth'], rows())
+        return range(first, first + count)
+
+    def movies(self, count):
+        first = _max_id(self.cursor, 'movies', 'movieid') + 1
+        rng = self.rng
+
+        def rows():
+            for movie_id in range(first, first + count):
+                title = ' '.join(rng.sample(WORDS, rng.randint(1, 4))).title()
+                minutes = rng.randint(75, 190)
+                yield (
+                    movie_id, title,
+                    _random_date(rng, datetime.date(1950, 1, 1), self.today),
+                    f"{minutes // 60}:{minutes % 60:02d}:00",
+                    f"A story about the {' '.join(rng.sample(WORDS, 6))}.",
+                )
+        self._insert('movies', ['movieid', 'title', 'release_date', 'duration', 'description'], rows())
+        return range(first, first + count)
+
+    def genres(self, movie_ids, per_movie):
+        rng = self.rng
+
+        def rows():
+            for movie_id in movie_ids:
+                for genre in rng.sample(GENRES, rng.randint(1, per_movie)):
+                    yield (movie_id, genre)
+        self._insert('movie_genre', ['movieid', 'movie_genre'], rows())
+
+    def subscriptions(self, user_ids, per_user):
+        # Each user gets 0..2*per_user back-to-back subscriptions; the latest may still be active
+        first = _max_id(self.cursor, 'subscriptions', 'subscription_id') + 1
+        rng = self.rng
+        periods = []  # (subscription_id, startdate, end_Date) for the payments step
+
+        def rows():
+            subscription_id = first
+            for user_id in user_ids:
+                start = _random_date(rng, datetime.date(2015, 1, 1), self.today)
+                for _ in range(rng.randint(0, 2 * per_user)):
+                    end = start + datetime.timedelta(days=rng.choice((30, 90, 365)))
+                    status = 'Active' if end >= self.today else 'Inactive'
+                    periods.append((subscription_id, start, end))
+                    yield (subscription_id, user_id, start, end, status)
+                    subscription_id += 1
+                    start = end + datetime.timedelta(days=1)
+        self._insert('subscriptions', ['subscription_id', 'userID', 'startdate', 'end_Date', 'subscription_status'], rows())
+        return periods
+
+    def payments(self, periods, per_subscription):
+        rng = self.rng
+
+        def rows():
+            for subscription_id, start, end in periods:
+                for n in range(rng.randint(1, per_subscription)):
+                    yield (
+                        rng.choice((10, 15, 20)),
+                        ''.join(rng.choice('0123456789') for _ in range(16)),
+                        min(start + datetime.timedelta(days=30 * n), end),
+                        rng.choice(('VISA', 'MASTERCARD')),
+                        subscription_id,
+                    )
+        self._insert('payments', ['payment_amount', 'card_no', 'payment_date', 'payment_method', 'subscription_id'], rows())
+
+    def ratings(self, user_ids, movie_ids, count):
+        # Distinct movies per user keep (userID, movieid) unique; popular movies
+        # are favoured by drawing from a skewed distribution of movie positions
+        rng = self.rng
+        per_user = count / len(user_ids)
+
+        def rows():
+            remaining = count
+            for user_id in user_ids:
+                if remaining <= 0:
+                    break
+                # Exponentially distributed activity: most users rate a few movies, some rate many
+                k = min(remaining, len(movie_ids), int(rng.expovariate(1 / per_user)))
+                chosen = set()
+                while len(chosen) < k:
+                    chosen.add(movie_ids[min(len(movie_ids) - 1, int(rng.paretovariate(1.2)) - 1)]
+                               if rng.random() < 0.5 else movie_ids[rng.randrange(len(movie_ids))])
+                for movie_id in chosen:
+                    yield (
+                        user_id, movie_id, rng.choice((1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5)),
+                        rng.choice(('', 'Loved it', 'Not for me', 'Great cast', 'Too long', 'Would watch again')) or None,
+                        _random_date(rng, datetime.date(2015, 1, 1), self.today),
+                    )
+                remaining -= k
+        self._insert('ratings', ['userID', 'movieid', 'ratingScore', 'review', 'ratingDate'], rows())
+
+
+@click.command('seed-data')
+@click.option('--scale', type=click.Choice(list(SCALES)), default='small', help='Preset sizes.')
+@click.option('--users', type=int, default=None, help='Override the number of users.')
+@click.option('--movies', type=int, default=None, help='Override the number of movies.')
+@click.option('--ratings', type=int, default=None, help='Override the number of ratings.')
+@click.option('--genres-per-movie', type=int, default=3, show_default=True)
+@click.option('--subscriptions-per-user', type=int, default=1, show_default=True, help='Average per user.')
+@click.option('--payments-per-subscription', type=int, default=3, show_default=True, help='Maximum per subscription.')
+@click.option('--seed', type=int, default=4754, show_default=True)
+@click.option('--today', type=click.DateTime(['%Y-%m-%d']), default=TODAY.isoformat(), show_default=True,
+              help='Date the generated history ends on.')
+@click.option('--batch-size', type=int, default=5000, show_default=True)
+def seed_command(scale, users, movies, ratings, genres_per_movie, subscriptions_per_user,
+                 payments_per_subscription, seed, today, batch_size):
+    """Fill the database with reproducible synthetic data."""
+    sizes = dict(SCALES[scale])
+    for name, value in (('users', users), ('movies', movies), ('ratings', ratings)):
+        if value is not None:
+            sizes[name] = value
+    if sizes['users'] < 1 or sizes['movies'] < 1:
+        raise click.BadParameter("At least one user and one movie are needed")
+
+    db = get_db()
+    seeder = Seeder(db, seed, batch_size, today.date())
+    click.echo(f"Seeding {sizes} with seed {seed}, today {seeder.today}")
+    started = time.perf_counter()
+
+    # Rows are generated to satisfy the foreign keys, so skip re-checking them
+    seeder.cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+    try:
+        user_ids = seeder.users(sizes['users'])
+        movie_ids = seeder.movies(sizes['movies'])
+        seeder.genres(movie_ids, genres_per_movie)
+        periods = seeder.subscriptions(user_ids, subscriptions_per_user)
+        seeder.payments(periods, payments_per_subscription)
+        seeder.ratings(user_ids, movie_ids, sizes['ratings'])
+    finally:
+        seeder.cursor.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+
+    invalidate('users', 'movies', 'movie_genre', 'subscriptions', 'payments', 'ratings')
+    click.echo(f"Done in {time.perf_counter() - started:.1f}s")
+
+def init_datagen(app):
+    app.cli.add_command(seed_command)
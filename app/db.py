@@ -1,20 +1,400 @@
+import itertools
+import threading
+import time
+
 import mysql.connector
-from flask import g
+from mysql.connector import errors
+from flask import current_app, g, has_request_context, request
+
+
+class ConnectionPool:
+    # A small bounded pool of MySQL connections shared by the request handlers.
+    # Connections are checked out once per request (see get_db) and returned in close_db.
+
+    def __init__(self, connect_args, size=10, timeout=5, recycle=3600, pre_ping=True):
+        self.connect_args = connect_args
+        self.size = size                # maximum number of open connections
+        self.timeout = timeout          # seconds to wait for a free connection
+        self.recycle = recycle          # seconds before a connection is replaced
+        self.pre_ping = pre_ping        # ping connections before handing them out
+
+        self._cond = threading.Condition()
+        self._idle = []                 # stack of (connection, created_at)
+        self._created_at = {}           # id(connection) -> created_at for checked-out connections
+        self._open = 0
+
+        self.counters = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_recycled': 0,
+            'failed_pings': 0,
+            'exhausted': 0,             # checkouts that found no free connection and had to wait
+            'timeouts': 0,              # checkouts that gave up waiting
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.connect_args)
+        self._count('connections_created')
+        return conn, time.monotonic()
+
+    def _count(self, counter):
+        with self._cond:
+            self.counters[counter] += 1
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except errors.Error:
+            pass
+
+    def checkout(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        conn = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    # Reserve a slot; the connection itself is opened outside the lock
+                    self._open += 1
+                    break
+                if not waited:
+                    self.counters['exhausted'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise errors.PoolError(
+                        f"No MySQL connection available after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+                self._cond.wait(remaining)
+
+            wait = time.monotonic() - start
+            self.counters['checkouts'] += 1
+            self.counters['wait_seconds_total'] += wait
+            self.counters['wait_seconds_max'] = max(self.counters['wait_seconds_max'], wait)
+
+        try:
+            if conn is not None and self.recycle and time.monotonic() - created_at > self.recycle:
+                self._count('connections_recycled')
+                self._discard(conn)
+                conn = None
+            if conn is not None and self.pre_ping:
+                try:
+                    conn.ping(reconnect=False)
+                except errors.Error:
+                    self._count('failed_pings')
+                    self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn, created_at = self._connect()
+        except Exception:
+            # Give the slot back so a failed connect does not shrink the pool
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created_at[id(conn)] = created_at
+        return conn
+
+    def checkin(self, conn, broken=False):
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), None)
+        healthy = created_at is not None and not broken
+        if healthy:
+            try:
+                # Never hand out a connection with a half-finished transaction
+                conn.rollback()
+            except errors.Error:
+                healthy = False
+
+        with self._cond:
+            if healthy:
+                self._idle.append((conn, created_at))
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+        if not healthy:
+            self._discard(conn)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        return stats
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.down_until = 0.0       # monotonic time before which the replica is skipped
+        self.lag = None             # last measured lag in seconds; None if unknown
+        self.lag_checked_at = None
+        self.counters = {'reads': 0, 'unreachable': 0, 'too_stale': 0}
+
+
+class ReplicaSet:
+    # Read replicas, each with its own pool. Requests take them in turn and skip
+    # one that could not be reached in the last `retry_interval` seconds or that
+    # is more than `max_lag` seconds behind the primary.
+
+    def __init__(self, replicas, max_lag=5, lag_check_interval=1.0, retry_interval=30):
+        self.replicas = replicas
+        self.max_lag = max_lag                      # None: any lag is accepted
+        self.lag_check_interval = lag_check_interval
+        self.retry_interval = retry_interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self.counters = {'primary_reads': 0, 'fallbacks': 0, 'failovers': 0}
+
+    def checkout(self):
+        """(replica, connection) for the next usable replica, or None."""
+        with self._lock:
+            start = next(self._turn)
+        now = time.monotonic()
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.down_until > now:
+                continue
+            try:
+                conn = replica.pool.checkout()
+            except errors.PoolError:
+                continue                            # busy, not down
+            except errors.Error:
+                self.mark_down(replica)
+                continue
+            try:
+                fresh = self._fresh_enough(replica, conn)
+            except errors.Error:
+                replica.pool.checkin(conn, broken=True)
+                self.mark_down(replica)
+                continue
+            if not fresh:
+                replica.counters['too_stale'] += 1
+                replica.pool.checkin(conn)
+                continue
+            replica.counters['reads'] += 1
+            return replica, conn
+        return None
+
+    def mark_down(self, replica):
+        replica.counters['unreachable'] += 1
+        replica.down_until = time.monotonic() + self.retry_interval
+        current_app.logger.warning("Replica %s unreachable; reading from the primary for %ss",
+                                   replica.name, self.retry_interval)
+
+    def _fresh_enough(self, replica, conn):
+        if self.max_lag is None:
+            return True
+        now = time.monotonic()
+        if replica.lag_checked_at is None or now - replica.lag_checked_at >= self.lag_check_interval:
+            replica.lag = replication_lag(conn)
+            replica.lag_checked_at = now
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    def stats(self):
+        stats = dict(self.counters)
+        now = time.monotonic()
+        for replica in self.replicas:
+            stats[replica.name] = dict(replica.counters, lag=replica.lag, down=replica.down_until > now,
+                                       pool=replica.pool.stats())
+        return stats
+
+
+def replication_lag(conn):
+    # Seconds_Behind_Source of a replica: None while replication is stopped, and 0
+    # for a server that is not replicating at all (e.g. a second local server in tests)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except errors.ProgrammingError:
+            cursor.execute("SHOW SLAVE STATUS")     # MySQL before 8.0.22
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if not rows:
+        return 0
+    row = rows[0]
+    return row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+
+
+_pool_lock = threading.Lock()
+
+def get_pool(app=None):
+    # The pool is created lazily so that each worker process opens its own connections
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get('mysql_pool')
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get('mysql_pool')
+            if pool is None:
+                pool = ConnectionPool(
+                    {
+                        'host': app.config['MYSQL_HOST'],
+                        'port': app.config.get('MYSQL_PORT', 3306),
+                        'user': app.config['MYSQL_USER'],
+                        'password': app.config['MYSQL_PASSWORD'],
+                        'database': app.config['MYSQL_DATABASE'],
+                    },
+                    size=app.config.get('MYSQL_POOL_SIZE', 10),
+                    timeout=app.config.get('MYSQL_POOL_TIMEOUT', 5),
+                    recycle=app.config.get('MYSQL_POOL_RECYCLE', 3600),
+                    pre_ping=app.config.get('MYSQL_POOL_PRE_PING', True),
+                )
+                app.extensions['mysql_pool'] = pool
+    return pool
+
+def forget_pools(app):
+    # A forked worker must not use sockets opened by its parent: drop inherited
+    # pools without closing them (that would end the parent's sessions)
+    with _pool_lock:
+        app.extensions.pop('mysql_pool', None)
+        app.extensions.pop('mysql_replicas', None)
+
+def get_replicas(app=None):
+    # None unless MYSQL_REPLICAS lists at least one server
+    app = app or current_app._get_current_object()
+    if 'mysql_replicas' not in app.extensions:
+        primary = get_pool(app).connect_args
+        with _pool_lock:
+            if 'mysql_replicas' not in app.extensions:
+                replicas = []
+                for settings in app.config.get('MYSQL_REPLICAS') or []:
+                    # Each entry overrides the primary's connection settings, e.g. {'host': ..., 'port': ...}
+                    if isinstance(settings, str):
+                        host, _, port = settings.partition(':')
+                        settings = {'host': host, 'port': int(port)} if port else {'host': host}
+                    pool = ConnectionPool(
+                        dict(primary, **settings),
+                        size=app.config.get('MYSQL_POOL_SIZE', 10),
+                        timeout=app.config.get('MYSQL_REPLICA_POOL_TIMEOUT', 1),
+                        recycle=app.config.get('MYSQL_POOL_RECYCLE', 3600),
+                        pre_ping=app.config.get('MYSQL_POOL_PRE_PING', True),
+                    )
+                    name = f"{settings.get('host', primary['host'])}:{settings.get('port', primary['port'])}"
+                    replicas.append(Replica(name, pool))
+                app.extensions['mysql_replicas'] = ReplicaSet(
+                    replicas,
+                    max_lag=app.config.get('MYSQL_REPLICA_MAX_LAG', 5),
+                    lag_check_interval=app.config.get('MYSQL_REPLICA_LAG_CHECK_INTERVAL', 1.0),
+                    retry_interval=app.config.get('MYSQL_REPLICA_RETRY_INTERVAL', 30),
+                ) if replicas else None
+    return app.extensions['mysql_replicas']
 
 def get_db():
     if 'db' not in g:
-        g.db = mysql.connector.connect(
-    host='localhost',
-    user='root',
-    password='123456',
-    database='movie_streaming'
-        )
+        started = time.perf_counter()
+        conn = get_pool().checkout()
+        # Instrumentation (see metrics.py) wraps the connection when enabled
+        wrap = current_app.extensions.get('db_wrapper')
+        g.db = wrap(conn, time.perf_counter() - started) if wrap else conn
     return g.db
 
+
+# Read routing. Reads go through get_read_db(), writes through get_db().
+# A read uses a replica only when all of these hold:
+#   - it runs in a GET/HEAD request (other methods, the CLI and background
+#     threads always use the primary);
+#   - this request has not used the primary yet, so reads that follow a write
+#     see it;
+#   - the client has not written in the last MYSQL_READ_YOUR_WRITES_SECONDS
+#     (mark_written() sets a cookie, so the page shown after a form's redirect
+#     includes the change even if the replicas are behind);
+#   - a replica is reachable and at most MYSQL_REPLICA_MAX_LAG seconds behind.
+# Otherwise the read uses the primary connection.
+
+READ_YOUR_WRITES_COOKIE = 'db_primary_until'
+
+def reads_pinned_to_primary():
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return True
+    if 'db' in g:
+        return True
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def get_read_db():
+    if 'read_db' in g and not reads_pinned_to_primary():
+        return g.read_db
+    replicas = get_replicas()
+    if replicas is None or g.get('read_routed'):
+        return get_db()
+    # First read of this request: pick the server once
+    g.read_routed = True
+    if reads_pinned_to_primary():
+        replicas.counters['primary_reads'] += 1
+        return get_db()
+    started = time.perf_counter()
+    checked_out = replicas.checkout()
+    if checked_out is None:
+        replicas.counters['fallbacks'] += 1
+        return get_db()
+    g.replica, conn = checked_out
+    wrap = current_app.extensions.get('db_wrapper')
+    g.read_db = wrap(conn, time.perf_counter() - started) if wrap else conn
+    return g.read_db
+
+def read_from_replica():
+    # True once this request has read from a replica
+    return has_request_context() and 'read_db' in g
+
+def is_replica(db):
+    return has_request_context() and db is not None and db is g.get('read_db')
+
+def replica_failed():
+    # A replica connection broke mid-request: discard it and read from the primary from now on
+    db = g.pop('read_db', None)
+    replica = g.pop('replica', None)
+    if db is not None:
+        replica.pool.checkin(getattr(db, 'wrapped', db), broken=True)
+        replicas = get_replicas()
+        replicas.counters['failovers'] += 1
+        replicas.mark_down(replica)
+
+def mark_written():
+    # Called after a committed write (see cache.invalidate)
+    if has_request_context():
+        g.db_written = True
+
+def _remember_writes(response):
+    if g.get('db_written') and get_replicas() is not None:
+        seconds = current_app.config.get('MYSQL_READ_YOUR_WRITES_SECONDS', 5)
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, f"{time.time() + seconds:.3f}",
+                            max_age=int(seconds) + 1, httponly=True, samesite='Lax')
+    return response
+
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().checkin(getattr(db, 'wrapped', db))
+    read_db = g.pop('read_db', None)
+    if read_db is not None:
+        g.pop('replica').pool.checkin(getattr(read_db, 'wrapped', read_db))
 
 def init_db(app):
     app.teardown_appcontext(close_db)
+    app.after_request(_remember_writes)
@@ -0,0 +1,190 @@
+# expiry.py
+#
+# Marks subscriptions whose end_Date has passed as Inactive, so the status
+# counts on /reports follow the end dates instead of manual edits.
+#
+# A run walks the (subscription_status, end_Date) index (`flask migrate`,
+# database/migrations/0003_subscriptions_status_end_date.sql) in batches: a
+# plain, non-locking SELECT finds up to SUBSCRIPTION_EXPIRY_BATCH_SIZE expired
+# ids, and an UPDATE by primary key flips them in its own short transaction.
+# Only the rows being flipped are locked, and the run is throttled to
+# SUBSCRIPTION_EXPIRY_MAX_ROWS_PER_SECOND.
+#
+# Runs come from cron (`flask expire-subscriptions`) or from the in-process
+# scheduler (SUBSCRIPTION_EXPIRY_INTERVAL > 0). A MySQL named lock keeps
+# several workers or hosts from running at the same time.
+
+import collections
+import datetime
+import threading
+import time
+
+import click
+from flask import current_app
+
+from .cache import invalidate
+from .db import get_db
+
+LOCK_NAME = 'movie_streaming.subscription_expiry'
+
+
+def expire_subscriptions(today=None, batch_size=None, max_rows_per_second=None, max_rows=None,
+                         pause=0.0, on_batch=None):
+    """Mark expired Active subscriptions Inactive in batches; returns the run's stats.
+
+    stats['locked'] is False, and nothing is done, when another run holds the lock.
+    """
+    config = current_app.config
+    today = today or datetime.date.today()
+    batch_size = batch_size or config['SUBSCRIPTION_EXPIRY_BATCH_SIZE']
+    if max_rows_per_second is None:
+        max_rows_per_second = config['SUBSCRIPTION_EXPIRY_MAX_ROWS_PER_SECOND']
+    if max_rows is None:
+        max_rows = config['SUBSCRIPTION_EXPIRY_MAX_ROWS']
+
+    stats = {'started_at': time.time(), 'today': today.isoformat(), 'locked': False,
+             'batches': 0, 'expired': 0, 'seconds': 0.0, 'rows_per_second': 0.0, 'complete': False}
+    db = get_db()
+    cursor = db.cursor()
+    started = time.monotonic()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (LOCK_NAME,))
+        if cursor.fetchone()[0] != 1:
+            return stats
+        stats['locked'] = True
+        try:
+            while True:
+                limit = batch_size if not max_rows else min(batch_size, max_rows - stats['expired'])
+                if limit <= 0:
+                    break
+                cursor.execute("""
+                    SELECT subscription_id
+                    FROM subscriptions
+                    WHERE subscription_status = 'Active' AND end_Date < %s
+                    ORDER BY end_Date
+                    LIMIT %s
+                """, (today, limit))
+                ids = [row[0] for row in cursor.fetchall()]
+                db.commit()     # end the read snapshot so the next batch sees the updates
+                if not ids:
+                    stats['complete'] = True
+                    break
+
+                # Throttle: wait until updating this batch keeps the run under the rate limit
+                wait = pause if stats['batches'] else 0.0
+                if max_rows_per_second:
+                    due = (stats['expired'] + len(ids)) / max_rows_per_second
+                    wait = max(wait, due - (time.monotonic() - started))
+                if wait > 0:
+                    time.sleep(wait)
+
+                # Conditions repeated so a row edited since the SELECT is left alone
+                cursor.execute(f"""
+                    UPDATE subscriptions
+                    SET subscription_status = 'Inactive'
+                    WHERE subscription_id IN ({', '.join(['%s'] * len(ids))})
+                      AND subscription_status = 'Active' AND end_Date < %s
+                """, (*ids, today))
+                stats['expired'] += cursor.rowcount
+                stats['batches'] += 1
+                db.commit()
+                if on_batch:
+                    on_batch(stats)
+                if len(ids) < limit:
+                    stats['complete'] = True
+                    break
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        if stats['seconds']:
+            stats['rows_per_second'] = round(stats['expired'] / stats['seconds'], 1)
+        if stats['expired']:
+            invalidate('subscriptions')
+    return stats
+
+
+class ExpiryScheduler:
+    # Runs expire_subscriptions every `interval` seconds on a daemon thread.
+    # Started by the first request of each process, so forked workers each get
+    # their own thread; the named lock lets only one of them work at a time.
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.runs = collections.deque(maxlen=20)   # stats of the most recent runs
+        self.errors = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='subscription-expiry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    stats = expire_subscriptions()
+                    if stats['locked']:
+                        self.runs.append(stats)
+                        if stats['expired']:
+                            self.app.logger.info("Expired %d subscriptions in %.1fs (%d batches)",
+                                                 stats['expired'], stats['seconds'], stats['batches'])
+                except Exception:
+                    # Whatever went wrong, keep the scheduler alive for the next run
+                    self.errors += 1
+                    self.app.logger.exception("Subscription expiry run failed")
+
+    def status(self):
+        return {
+            'interval': self.interval,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'errors': self.errors,
+            'runs': list(self.runs),
+        }
+
+
+def expiry_status():
+    scheduler = current_app.extensions.get('subscription_expiry')
+    return scheduler.status() if scheduler is not None else {'interval': 0, 'running': False, 'errors': 0, 'runs': []}
+
+
+@click.command('expire-subscriptions')
+@click.option('--batch-size', type=int, default=None, help='Subscriptions updated per transaction.')
+@click.option('--max-rate', type=float, default=None, help='Most subscriptions updated per second (0: no limit).')
+@click.option('--max-rows', type=int, default=None, help='Stop after this many subscriptions (0: no limit).')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def expire_command(batch_size, max_rate, max_rows, pause):
+    """Mark Active subscriptions whose end date has passed as Inactive (run it from cron)."""
+    stats = expire_subscriptions(
+        batch_size=batch_size, max_rows_per_second=max_rate, max_rows=max_rows, pause=pause,
+        on_batch=lambda s: click.echo(f"batch {s['batches']}: {s['expired']} expired so far"))
+    if not stats['locked']:
+        raise click.ClickException("Another expiry run is in progress")
+    click.echo(f"Expired {stats['expired']} subscriptions in {stats['seconds']}s "
+               f"({stats['batches']} batches, {stats['rows_per_second']} rows/s)"
+               + ("" if stats['complete'] else "; more remain, stopped at --max-rows"))
+
+def init_expiry(app):
+    app.cli.add_command(expire_command)
+    interval = app.config.get('SUBSCRIPTION_EXPIRY_INTERVAL', 0)
+    if interval > 0:
+        scheduler = ExpiryScheduler(app, interval)
+        app.extensions['subscription_expiry'] = scheduler
+        app.before_request(scheduler.start)
@@ -0,0 +1,203 @@
+# exporter.py
+#
+# Streaming CSV / NDJSON export of large tables for analytics jobs.
+# Rows are read through an unbuffered cursor (the server streams the result
+# set and the client fetches it in chunks) and written out through a
+# generator, so worker memory stays flat however large the table is.
+# Exports are ordered by primary key; ?after= / --after resumes an
+# interrupted export from the last key it delivered.
+
+import csv
+import datetime
+import decimal
+import io
+import json
+import zlib
+
+import click
+from mysql.connector import errors
+from flask import current_app
+
+from .db import get_read_db
+from .pagination import seek_condition, seek_params
+
+
+# Exportable columns per table; secrets (users.password, payments.card_no) are left out
+EXPORTS = {
+    'users': {
+        'key': ['userID'],
+        'columns': ['userID', 'userName', 'email', 'date_of_birth'],
+    },
+    'payments': {
+        'key': ['payment_id'],
+        'columns': ['payment_id', 'payment_amount', 'payment_date', 'payment_method', 'subscription_id'],
+    },
+    'ratings': {
+        'key': ['userID', 'movieid'],
+        'columns': ['userID', 'movieid', 'ratingScore', 'review', 'ratingDate'],
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_columns(table, requested):
+    # Validate a comma separated column list against the exportable columns
+    allowed = EXPORTS[table]['columns']
+    if not requested:
+        return list(allowed)
+    by_name = {c.lower(): c for c in allowed}
+    columns = []
+    for name in requested.split(','):
+        name = name.strip()
+        if name.lower() not in by_name:
+            raise ValueError(f"Unknown column for {table}: {name}; expected some of {', '.join(allowed)}")
+        columns.append(by_name[name.lower()])
+    return columns
+
+def parse_key(table, raw):
+    # "12" or, for ratings, "12,345" (userID,movieid)
+    if raw is None or raw == '':
+        return None
+    key = EXPORTS[table]['key']
+    try:
+        values = [int(v) for v in raw.split(',')]
+    except ValueError:
+        raise ValueError(f"Key for {table} must be {len(key)} integer(s): {','.join(key)}") from None
+    if len(values) != len(key):
+        raise ValueError(f"Key for {table} must be {len(key)} integer(s): {','.join(key)}")
+    return values
+
+
+def stream_rows(table, columns, after=None, upto=None):
+    # Yields row tuples in primary key order, between after (exclusive) and upto (inclusive)
+    key = EXPORTS[table]['key']
+    fetch_size = current_app.config.get('EXPORT_FETCH_SIZE', 5000)
+
+    conditions, params = [], []
+    if after is not None:
+        conditions.append(seek_condition(key, '>'))
+        params.extend(seek_params(after))
+    if upto is not None:
+        conditions.append(seek_condition(key, '<', inclusive=True))
+        params.extend(seek_params(upto))
+
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(key)
+
+    db = get_read_db()
+    cursor = db.cursor(buffered=False)
+    # A slow client must not make the server give up on the result set. The
+    # connection goes back to the pool afterwards, so the old value is restored.
+    cursor.execute("SELECT @@SESSION.net_write_timeout")
+    previous_timeout = cursor.fetchall()[0][0]
+    cursor.execute("SET SESSION net_write_timeout = %s", (current_app.config.get('EXPORT_NET_WRITE_TIMEOUT', 600),))
+    finished = False
+    try:
+        cursor.execute(sql, tuple(params))
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+        finished = True
+    finally:
+        if finished:
+            cursor.close()
+            cursor = db.cursor()
+            cursor.execute("SET SESSION net_write_timeout = %s", (previous_timeout,))
+            cursor.close()
+        else:
+            # Abandoned mid-stream: drop the connection rather than draining the rest
+            # of the result set. The pool discards it when it is checked back in.
+            try:
+                db.close()
+            except errors.Error:
+                pass
+
+
+def plain_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', 'replace')
+    return value
+
+def render_csv(columns, rows, chunk_rows=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(['' if v is None else plain_value(v) for v in row])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+def render_ndjson(columns, rows, chunk_rows=1000):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({c: plain_value(v) for c, v in zip(columns, row)}, separators=(',', ':')))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(table, fmt='csv', columns=None, after=None, upto=None, compress=False):
+    """Return a generator of output chunks (str, or bytes when compressed).
+
+    Raises ValueError for an unknown table, format, column or malformed key.
+    """
+    if table not in EXPORTS:
+        raise ValueError(f"Cannot export {table}; expected one of {', '.join(EXPORTS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}; expected one of {', '.join(FORMATS)}")
+    columns = parse_columns(table, columns)
+    after, upto = parse_key(table, after), parse_key(table, upto)
+
+    render = render_csv if fmt == 'csv' else render_ndjson
+    chunks = render(columns, stream_rows(table, columns, after, upto))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+@click.command('export-table')
+@click.argument('table')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv')
+@click.option('--columns', default=None, help='Comma separated columns (default: all exportable).')
+@click.option('--after', default=None, help='Resume after this primary key (e.g. 42 or 42,7 for ratings).')
+@click.option('--upto', default=None, help='Stop at this primary key (inclusive).')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default='-', help='Output file (default: stdout).')
+def export_command(table, fmt, columns, after, upto, compress, output):
+    """Stream TABLE (users, payments or ratings) as CSV or NDJSON."""
+    try:
+        chunks = export(table, fmt, columns, after, upto, compress)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    with click.open_file(output, 'wb' if compress else 'w') as out:
+        for chunk in chunks:
+            out.write(chunk)
+
+def init_exporter(app):
+    app.cli.add_command(export_command)
@@ -0,0 +1,378 @@
+# facets.py
+#
+# Genre-faceted browsing of /movies (?genre=, ?match=all|any, ?year=, ?min_rating=).
+#
+# FacetIndex keeps, per process, one bitmap of movieids per genre and per
+# release year (Python ints: bit n is movie n, so 50k movies take about 6 KB
+# per bitmap) and the rated movies sorted by average rating. Filters are then
+# set operations instead of joins: several genres are the AND (match=all) or
+# OR (match=any) of their bitmaps, a year range the OR of its years, and
+# min_rating a suffix of the rating order; facet counts are popcounts. Only
+# the movies on the page are read from the database, by primary key.
+#
+# The index is built from movies, movie_genre and movie_rating_stats on first
+# use. The movie and genre write routes update it in place, so this process
+# sees its own changes at once. Changes made elsewhere (other workers, imports,
+# SQL) are picked up by a rebuild when table_versions shows that movies or
+# movie_genre changed, checked at most every FACET_REFRESH_INTERVAL seconds.
+# Ratings change all the time, so average ratings are reloaded at most every
+# FACET_RATING_REFRESH_INTERVAL seconds.
+
+import bisect
+import datetime
+import operator
+import threading
+import time
+from functools import reduce
+
+from flask import current_app
+from mysql.connector import errors
+
+from .pagination import Page, decode_cursor, encode_cursor
+from .queries import fetch_all, fetch_tuples, in_list, register
+
+MATCH_MODES = ('all', 'any')
+
+# The index loads whole tables by design (see plancheck.EXPECTED)
+register('facet_movies', "SELECT movieid, YEAR(release_date) FROM movies")
+register('facet_genres', "SELECT movieid, movie_genre FROM movie_genre")
+register('facet_ratings', "SELECT movieid, avg_rating FROM movie_rating_stats WHERE avg_rating IS NOT NULL")
+# The movies on a page, by primary key (an IN list appended, see plancheck.py)
+MOVIES_SQL = "SELECT movieid, title, release_date, duration, description FROM movies WHERE "
+
+
+def bitmap(ids):
+    """An int with bit n set for each n in ids, built in one pass."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+def ids_after(bits, after, limit):
+    """Up to limit set bits above `after`, ascending."""
+    ids = []
+    rest = bits >> (after + 1) if after >= 0 else bits
+    base = max(after + 1, 0)
+    while rest and len(ids) < limit:
+        low = rest & -rest
+        position = low.bit_length() - 1
+        ids.append(base + position)
+        rest ^= low
+    return ids
+
+def ids_before(bits, before, limit):
+    """Up to limit set bits below `before`, descending."""
+    ids = []
+    # No bit is above bits.bit_length(), so a larger `before` (from a client's cursor) changes nothing
+    rest = bits & ((1 << min(max(before, 0), bits.bit_length())) - 1)
+    while rest and len(ids) < limit:
+        position = rest.bit_length() - 1
+        ids.append(position)
+        rest ^= 1 << position
+    return ids
+
+
+def _year(value):
+    # release_date as stored (date) or as typed in a form ('YYYY-MM-DD')
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.year
+    try:
+        return int(str(value)[:4])
+    except (TypeError, ValueError):
+        return None
+
+
+class FacetIndex:
+    def __init__(self, refresh_interval=30, rating_refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self.rating_refresh_interval = rating_refresh_interval
+
+        self.movies = 0            # bitmap of every movie
+        self.genres = {}           # genre -> bitmap
+        self.years = {}            # release year -> bitmap
+        self._ratings = ([], [])   # (average ratings ascending, movieids in the same order)
+        self._at_least = {}        # min_rating -> bitmap, until the ratings are reloaded
+
+        self._lock = threading.Lock()           # guards the bitmaps while they change
+        self._refresh_lock = threading.Lock()   # one rebuild at a time
+        self._changes = 0          # in-place updates, so a rebuild that raced one is redone
+        self.versions = None       # movies and movie_genre versions the bitmaps were built from
+        self.built_at = None
+        self.checked_at = None
+        self.ratings_at = None
+        self.counters = {'builds': 0, 'rating_loads': 0, 'updates': 0, 'queries': 0}
+
+    # Loading
+
+    def refresh(self, versions_store=None):
+        """Build or rebuild what is out of date; serves the current bitmaps while another thread does."""
+        now = time.monotonic()
+        movies_due = self.built_at is None or now - self.checked_at >= self.refresh_interval
+        ratings_due = self.ratings_at is None or now - self.ratings_at >= self.rating_refresh_interval
+        if not (movies_due or ratings_due):
+            return
+        if not self._refresh_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if movies_due:
+                self.checked_at = time.monotonic()
+                versions = None
+                if versions_store is not None:
+                    try:
+                        found = versions_store.get(['movies', 'movie_genre'])
+                        versions = [v for v, _ in found] if found is not None else None
+                    except errors.Error:
+                        current_app.logger.exception("Could not read table versions; rebuilding the facet index")
+                if self.built_at is None or versions is None or versions != self.versions:
+                    self._load_movies(versions)
+            if ratings_due:
+                self._load_ratings()
+        finally:
+            self._refresh_lock.release()
+
+    def _load_movies(self, versions):
+        changes = self._changes
+        years = {}
+        movie_ids = []
+        for movieid, year in fetch_tuples('facet_movies'):
+            movie_ids.append(movieid)
+            if year is not None:
+                years.setdefault(year, []).append(movieid)
+        genres = {}
+        for movieid, genre in fetch_tuples('facet_genres'):
+            genres.setdefault(genre, []).append(movieid)
+
+        movies = bitmap(movie_ids)
+        years = {year: bitmap(ids) for year, ids in years.items()}
+        genres = {genre: bitmap(ids) for genre, ids in genres.items()}
+        with self._lock:
+            self.movies, self.years, self.genres = movies, years, genres
+            # An update applied while the tables were being read may be missing: rebuild next time
+            self.versions = versions if self._changes == changes else None
+            self.built_at = time.monotonic()
+            self.counters['builds'] += 1
+
+    def _load_ratings(self):
+        rated = sorted((float(avg), movieid) for movieid, avg in fetch_tuples('facet_ratings'))
+        with self._lock:
+            self._ratings = ([avg for avg, _ in rated], [movieid for _, movieid in rated])
+            self._at_least = {}
+            self.ratings_at = time.monotonic()
+            self.counters['rating_loads'] += 1
+
+    # In-place updates from the write routes (after their commit)
+
+    def _update(self, change):
+        with self._lock:
+            if self.built_at is None:
+                return      # built from the database on first use
+            change()
+            self._changes += 1
+            self.counters['updates'] += 1
+
+    def movie_saved(self, movieid, release_date):
+        def change():
+            bit = 1 << movieid
+            self.movies |= bit
+            for year, bits in list(self.years.items()):
+                if bits & bit:
+                    self._set(self.years, year, bits & ~bit)
+            year = _year(release_date)
+            if year is not None:
+                self.years[year] = self.years.get(year, 0) | bit
+        self._update(change)
+
+    def movie_deleted(self, movieid):
+        def change():
+            bit = 1 << movieid
+            self.movies &= ~bit
+            for facet in (self.years, self.genres):
+                for key, bits in list(facet.items()):
+                    if bits & bit:
+                        self._set(facet, key, bits & ~bit)
+        self._update(change)
+
+    def genre_added(self, movieid, genre):
+        def change():
+            self.genres[genre] = self.genres.get(genre, 0) | (1 << movieid)
+        self._update(change)
+
+    def genre_removed(self, movieid, genre):
+        def change():
+            self._set(self.genres, genre, self.genres.get(genre, 0) & ~(1 << movieid))
+        self._update(change)
+
+    @staticmethod
+    def _set(facet, key, bits):
+        if bits:
+            facet[key] = bits
+        else:
+            facet.pop(key, None)
+
+    # Queries
+
+    def _at_least_rating(self, min_rating):
+        # Called with the lock held
+        bits = self._at_least.get(min_rating)
+        if bits is None:
+            averages, movie_ids = self._ratings
+            bits = bitmap(movie_ids[bisect.bisect_left(averages, min_rating):])
+            if len(self._at_least) >= 64:
+                self._at_least.clear()
+            self._at_least[min_rating] = bits
+        return bits
+
+    def select(self, genres=(), match='all', years=None, min_rating=None):
+        """(matching movies, movies matching every filter but the genres), as bitmaps."""
+        with self._lock:
+            self.counters['queries'] += 1
+            base = self.movies
+            if years is not None:
+                first, last = years
+                base &= reduce(operator.or_, (bits for year, bits in self.years.items() if first <= year <= last), 0)
+            if min_rating is not None:
+                base &= self._at_least_rating(min_rating)
+            if not genres:
+                return base, base
+            maps = [self.genres.get(genre, 0) for genre in genres]
+        combined = reduce(operator.and_ if match == 'all' else operator.or_, maps)
+        return base & combined, base
+
+    def genre_counts(self, result, base, match='all'):
+        """[(genre, count)]: for match=all the results that also have the genre
+        (what adding it leaves), for match=any the movies it brings within the other filters."""
+        within = result if match == 'all' else base
+        with self._lock:
+            genres = dict(self.genres)
+        return [(genre, (within & genres[genre]).bit_count()) for genre in sorted(genres, key=str.casefold)]
+
+    def stats(self):
+        with self._lock:
+            maps = [self.movies] + list(self.genres.values()) + list(self.years.values())
+            return dict(
+                self.counters,
+                movies=self.movies.bit_count(),
+                genres=len(self.genres),
+                years=len(self.years),
+                rated_movies=len(self._ratings[1]),
+                bitmap_bytes=sum((bits.bit_length() + 7) // 8 for bits in maps),
+                built_seconds_ago=round(time.monotonic() - self.built_at, 1) if self.built_at else None,
+            )
+
+
+def get_facet_index():
+    app = current_app._get_current_object()
+    index = app.extensions['facet_index']
+    index.refresh(app.extensions.get('table_versions'))
+    return index
+
+def _updated(method, *args):
+    # Called by the write routes; the index ignores updates until it is first built
+    index = current_app.extensions.get('facet_index')
+    if index is not None:
+        getattr(index, method)(*args)
+
+def movie_saved(movieid, release_date):
+    _updated('movie_saved', movieid, release_date)
+
+def movie_deleted(movieid):
+    _updated('movie_deleted', movieid)
+
+def genre_added(movieid, genre):
+    _updated('genre_added', movieid, genre)
+
+def genre_removed(movieid, genre):
+    _updated('genre_removed', movieid, genre)
+
+
+def parse_filters(args):
+    """{genres, match, years, min_rating} from the query string; None without filters.
+
+    Raises ValueError for a malformed year, range or rating.
+    """
+    genres = [g.strip() for value in args.getlist('genre') for g in value.split(',') if g.strip()]
+    year = (args.get('year') or '').strip()
+    min_rating = (args.get('min_rating') or '').strip()
+    if not (genres or year or min_rating):
+        return None
+    match = args.get('match', 'all')
+    if match not in MATCH_MODES:
+        raise ValueError(f"match must be one of {', '.join(MATCH_MODES)}")
+    years = None
+    if year:
+        first, _, last = year.partition('-')
+        try:
+            years = (int(first), int(last or first))
+        except ValueError:
+            raise ValueError("year must be a year or a range like 1990-1999") from None
+    rating = None
+    if min_rating:
+        try:
+            rating = float(min_rating)
+        except ValueError:
+            raise ValueError("min_rating must be a number") from None
+        # nan compares false with every rating, so it would quietly match nothing
+        if not 0 <= rating <= 5:
+            raise ValueError("min_rating must be between 0 and 5")
+    return {'genres': genres, 'match': match, 'years': years, 'min_rating': rating}
+
+
+def browse_movies(filters, token=None, limit=50):
+    """(Page of movies ordered by movieid, [(genre, count)], total) for the filters."""
+    index = get_facet_index()
+    # Genres are matched like MySQL compares them, without regard to case
+    names = {name.casefold(): name for name in list(index.genres)}
+    genres = [names.get(g.casefold(), g) for g in filters['genres']]
+    result, base = index.select(genres, filters['match'], filters['years'], filters['min_rating'])
+
+    position = decode_cursor(token)
+    # Cursors come from the client: anything but one non-negative movieid starts over
+    if position is not None and (len(position[1]) != 1 or type(position[1][0]) is not int or position[1][0] < 0):
+        position = None
+    backwards = position is not None and position[0] == 'prev'
+    if backwards:
+        ids = ids_before(result, position[1][0], limit + 1)
+    else:
+        ids = ids_after(result, position[1][0] if position else -1, limit + 1)
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    if backwards:
+        ids.reverse()
+
+    rows = []
+    if ids:
+        where, params = in_list('movieid', ids)
+        by_id = {row.movieid: row for row in _fetch_movies(where, params)}
+        rows = [by_id[i] for i in ids if i in by_id]
+
+    next_cursor = prev_cursor = None
+    if ids:
+        if backwards:
+            next_cursor = encode_cursor('next', [ids[-1]])
+            if has_more:
+                prev_cursor = encode_cursor('prev', [ids[0]])
+        else:
+            if has_more:
+                next_cursor = encode_cursor('next', [ids[-1]])
+            if position is not None:
+                prev_cursor = encode_cursor('prev', [ids[0]])
+    page = Page(rows, next_cursor, prev_cursor, limit)
+    return page, index.genre_counts(result, base, filters['match']), result.bit_count()
+
+def _fetch_movies(where, params):
+    return fetch_all(MOVIES_SQL + where, params)
+
+
+def facet_stats():
+    index = current_app.extensions.get('facet_index')
+    return index.stats() if index is not None else {}
+
+
+def init_facets(app):
+    app.extensions['facet_index'] = FacetIndex(
+        refresh_interval=app.config.get('FACET_REFRESH_INTERVAL', 30),
+        rating_refresh_interval=app.config.get('FACET_RATING_REFRESH_INTERVAL', 60),
+    )
@@ -0,0 +1,318 @@
+# importer.py
+#
+# Streaming CSV import for users, movies, subscriptions, payments and ratings.
+# Files are read row by row, validated against the column definitions in
+# database/*.sql and inserted in batches with executemany(), one transaction
+# per batch, so memory use depends on the batch size and not on the file size.
+#
+# Card numbers are inserted in plain text on purpose: the encrypt_cardno
+# trigger on payments encrypts them per row, exactly as for add_payment.
+
+import csv
+import datetime
+import io
+import time
+
+import click
+import mysql.connector
+from flask import current_app
+from mysql.connector import errors
+
+from .cache import invalidate
+from .db import get_db
+
+
+class Column:
+    def __init__(self, name, kind, required=False, max_length=None, choices=None,
+                 minimum=None, maximum=None, references=None):
+        self.name = name
+        self.kind = kind                # 'int', 'float', 'date', 'str' or 'enum'
+        self.required = required
+        self.max_length = max_length
+        self.choices = choices
+        self.minimum = minimum
+        self.maximum = maximum
+        self.references = references    # (table, column) of a foreign key
+
+    def parse(self, raw):
+        value = raw.strip() if raw is not None else ''
+        if value == '':
+            if self.required:
+                raise ValueError(f"{self.name} is required")
+            return None
+        try:
+            if self.kind == 'int':
+                value = int(value)
+            elif self.kind == 'float':
+                value = float(value)
+            elif self.kind == 'date':
+                value = datetime.date.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"{self.name} is not a valid {self.kind}: {value!r}") from None
+        if self.kind == 'enum':
+            matches = [c for c in self.choices if c.lower() == value.lower()]
+            if not matches:
+                raise ValueError(f"{self.name} must be one of {', '.join(self.choices)}")
+            value = matches[0]
+        elif self.max_length is not None and len(value) > self.max_length:
+            raise ValueError(f"{self.name} is longer than {self.max_length} characters")
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"{self.name} must be at least {self.minimum}")
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(f"{self.name} must be at most {self.maximum}")
+        return value
+
+
+# Column definitions mirror the CREATE TABLE statements in database/
+SCHEMAS = {
+    'users': [
+        Column('userID', 'int', minimum=1),
+        Column('userName', 'str', required=True, max_length=255),
+        Column('email', 'str', required=True, max_length=255),
+        Column('password', 'str', required=True, max_length=64),
+        Column('date_of_birth', 'date'),
+    ],
+    'movies': [
+        Column('movieid', 'int', minimum=1),
+        Column('title', 'str', max_length=255),
+        Column('release_date', 'date'),
+        Column('duration', 'str', max_length=20),
+        Column('description', 'str', max_length=255),
+    ],
+    'subscriptions': [
+        Column('subscription_id', 'int', minimum=1),
+        Column('userID', 'int', references=('users', 'userID')),
+        Column('startdate', 'date'),
+        Column('end_Date', 'date'),
+        Column('subscription_status', 'enum', choices=('Active', 'Inactive')),
+    ],
+    'payments': [
+        Column('payment_id', 'int', minimum=1),
+        Column('payment_amount', 'int'),
+        Column('card_no', 'str', max_length=64),
+        Column('payment_date', 'date'),
+        Column('payment_method', 'enum', choices=('VISA', 'MASTERCARD')),
+        Column('subscription_id', 'int', references=('subscriptions', 'subscription_id')),
+    ],
+    'ratings': [
+        Column('userID', 'int', required=True, references=('users', 'userID')),
+        Column('movieid', 'int', required=True, references=('movies', 'movieid')),
+        Column('ratingScore', 'float', minimum=0.0, maximum=5.0),
+        Column('review', 'str', max_length=255),
+        Column('ratingDate', 'date'),
+    ],
+}
+
+# Parents before children, so a multi-file import satisfies the foreign keys
+IMPORT_ORDER = ['users', 'movies', 'subscriptions', 'payments', 'ratings']
+
+
+class ImportReport:
+    def __init__(self, table, max_rejects=100):
+        self.table = table
+        self.max_rejects = max_rejects
+        self.rows_read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.rejects = []       # first max_rejects (line, reason) pairs
+        self.batches = []       # per-batch {'rows', 'inserted', 'seconds', 'rows_per_second'}
+        self.seconds = 0.0
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append({'line': line, 'reason': reason})
+
+    def as_dict(self):
+        return {
+            'table': self.table,
+            'rows_read': self.rows_read,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'rejects': self.rejects,
+            'batches': self.batches,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.inserted / self.seconds, 1) if self.seconds else None,
+        }
+
+
+def _columns_for(table, header):
+    # Map CSV headers (case-insensitive) onto the table's columns
+    by_name = {c.name.lower(): c for c in SCHEMAS[table]}
+    unknown = [h for h in header if h.strip().lower() not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown column(s) for {table}: {', '.join(unknown)}")
+    columns = [by_name[h.strip().lower()] for h in header]
+    missing = [c.name for c in SCHEMAS[table] if c.required and c not in columns]
+    if missing:
+        raise ValueError(f"Missing required column(s) for {table}: {', '.join(missing)}")
+    return columns
+
+
+def _missing_parents(cursor, columns, rows):
+    # Returns {(column index, value)} for foreign key values with no parent row.
+    # One indexed IN lookup per referenced table per batch.
+    missing = set()
+    for i, column in enumerate(columns):
+        if column.references is None:
+            continue
+        wanted = {row[i] for _, row in rows if row[i] is not None}
+        if not wanted:
+            continue
+        table, key = column.references
+        placeholders = ", ".join(["%s"] * len(wanted))
+        cursor.execute(f"SELECT {key} FROM {table} WHERE {key} IN ({placeholders})", tuple(wanted))
+        found = {r[0] for r in cursor.fetchall()}
+        missing.update((i, value) for value in wanted - found)
+    return missing
+
+
+def _flush(db, table, columns, rows, report):
+    started = time.perf_counter()
+    cursor = db.cursor()
+    missing = _missing_parents(cursor, columns, rows)
+    valid = []
+    for line, row in rows:
+        bad = [columns[i].name for i, value in enumerate(row) if (i, value) in missing]
+        if bad:
+            report.reject(line, f"no parent row for {', '.join(bad)}")
+        else:
+            valid.append((line, row))
+
+    names = ", ".join(c.name for c in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    sql = f"INSERT INTO {table} ({names}) VALUES ({placeholders})"
+
+    inserted = 0
+    try:
+        try:
+            if valid:
+                cursor.executemany(sql, [row for _, row in valid])
+            db.commit()
+            inserted = len(valid)
+        except (errors.IntegrityError, errors.DataError):
+            # Something in the batch was refused (duplicate key, concurrent delete of a
+            # parent, value out of range, ...). Retry the rows one at a time to find and
+            # report the culprits; InnoDB only rolls back the failing statement, not the
+            # transaction, for these errors.
+            db.rollback()
+            for line, row in valid:
+                try:
+                    cursor.execute(sql, row)
+                    inserted += 1
+                except (errors.IntegrityError, errors.DataError) as e:
+                    report.reject(line, e.msg)
+            db.commit()
+    except mysql.connector.Error:
+        # A deadlock, lock wait timeout or lost connection rolls back the whole
+        # transaction, so none of this batch is in: fail the import rather than
+        # count rows that are not there (earlier batches stay committed)
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    seconds = time.perf_counter() - started
+    report.inserted += inserted
+    report.batches.append({
+        'rows': len(rows),
+        'inserted': inserted,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(inserted / seconds, 1) if seconds else None,
+    })
+    return report.batches[-1]
+
+
+def import_csv(table, stream, batch_size=None, on_batch=None):
+    """Import a CSV text stream into ``table`` and return an ImportReport.
+
+    The first line must be a header naming the table's columns. ``on_batch``
+    is called with each batch's statistics as soon as it is committed.
+    """
+    if table not in SCHEMAS:
+        raise ValueError(f"Cannot import into {table}; expected one of {', '.join(IMPORT_ORDER)}")
+    batch_size = batch_size or current_app.config.get('IMPORT_BATCH_SIZE', 1000)
+    report = ImportReport(table, current_app.config.get('IMPORT_MAX_REJECTS_REPORTED', 100))
+    started = time.perf_counter()
+
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return report
+    columns = _columns_for(table, header)
+
+    db = get_db()
+    batch = []
+    for row in reader:
+        report.rows_read += 1
+        line = reader.line_num
+        if not any(field.strip() for field in row):
+            continue
+        if len(row) != len(columns):
+            report.reject(line, f"expected {len(columns)} fields, found {len(row)}")
+            continue
+        try:
+            batch.append((line, tuple(c.parse(v) for c, v in zip(columns, row))))
+        except ValueError as e:
+            report.reject(line, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            stats = _flush(db, table, columns, batch, report)
+            batch = []
+            if on_batch:
+                on_batch(stats)
+
+    if batch:
+        stats = _flush(db, table, columns, batch, report)
+        if on_batch:
+            on_batch(stats)
+
+    report.seconds = time.perf_counter() - started
+    invalidate(table)
+    return report
+
+
+def open_upload(file_storage):
+    # Text view over an uploaded file; werkzeug spools large uploads to disk
+    return io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+
+
+@click.command('import-csv')
+@click.argument('sources', nargs=-1, required=True)
+@click.option('--batch-size', type=int, default=None, help='Rows per INSERT transaction.')
+def import_command(sources, batch_size):
+    """Import CSV files given as TABLE=PATH (e.g. users=users.csv ratings=ratings.csv).
+
+    Files are imported parents first, whatever order they are given in.
+    """
+    jobs = []
+    for source in sources:
+        table, sep, path = source.partition('=')
+        if not sep or table not in SCHEMAS:
+            raise click.BadParameter(f"{source!r} should be TABLE=PATH with TABLE one of {', '.join(IMPORT_ORDER)}")
+        jobs.append((IMPORT_ORDER.index(table), table, path))
+
+    for _, table, path in sorted(jobs):
+        click.echo(f"Importing {path} into {table}")
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            try:
+                report = import_csv(
+                    table, f, batch_size,
+                    on_batch=lambda b: click.echo(
+                        f"  batch: {b['inserted']}/{b['rows']} rows in {b['seconds']}s ({b['rows_per_second']} rows/s)"
+                    )
+                )
+            except ValueError as e:
+                # A header the table cannot take (unknown or missing columns)
+                raise click.ClickException(f"{path}: {e}") from e
+        for reject in report.rejects:
+            click.echo(f"  rejected line {reject['line']}: {reject['reason']}")
+        summary = report.as_dict()
+        click.echo(
+            f"  {summary['inserted']} inserted, {summary['rejected']} rejected "
+            f"in {summary['seconds']}s ({summary['rows_per_second']} rows/s)"
+        )
+
+def init_importer(app):
+    app.cli.add_command(import_command)
@@ -0,0 +1,390 @@
+# ingest.py
+#
+# Write-behind ingestion for rating submissions (RATING_INGEST_MODE = 'buffered').
+#
+# add_rating and edit_rating hand the rating to a bounded in-process queue
+# and redirect at once. A background writer takes up to
+# RATING_INGEST_BATCH_SIZE ratings at a time, when that many are waiting or
+# RATING_INGEST_FLUSH_INTERVAL seconds after the oldest arrived, and writes
+# them in one transaction: new ratings with a multi-row INSERT, edits with a
+# multi-row INSERT ... ON DUPLICATE KEY UPDATE. An edit of a rating that is
+# still waiting replaces the queued values (the last one wins, and a queued
+# new rating stays an INSERT), so a user changing a rating several times costs
+# one row write.
+#
+# Adding keeps its synchronous meaning: a rating whose user or movie does not
+# exist, or that already exists (in the table or in the queue), is refused
+# with 400 before it is queued. What the database still refuses at write time
+# (a rating added by another process in the meantime, a parent deleted since)
+# is dropped, logged and counted as 'dropped' on /reports/ingest.
+#
+# Backpressure: the queue holds at most RATING_INGEST_QUEUE_SIZE ratings. A
+# submission waits up to RATING_INGEST_ENQUEUE_TIMEOUT seconds for room and
+# then gets 503 with Retry-After.
+#
+# Queued ratings live only in this process until flushed. The queue is drained
+# when the process exits normally (atexit) or when stop() is called, e.g. by a
+# server's worker shutdown hook. Ratings are written synchronously, as before,
+# in 'sync' mode, outside a request and after the writer has been stopped.
+
+import atexit
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import click
+from flask import current_app, has_request_context
+from mysql.connector import errors
+
+from .cache import invalidate
+from .db import get_db
+from .queries import fetch_tuples, register
+
+
+class RatingQueueFull(Exception):
+    pass
+
+class InvalidRating(ValueError):
+    pass
+
+
+register('rating_add_check', """
+    SELECT EXISTS (SELECT 1 FROM users WHERE userID = %s),
+           EXISTS (SELECT 1 FROM movies WHERE movieid = %s),
+           EXISTS (SELECT 1 FROM ratings WHERE userID = %s AND movieid = %s)
+""")
+
+# Lock wait timeout and deadlock: the batch is fine, try it again later
+_RETRYABLE_ERRNOS = {1205, 1213}
+
+def _row_rejected(e):
+    """Whether the database refused the data itself (constraint, CHECK, bad value, ...)
+    rather than failing to run the statement (connection lost, lock timeout, ...)."""
+    return (isinstance(e, errors.DatabaseError)
+            and not isinstance(e, (errors.OperationalError, errors.InterfaceError))
+            and e.errno not in _RETRYABLE_ERRNOS)
+
+
+class RatingWriter:
+    def __init__(self, app, max_queue=10000, batch_size=500, flush_interval=0.2,
+                 enqueue_timeout=0.5, retry_interval=1.0):
+        self.app = app
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retry_interval = retry_interval
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # (userID, movieid) -> (ratingScore, review, ratingDate, insert), oldest first
+        self._oldest_at = None          # monotonic time the oldest pending rating arrived
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.stopped = False
+        self.counters = {'submitted': 0, 'coalesced': 0, 'rejected_full': 0, 'written': 0,
+                         'batches': 0, 'failed_batches': 0, 'dropped': 0}
+
+    # Request side
+
+    def submit(self, user_id, movie_id, score, review, rating_date, insert=False):
+        """Queue a rating; False if the caller should write it itself (writer stopped).
+
+        insert=True adds a new rating (refused if one is already queued),
+        otherwise the rating is written whether or not the row exists.
+        """
+        key = (int(user_id), int(movie_id))
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._cond:
+            if self.stopped:
+                return False
+            self._ensure_started()
+            if key in self._pending:
+                if insert:
+                    raise InvalidRating(f"User {key[0]} has already rated movie {key[1]}")
+                self._pending[key] = (score, review, rating_date, self._pending[key][3])
+                self.counters['submitted'] += 1
+                self.counters['coalesced'] += 1
+                return True
+            while len(self._pending) >= self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['rejected_full'] += 1
+                    raise RatingQueueFull()
+                self._cond.wait(remaining)
+                if self.stopped:
+                    return False
+            first = not self._pending
+            if first:
+                self._oldest_at = time.monotonic()
+            self._pending[key] = (score, review, rating_date, insert)
+            self.counters['submitted'] += 1
+            if first or len(self._pending) >= self.batch_size:
+                # Wake the writer to start the flush timer, or to write a full batch
+                self._cond.notify_all()
+        return True
+
+    def _ensure_started(self):
+        # Called with the lock held. A forked worker does not inherit the
+        # parent's thread (or its queue), so each process starts its own.
+        if self._pid != os.getpid():
+            self._pending.clear()
+            self._oldest_at = None
+            self._thread = None
+            self._pid = os.getpid()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='rating-writer', daemon=True)
+            self._thread.start()
+
+    # Writer side
+
+    def _take_batch(self):
+        # Waits until a batch is due; returns [] only when stopping with nothing left
+        with self._cond:
+            while True:
+                if len(self._pending) >= self.batch_size or (self._stopping and self._pending):
+                    break
+                if self._stopping:
+                    return []
+                if self._pending:
+                    wait = self._oldest_at + self.flush_interval - time.monotonic()
+                    if wait <= 0:
+                        break
+                else:
+                    wait = None
+                self._cond.wait(wait)
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                key, values = self._pending.popitem(last=False)
+                batch.append(key + values)
+            self._oldest_at = time.monotonic() if self._pending else None
+            self._cond.notify_all()     # room for blocked submitters
+            return batch
+
+    def _requeue(self, batch):
+        # Put a failed batch back in front, without overwriting newer submissions
+        with self._cond:
+            newer = self._pending
+            self._pending = OrderedDict(
+                ((user_id, movie_id), tuple(values)) for user_id, movie_id, *values in batch
+                if (user_id, movie_id) not in newer
+            )
+            self._pending.update(newer)
+            self._oldest_at = time.monotonic()
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            with self.app.app_context():
+                try:
+                    self.write(batch)
+                except errors.Error:
+                    # Database unreachable, lock timeout, ...: keep the ratings and try again shortly
+                    self.counters['failed_batches'] += 1
+                    self.app.logger.exception("Rating batch of %d failed; retrying in %ss",
+                                              len(batch), self.retry_interval)
+                    self._requeue(batch)
+                    if self._stopping:
+                        return
+                    time.sleep(self.retry_interval)
+
+    def write(self, batch):
+        db = get_db()
+        cursor = db.cursor()
+        try:
+            try:
+                for sql, rows in ((_insert_sql, [row[:5] for row in batch if row[5]]),
+                                  (_upsert_sql, [row[:5] for row in batch if not row[5]])):
+                    if rows:
+                        cursor.execute(sql(len(rows)), [value for row in rows for value in row])
+                db.commit()
+                written = len(batch)
+            except errors.DatabaseError as e:
+                if not _row_rejected(e):
+                    raise
+                # A rating was refused (unknown user or movie, a new rating that
+                # exists by now, score outside the CHECK, bad value, ...). Retry
+                # one at a time so only the culprits are dropped.
+                db.rollback()
+                written = 0
+                for row in batch:
+                    try:
+                        cursor.execute((_insert_sql if row[5] else _upsert_sql)(1), row[:5])
+                        written += 1
+                    except errors.DatabaseError as e:
+                        if not _row_rejected(e):
+                            raise
+                        self.counters['dropped'] += 1
+                        self.app.logger.warning("Dropped rating userID=%s movieid=%s: %s", row[0], row[1], e.msg)
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.counters['written'] += written
+        self.counters['batches'] += 1
+        if written:
+            invalidate('ratings')
+
+    def stop(self, timeout=30):
+        """Stop taking ratings and write everything still queued."""
+        with self._cond:
+            if self.stopped:
+                return
+            self.stopped = True
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        # Anything left (no thread in this process, or it gave up on the database)
+        # gets one last synchronous attempt
+        with self._cond:
+            remaining = [key + values for key, values in self._pending.items()]
+            self._pending.clear()
+        with self.app.app_context():
+            for start in range(0, len(remaining), self.batch_size):
+                try:
+                    self.write(remaining[start:start + self.batch_size])
+                except errors.Error:
+                    self.counters['dropped'] += len(remaining) - start
+                    self.app.logger.exception("Could not flush %d queued ratings", len(remaining) - start)
+                    break
+
+    def status(self):
+        with self._cond:
+            queued = len(self._pending)
+            oldest = time.monotonic() - self._oldest_at if self._oldest_at is not None else None
+        return dict(self.counters, mode='buffered', queued=queued, queue_size=self.max_queue,
+                    batch_size=self.batch_size, flush_interval=self.flush_interval,
+                    oldest_seconds=round(oldest, 3) if oldest is not None else None,
+                    running=self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+                    stopped=self.stopped)
+
+
+_INSERT = "INSERT INTO ratings (userID, movieid, ratingScore, review, ratingDate) VALUES {rows}"
+_UPSERT = _INSERT + """ AS new
+    ON DUPLICATE KEY UPDATE ratingScore = new.ratingScore, review = new.review, ratingDate = new.ratingDate
+"""
+_sql_cache = {}
+
+def _sql(template, rows):
+    sql = _sql_cache.get((template, rows))
+    if sql is None:
+        sql = _sql_cache[template, rows] = template.format(rows=', '.join(['(%s, %s, %s, %s, %s)'] * rows))
+    return sql
+
+def _insert_sql(rows):
+    return _sql(_INSERT, rows)
+
+def _upsert_sql(rows):
+    return _sql(_UPSERT, rows)
+
+
+def enqueue_rating(user_id, movie_id, score, review, rating_date, insert=False):
+    """Hand a rating to the background writer; insert=True for a new rating.
+
+    Returns False when the caller should write it synchronously: ingestion is
+    in 'sync' mode, there is no request (CLI), or the writer has been stopped.
+    Raises RatingQueueFull when the queue stays full, and InvalidRating for
+    ids, a score or a date the database would refuse, and for a new rating
+    whose user or movie does not exist or that already exists.
+    """
+    writer = current_app.extensions.get('rating_writer')
+    if writer is None or not has_request_context():
+        return False
+    user_id, movie_id, score, rating_date = _checked(user_id, movie_id, score, rating_date)
+    if insert:
+        user_exists, movie_exists, rated = fetch_tuples('rating_add_check', (user_id, movie_id, user_id, movie_id))[0]
+        if not user_exists:
+            raise InvalidRating(f"There is no user {user_id}")
+        if not movie_exists:
+            raise InvalidRating(f"There is no movie {movie_id}")
+        if rated:
+            raise InvalidRating(f"User {user_id} has already rated movie {movie_id}")
+    return writer.submit(user_id, movie_id, score, review, rating_date, insert)
+
+def _checked(user_id, movie_id, score, rating_date):
+    # Refuse now what the database would refuse later, when nobody can be told
+    try:
+        user_id, movie_id = int(user_id), int(movie_id)
+    except (TypeError, ValueError):
+        raise InvalidRating("The user and movie IDs must be whole numbers") from None
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        raise InvalidRating("The rating score must be a number") from None
+    if not 0 <= score <= 5:
+        raise InvalidRating("The rating score must be between 0 and 5")
+    try:
+        rating_date = datetime.date.fromisoformat(str(rating_date))
+    except ValueError:
+        raise InvalidRating("The rating date must be a date (YYYY-MM-DD)") from None
+    return user_id, movie_id, score, rating_date
+
+def ingest_status():
+    writer = current_app.extensions.get('rating_writer')
+    return writer.status() if writer is not None else {'mode': 'sync'}
+
+def _queue_full(e):
+    retry_after = max(1, round(current_app.config.get('RATING_INGEST_FLUSH_INTERVAL', 0.2)))
+    return "Too many ratings are being submitted right now; please try again.", 503, {'Retry-After': str(retry_after)}
+
+
+@click.command('ratings-flush-bench')
+@click.option('--ratings', type=int, default=20000, show_default=True, help='Ratings to submit.')
+@click.option('--users', type=int, default=2000, show_default=True, help='Distinct users (of the first userIDs).')
+@click.option('--movies', type=int, default=500, show_default=True, help='Distinct movies (of the first movieids).')
+def flush_bench_command(ratings, users, movies):
+    """Upsert random ratings through the writer and report commits per rating."""
+    import random
+
+    app = current_app._get_current_object()
+    cursor = get_db().cursor()
+    cursor.execute("SELECT userID FROM users ORDER BY userID LIMIT %s", (users,))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT movieid FROM movies ORDER BY movieid LIMIT %s", (movies,))
+    movie_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    if not user_ids or not movie_ids:
+        raise click.ClickException("Needs users and movies; run seed-data first")
+
+    writer = RatingWriter(app, max_queue=app.config['RATING_INGEST_QUEUE_SIZE'],
+                          batch_size=app.config['RATING_INGEST_BATCH_SIZE'],
+                          flush_interval=app.config['RATING_INGEST_FLUSH_INTERVAL'],
+                          enqueue_timeout=60)
+    rng = random.Random(4754)
+    today = time.strftime('%Y-%m-%d')
+    started = time.perf_counter()
+    for _ in range(ratings):
+        writer.submit(rng.choice(user_ids), rng.choice(movie_ids), rng.randint(1, 5), None, today)
+    writer.stop()
+    seconds = time.perf_counter() - started
+    stats = writer.status()
+    click.echo(f"{ratings} ratings in {seconds:.2f}s ({ratings / seconds:.0f}/s): "
+               f"{stats['coalesced']} coalesced, {stats['written']} rows written in "
+               f"{stats['batches']} commits ({ratings / max(1, stats['batches']):.0f} ratings per commit), "
+               f"{stats['dropped']} dropped")
+
+
+def init_ingest(app):
+    app.cli.add_command(flush_bench_command)
+    app.register_error_handler(RatingQueueFull, _queue_full)
+    app.register_error_handler(InvalidRating, lambda e: (str(e), 400))
+    if app.config.get('RATING_INGEST_MODE', 'sync') != 'buffered':
+        return
+    writer = RatingWriter(
+        app,
+        max_queue=app.config.get('RATING_INGEST_QUEUE_SIZE', 10000),
+        batch_size=app.config.get('RATING_INGEST_BATCH_SIZE', 500),
+        flush_interval=app.config.get('RATING_INGEST_FLUSH_INTERVAL', 0.2),
+        enqueue_timeout=app.config.get('RATING_INGEST_ENQUEUE_TIMEOUT', 0.5),
+        retry_interval=app.config.get('RATING_INGEST_RETRY_INTERVAL', 1.0),
+    )
+    app.extensions['rating_writer'] = writer
+    atexit.register(writer.stop)
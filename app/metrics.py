@@ -0,0 +1,378 @@
+# metrics.py
+#
+# Per-request SQL instrumentation, a slow-query log and a Prometheus /metrics
+# endpoint.
+#
+# When METRICS_ENABLED is set, get_db() hands out an InstrumentedConnection
+# whose cursors time every statement and count the rows they return. Each
+# request's totals (queries, DB time, rows, pool wait) are folded into
+# per-route histograms when the request ends. Statements slower than
+# SLOW_QUERY_THRESHOLD_MS are written to the "movie_streaming.slow_query"
+# logger as one JSON object per line, with literals stripped from the SQL.
+# With METRICS_ENABLED off nothing is wrapped and no hooks are installed.
+#
+# Metrics are kept per process; with several workers, scrape each one.
+
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, has_request_context, request
+
+from .db import get_pool, get_replicas
+
+slow_query_log = logging.getLogger('movie_streaming.slow_query')
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+_literal_patterns = [
+    (re.compile(r"'(?:[^'\\]|\\.)*'"), '?'),            # string literals
+    (re.compile(r'"(?:[^"\\]|\\.)*"'), '?'),
+    (re.compile(r'%s|%\(\w+\)s'), '?'),                  # driver placeholders
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),             # numbers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),  # IN lists of any length
+    (re.compile(r'\s+'), ' '),
+]
+
+def normalize_sql(sql):
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    for pattern, replacement in _literal_patterns:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'rows', 'wait_seconds')
+
+    def __init__(self, wait_seconds=0.0):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.wait_seconds = wait_seconds
+
+
+class Registry:
+    def __init__(self, max_statements=500):
+        self._lock = threading.Lock()
+        self.max_statements = max_statements
+        self.requests = {}          # (endpoint, method, status) -> count
+        self.latency = {}           # (endpoint, method) -> Histogram (seconds)
+        self.queries = {}           # (endpoint, method) -> Histogram (statements per request)
+        self.db_seconds = {}        # (endpoint, method) -> seconds
+        self.rows = {}              # (endpoint, method) -> rows fetched
+        self.statements = {}        # normalized sql -> [calls, seconds, rows]
+        self.slow_queries = 0
+        self.pool_wait = Histogram(LATENCY_BUCKETS)
+
+    def record_statement(self, sql, seconds, rows, calls=1):
+        with self._lock:
+            entry = self.statements.get(sql)
+            if entry is None:
+                if len(self.statements) >= self.max_statements:
+                    sql = '<other>'
+                entry = self.statements.setdefault(sql, [0, 0.0, 0])
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] += rows
+
+    def record_slow(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def record_request(self, endpoint, method, status, seconds, stats):
+        route = (endpoint, method)
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(route, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            if stats is not None:
+                self.queries.setdefault(route, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+                self.db_seconds[route] = self.db_seconds.get(route, 0.0) + stats.db_seconds
+                self.rows[route] = self.rows.get(route, 0) + stats.rows
+
+    def record_pool_wait(self, seconds):
+        with self._lock:
+            self.pool_wait.observe(seconds)
+
+
+def _request_stats():
+    # Statements can also run outside a request (CLI commands); those only feed the totals
+    return g.get('sql_stats')
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, registry, threshold):
+        self._cursor = cursor
+        self._registry = registry
+        self._threshold = threshold
+        self._sql = None
+
+    def _observe(self, seconds, rows=0, statements=1):
+        stats = _request_stats()
+        if stats is not None:
+            stats.queries += statements
+            stats.db_seconds += seconds
+            stats.rows += rows
+        if self._sql is not None:
+            self._registry.record_statement(self._sql, seconds, rows)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._sql = normalize_sql(operation)
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            self._observe(seconds)
+            if seconds * 1000 >= self._threshold:
+                self._log_slow(seconds)
+
+    def executemany(self, operation, seq_params):
+        self._sql = normalize_sql(operation)
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params)
+        finally:
+            seconds = time.perf_counter() - started
+            self._observe(seconds)
+            if seconds * 1000 >= self._threshold:
+                self._log_slow(seconds)
+
+    def _fetch(self, method, single, *args):
+        # Unbuffered cursors read from the server while fetching, so this counts as DB time
+        started = time.perf_counter()
+        result = method(*args)
+        seconds = time.perf_counter() - started
+        rows = 0 if result is None else (1 if single else len(result))
+        stats = _request_stats()
+        if stats is not None:
+            stats.db_seconds += seconds
+            stats.rows += rows
+        if self._sql is not None:
+            self._registry.record_statement(self._sql, seconds, rows, calls=0)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone, True)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._fetch(self._cursor.fetchmany, False)
+        return self._fetch(self._cursor.fetchmany, False, size)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall, False)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _log_slow(self, seconds):
+        self._registry.record_slow()
+        record = {
+            'event': 'slow_query',
+            'duration_ms': round(seconds * 1000, 2),
+            'threshold_ms': self._threshold,
+            'sql': self._sql,
+        }
+        if has_request_context():
+            record['endpoint'] = request.endpoint
+            record['method'] = request.method
+            record['path'] = request.path
+        slow_query_log.warning(json.dumps(record))
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, connection, registry, threshold):
+        self.wrapped = connection
+        self._registry = registry
+        self._threshold = threshold
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.wrapped.cursor(*args, **kwargs), self._registry, self._threshold)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+def _wrap_connection(connection, wait_seconds):
+    registry = current_app.extensions['metrics']
+    registry.record_pool_wait(wait_seconds)
+    stats = _request_stats()
+    if stats is not None:
+        stats.wait_seconds += wait_seconds
+    return InstrumentedConnection(connection, registry, current_app.config.get('SLOW_QUERY_THRESHOLD_MS', 200))
+
+
+def _start_request():
+    g.sql_stats = RequestStats()
+    g.request_started = time.perf_counter()
+
+def _finish_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    stats = g.get('sql_stats')
+    current_app.extensions['metrics'].record_request(
+        request.endpoint or 'unmatched', request.method, response.status_code, seconds, stats
+    )
+    if stats is not None:
+        # Lets browser dev tools show where the time went
+        response.headers['Server-Timing'] = (
+            f"db;dur={stats.db_seconds * 1000:.1f};desc=\"{stats.queries} queries\", "
+            f"pool;dur={stats.wait_seconds * 1000:.1f}, total;dur={seconds * 1000:.1f}"
+        )
+    return response
+
+
+# Prometheus text exposition format
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_label_value(v)}"' for k, v in labels.items()) + '}'
+
+def _histogram_lines(name, histogram, **labels):
+    cumulative = 0
+    bounds = [str(b) for b in histogram.buckets] + ['+Inf']
+    for bound, count in zip(bounds, histogram.counts):
+        cumulative += count
+        yield f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}"
+    yield f"{name}_sum{_labels(**labels)} {histogram.sum}"
+    yield f"{name}_count{_labels(**labels)} {histogram.count}"
+
+def render_prometheus(registry, pool_stats=None, cache_stats=None, replica_stats=None):
+    lines = []
+    with registry._lock:
+        lines += ["# HELP http_requests_total Requests handled, by route and status.",
+                  "# TYPE http_requests_total counter"]
+        for (endpoint, method, status), count in sorted(registry.requests.items()):
+            lines.append(f"http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}")
+
+        lines += ["# HELP http_request_duration_seconds Request latency by route.",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (endpoint, method), histogram in sorted(registry.latency.items()):
+            lines += _histogram_lines('http_request_duration_seconds', histogram, endpoint=endpoint, method=method)
+
+        lines += ["# HELP http_request_sql_queries SQL statements issued per request, by route.",
+                  "# TYPE http_request_sql_queries histogram"]
+        for (endpoint, method), histogram in sorted(registry.queries.items()):
+            lines += _histogram_lines('http_request_sql_queries', histogram, endpoint=endpoint, method=method)
+
+        lines += ["# HELP http_request_db_seconds_total Time spent in the database, by route.",
+                  "# TYPE http_request_db_seconds_total counter"]
+        for (endpoint, method), seconds in sorted(registry.db_seconds.items()):
+            lines.append(f"http_request_db_seconds_total{_labels(endpoint=endpoint, method=method)} {seconds}")
+
+        lines += ["# HELP http_request_db_rows_total Rows fetched from the database, by route.",
+                  "# TYPE http_request_db_rows_total counter"]
+        for (endpoint, method), rows in sorted(registry.rows.items()):
+            lines.append(f"http_request_db_rows_total{_labels(endpoint=endpoint, method=method)} {rows}")
+
+        lines += ["# HELP sql_statement_calls_total Executions per normalized statement.",
+                  "# TYPE sql_statement_calls_total counter"]
+        for sql, (calls, _, _) in sorted(registry.statements.items()):
+            lines.append(f"sql_statement_calls_total{_labels(statement=sql)} {calls}")
+        lines += ["# HELP sql_statement_seconds_total Execution time per normalized statement.",
+                  "# TYPE sql_statement_seconds_total counter"]
+        for sql, (_, seconds, _) in sorted(registry.statements.items()):
+            lines.append(f"sql_statement_seconds_total{_labels(statement=sql)} {seconds}")
+        lines += ["# HELP sql_statement_rows_total Rows fetched per normalized statement.",
+                  "# TYPE sql_statement_rows_total counter"]
+        for sql, (_, _, rows) in sorted(registry.statements.items()):
+            lines.append(f"sql_statement_rows_total{_labels(statement=sql)} {rows}")
+
+        lines += ["# HELP sql_slow_queries_total Statements slower than the slow-query threshold.",
+                  "# TYPE sql_slow_queries_total counter",
+                  f"sql_slow_queries_total {registry.slow_queries}"]
+
+        lines += ["# HELP db_pool_wait_seconds Time spent waiting for a pooled connection.",
+                  "# TYPE db_pool_wait_seconds histogram"]
+        lines += _histogram_lines('db_pool_wait_seconds', registry.pool_wait)
+
+    if pool_stats:
+        lines += ["# HELP db_pool Connection pool state and counters.",
+                  "# TYPE db_pool gauge"]
+        for name, value in sorted(pool_stats.items()):
+            lines.append(f"db_pool{_labels(stat=name)} {value}")
+
+    if replica_stats:
+        lines += ["# HELP db_replica_reads_total Requests whose reads were routed to each server.",
+                  "# TYPE db_replica_reads_total counter",
+                  f"db_replica_reads_total{_labels(server='primary')} {replica_stats['primary_reads']}"]
+        replicas = {name: s for name, s in replica_stats.items() if isinstance(s, dict)}
+        for name, stats in sorted(replicas.items()):
+            lines.append(f"db_replica_reads_total{_labels(server=name)} {stats['reads']}")
+        lines += ["# HELP db_replica_fallbacks_total Requests that found no usable replica and read from the primary.",
+                  "# TYPE db_replica_fallbacks_total counter",
+                  f"db_replica_fallbacks_total {replica_stats['fallbacks']}",
+                  "# HELP db_replica_failovers_total Replica connections that broke mid-request.",
+                  "# TYPE db_replica_failovers_total counter",
+                  f"db_replica_failovers_total {replica_stats['failovers']}",
+                  "# HELP db_replica_lag_seconds Last measured replication lag.",
+                  "# TYPE db_replica_lag_seconds gauge"]
+        for name, stats in sorted(replicas.items()):
+            if stats['lag'] is not None:
+                lines.append(f"db_replica_lag_seconds{_labels(server=name)} {stats['lag']}")
+        lines += ["# HELP db_replica_up Whether the replica is in use (0 while skipped as unreachable).",
+                  "# TYPE db_replica_up gauge"]
+        for name, stats in sorted(replicas.items()):
+            lines.append(f"db_replica_up{_labels(server=name)} {0 if stats['down'] else 1}")
+
+    if cache_stats:
+        lines += ["# HELP report_cache_requests_total Report cache lookups.",
+                  "# TYPE report_cache_requests_total counter"]
+        for report, counts in sorted(cache_stats['per_report'].items()):
+            lines.append(f"report_cache_requests_total{_labels(report=report, result='hit')} {counts['hits']}")
+            lines.append(f"report_cache_requests_total{_labels(report=report, result='miss')} {counts['misses']}")
+
+    return '\n'.join(lines) + '\n'
+
+
+@metrics_blueprint.route('/metrics')
+def metrics():
+    cache = current_app.extensions.get('report_cache')
+    pool = get_pool()
+    replicas = get_replicas()
+    body = render_prometheus(
+        current_app.extensions['metrics'],
+        pool_stats=pool.stats(),
+        cache_stats=cache.stats() if cache else None,
+        replica_stats=replicas.stats() if replicas else None,
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.extensions['metrics'] = Registry(app.config.get('METRICS_MAX_STATEMENTS', 500))
+    app.extensions['db_wrapper'] = _wrap_connection
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.register_blueprint(metrics_blueprint)
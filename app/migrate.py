@@ -0,0 +1,181 @@
+# migrate.py
+#
+# Versioned schema migrations. Each file in database/migrations is named
+# NNNN_description.sql and applied once, in order, by `flask migrate`; the
+# versions applied are recorded in schema_migrations together with a checksum
+# of the file, so `flask migrate-status` can tell when an applied file was
+# edited afterwards.
+#
+# Statements in a migration end with ';' at the end of a line (no DELIMITER
+# blocks). DDL commits implicitly in MySQL, so a migration that fails halfway
+# is not rolled back: fix the cause and run `flask migrate` again. Statements
+# whose only problem is that their change already exists (an index, column or
+# primary key added by one of the older database/*.sql scripts or by an
+# interrupted run) are skipped, which makes re-running safe.
+#
+# A migration whose statements are not safe to repeat once its change exists
+# (one that adds a scratch column on the way, say) starts with a
+#
+#     -- skip-if: SELECT ...
+#
+# line: when that query returns a non-zero value, none of the statements run
+# and the version is only recorded as applied.
+
+import hashlib
+import os
+import re
+import time
+
+import click
+from mysql.connector import errors
+
+from .db import get_db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'migrations')
+
+# ER_DUP_FIELDNAME, ER_DUP_KEYNAME, ER_MULTIPLE_PRI_KEY, ER_CANT_DROP_FIELD_OR_KEY
+ALREADY_APPLIED = {1060, 1061, 1068, 1091}
+
+_FILE_NAME = re.compile(r'^(\d{4})_(\w+)\.sql$')
+_SKIP_IF = re.compile(r'^\s*--\s*skip-if:\s*(.+?);?\s*$', re.M)
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding='utf-8') as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+
+    def statements(self):
+        # Drop comment lines, then split at ';' ending a line
+        lines = [line for line in self.sql.splitlines() if not line.lstrip().startswith('--')]
+        text = '\n'.join(lines)
+        return [s.strip() for s in re.split(r';\s*$', text, flags=re.M) if s.strip()]
+
+    def skip_if(self):
+        match = _SKIP_IF.search(self.sql)
+        return match.group(1) if match else None
+
+
+def load_migrations(directory=None):
+    directory = directory or MIGRATIONS_DIR
+    migrations = []
+    for file_name in sorted(os.listdir(directory)):
+        match = _FILE_NAME.match(file_name)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, file_name)))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise click.ClickException(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def _ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version int NOT NULL,
+          name varchar(255) NOT NULL,
+          checksum char(64) NOT NULL,
+          applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          seconds decimal(10,3) NOT NULL DEFAULT '0',
+          PRIMARY KEY (version)
+        ) ENGINE=InnoDB
+    """)
+
+def applied_migrations():
+    """{version: (name, checksum, applied_at)} of the migrations already applied."""
+    cursor = get_db().cursor()
+    try:
+        _ensure_table(cursor)
+        cursor.execute("SELECT version, name, checksum, applied_at FROM schema_migrations")
+        return {version: (name, checksum, applied_at) for version, name, checksum, applied_at in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def apply_migration(migration, echo=None):
+    db = get_db()
+    cursor = db.cursor()
+    started = time.monotonic()
+    try:
+        statements = migration.statements()
+        condition = migration.skip_if()
+        if condition:
+            cursor.execute(condition)
+            row = cursor.fetchone()
+            if cursor.with_rows:
+                cursor.fetchall()
+            if row and row[0]:
+                if echo:
+                    echo("  skipped (already applied): skip-if condition holds")
+                statements = []
+        for statement in statements:
+            try:
+                cursor.execute(statement)
+            except errors.DatabaseError as e:
+                if e.errno not in ALREADY_APPLIED:
+                    raise
+                if echo:
+                    echo(f"  skipped (already applied): {e.msg}")
+                continue
+            if cursor.with_rows:
+                cursor.fetchall()
+            db.commit()
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, checksum, seconds) VALUES (%s, %s, %s, %s)",
+            (migration.version, migration.name, migration.checksum, round(time.monotonic() - started, 3)),
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+    return time.monotonic() - started
+
+def pending_migrations(target=None):
+    applied = applied_migrations()
+    return [m for m in load_migrations()
+            if m.version not in applied and (target is None or m.version <= target)]
+
+
+@click.command('migrate')
+@click.option('--to', 'target', type=int, default=None, help='Stop after this version.')
+@click.option('--dry-run', is_flag=True, help='List the statements that would run.')
+def migrate_command(target, dry_run):
+    """Apply the pending schema migrations in database/migrations."""
+    pending = pending_migrations(target)
+    if not pending:
+        click.echo("Schema is up to date.")
+        return
+    for migration in pending:
+        click.echo(f"{migration.version:04d} {migration.name}")
+        if dry_run:
+            if migration.skip_if():
+                click.echo(f"  unless: {migration.skip_if()}")
+            for statement in migration.statements():
+                click.echo('  ' + ' '.join(statement.split()) + ';')
+            continue
+        seconds = apply_migration(migration, echo=click.echo)
+        click.echo(f"  applied in {seconds:.2f}s")
+
+@click.command('migrate-status')
+def migrate_status_command():
+    """List the migrations and whether each one has been applied."""
+    applied = applied_migrations()
+    for migration in load_migrations():
+        entry = applied.get(migration.version)
+        if entry is None:
+            state = 'pending'
+        elif entry[1] != migration.checksum:
+            state = f"applied {entry[2]}, FILE CHANGED SINCE"
+        else:
+            state = f"applied {entry[2]}"
+        click.echo(f"{migration.version:04d} {migration.name}: {state}")
+
+
+def init_migrate(app):
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(migrate_status_command)
@@ -0,0 +1,133 @@
+# pagination.py
+#
+# Keyset ("seek") pagination for the list pages. Instead of OFFSET, each page
+# continues from the key of the last row shown, so MySQL only reads one page
+# worth of index entries no matter how deep the user pages.
+
+import base64
+import binascii
+import json
+
+from flask import current_app, request
+
+from .queries import PAGES, STATEMENTS, fetch_all
+
+
+class Page:
+    def __init__(self, rows, next_cursor=None, prev_cursor=None, limit=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.limit = limit
+
+
+def encode_cursor(direction, values):
+    raw = json.dumps([direction, list(values)], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    # Returns (direction, values) or None when the cursor is missing or malformed
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, values = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+def page_limit():
+    # Page size from ?limit=, bounded by the configured maximum
+    default = current_app.config.get('PAGE_SIZE', 50)
+    maximum = current_app.config.get('PAGE_SIZE_MAX', 500)
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, maximum))
+
+
+def seek_condition(keys, op, inclusive=False):
+    # (k1, k2) > (v1, v2) written out as k1 > v1 OR (k1 = v1 AND k2 > v2),
+    # which the range optimizer turns into index range scans.
+    # inclusive=True gives >= / <= on the full key.
+    clauses = []
+    for i, key in enumerate(keys):
+        key_op = op + '=' if inclusive and i == len(keys) - 1 else op
+        parts = [f"{k} = %s" for k in keys[:i]] + [f"{key} {key_op} %s"]
+        clauses.append("(" + " AND ".join(parts) + ")")
+    return "(" + " OR ".join(clauses) + ")"
+
+def seek_params(values):
+    params = []
+    for i in range(len(values)):
+        params.extend(values[:i + 1])
+    return params
+
+
+def page_sql(select, keys, reverse_scan=False, where=None, seek=False):
+    # The statement for one page: `seek` continues after a position, and
+    # reverse_scan reads the index from the other end. The parameters are the
+    # filter's, then seek_params(position), then the row limit.
+    sql = STATEMENTS.get(select, select)
+    conditions = [where] if where else []
+    if seek:
+        conditions.append(seek_condition(keys, '<' if reverse_scan else '>'))
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    order = 'DESC' if reverse_scan else 'ASC'
+    sql += " ORDER BY " + ", ".join(f"{k} {order}" for k in keys)
+    return sql + " LIMIT %s"
+
+def fetch_page(select, keys=None, descending=None, where=None, params=(), token=None, limit=None):
+    """Fetch one page of ``select`` ordered by ``keys`` (a unique, indexed key).
+
+    ``select`` is a SELECT ... FROM ... statement without WHERE/ORDER BY/LIMIT,
+    or the name of one registered in queries.py (whose keys and direction are
+    then the defaults); ``where`` and ``params`` add an extra filter. ``token``
+    defaults to the ``cursor`` query argument of the current request. Each
+    combination of filter, direction and position gives one fixed SQL text, so
+    pages run as prepared statements (see queries.py).
+    """
+    registered_keys, registered_descending = PAGES.get(select, (None, False))
+    keys = keys or registered_keys
+    descending = registered_descending if descending is None else descending
+    if token is None:
+        token = request.args.get('cursor')
+    if limit is None:
+        limit = page_limit()
+    position = decode_cursor(token)
+    if position is not None and len(position[1]) != len(keys):
+        position = None
+
+    backwards = position is not None and position[0] == 'prev'
+    # Walking backwards reads the index in the opposite direction and flips the result
+    reverse_scan = descending != backwards
+
+    query_params = list(params)
+    if position is not None:
+        query_params.extend(seek_params(position[1]))
+    query_params.append(limit + 1)
+    sql = page_sql(select, keys, reverse_scan, where, seek=position is not None)
+
+    rows = fetch_all(sql, query_params)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    def key_of(row):
+        return [row[k.split('.')[-1]] for k in keys]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = encode_cursor('next', key_of(rows[-1]))
+            if has_more:
+                prev_cursor = encode_cursor('prev', key_of(rows[0]))
+        else:
+            if has_more:
+                next_cursor = encode_cursor('next', key_of(rows[-1]))
+            if position is not None:
+                prev_cursor = encode_cursor('prev', key_of(rows[0]))
+    return Page(rows, next_cursor, prev_cursor, limit)
@@ -0,0 +1,199 @@
+# plancheck.py
+#
+# Query plan regression check: `flask plan-check` runs EXPLAIN FORMAT=JSON on
+# every statement registered in queries.py (which holds the SQL of the routes,
+# the search and the dashboard; list pages are checked as the first page and
+# as a page after a cursor, in both directions) and on the SQL other modules
+# build at run time (the reports, the JSON API, the IN lists of the facet and
+# profile pages; see _built_cases), and fails when one of them reads a whole
+# table or sorts with a filesort. Run it in CI against a local MySQL loaded
+# with seed-data and migrated, since plans depend on table sizes.
+#
+# Parameters are taken from real rows (bench.sample_data): matched to the
+# column each placeholder is compared with for registered statements, given
+# explicitly for the built ones, so lookups are planned with values that exist.
+
+import datetime
+import json
+import re
+
+import click
+
+from . import api, facets, profile, reports
+from .bench import sample_data
+from .db import get_db
+from .pagination import page_sql, seek_params
+from .queries import PAGES, STATEMENTS, in_list, padded
+
+# Findings accepted for a statement, and why
+EXPECTED = {
+    # Full-text matches are ranked by relevance, so the (LIMIT bounded) matches are sorted
+    'search_movies': {'filesort'},
+    # Subscriptions of the first few matching users, sorted by name; at most a few pages of rows
+    'suggest_subscriptions': {'filesort'},
+    # One user's payments, ordered by subscription then payment across the join
+    'profile_payments_page': {'filesort'},
+    # The facet index (facets.py) loads every movie, genre and average rating when it is built
+    'facet_movies': {'full scan'},
+    'facet_genres': {'full scan'},
+    'facet_ratings': {'full scan'},
+    # /reports: the total sums the whole daily rollup (one row per day and method),
+    # and the genre ranking numbers every rated movie of each genre before keeping n
+    'total_revenue': {'full scan'},
+    'top_movies_by_genre': {'full scan', 'filesort'},
+}
+
+_TABLES = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+`?(\w+)`?', re.I)
+_COMPARED = re.compile(r'([\w.]+)\s*(?:=|<=|>=|<>|!=|<|>)\s*$')
+
+
+def _guess_params(sql, samples):
+    # One value per %s from the sample rows of the tables the statement reads,
+    # those named first taking precedence
+    tables = [t.lower() for t in _TABLES.findall(sql)]
+    columns = {}
+    for table in tables + list(samples):
+        for column, value in (samples.get(table) or {}).items():
+            columns.setdefault(column.lower(), value)
+
+    params = []
+    parts = sql.split('%s')
+    for before in parts[:-1]:
+        before = before.rstrip()
+        upper = before.upper()
+        if upper.endswith('LIMIT'):
+            params.append(10)
+        elif upper.endswith('AGAINST (') or upper.endswith('AGAINST('):
+            words = str(columns.get('title', 'a')).split()
+            params.append(f"+{words[0] if words else 'a'}*")
+        elif upper.endswith('LIKE'):
+            column = before[:-4].split()[-1].split('.')[-1].lower()
+            params.append(str(columns.get(column, 'a'))[:2] + '%')
+        else:
+            match = _COMPARED.search(before)
+            column = match.group(1).split('.')[-1].lower() if match else None
+            if column in columns:
+                params.append(columns[column])
+            elif column and (column == 'day' or 'date' in column):
+                params.append(datetime.date.today())
+            else:
+                params.append(1)
+    return params
+
+
+def plan_findings(plan):
+    """[(finding, table)] for the full scans and filesorts in an EXPLAIN FORMAT=JSON tree."""
+    findings = []
+
+    def walk(node, table=None):
+        if isinstance(node, dict):
+            table = node.get('table_name', table)
+            if node.get('access_type') == 'ALL':
+                findings.append(('full scan', table))
+            if node.get('using_filesort'):
+                findings.append(('filesort', table))
+            for value in node.values():
+                walk(value, table)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, table)
+
+    walk(plan)
+    return findings
+
+
+def _cases(samples):
+    # (label, statement name, sql, params) for every registered statement; INSERTs have no access path to check
+    for name, sql in sorted(STATEMENTS.items()):
+        if name in PAGES:
+            keys, descending = PAGES[name]
+            for reverse_scan in (descending, not descending):
+                direction = 'backwards' if reverse_scan != descending else 'forwards'
+                for seek, position in ((False, 'first page'), (True, 'after cursor')):
+                    page = page_sql(name, keys, reverse_scan, seek=seek)
+                    yield f"{name} ({position}, {direction})", name, page, _guess_params(page, samples)
+        elif not sql.lstrip().upper().startswith('INSERT'):
+            yield name, name, sql, _guess_params(sql, samples)
+    yield from _built_cases(samples)
+
+
+def _built_cases(samples):
+    # The statements that are put together at run time instead of registered:
+    # the /reports queries (reports.py), the JSON API's id lookups and listings
+    # (api.py) and the IN lists of the facet and profile pages
+    today = datetime.date.today()
+    genre = samples['movie_genre']['movie_genre']
+    method = samples['payments']['payment_method']
+    movie_ids = padded([samples['movies']['movieid']] * 3)
+    movies_in, _ = in_list('movieid', movie_ids)
+
+    yield 'subscription_status_counts', 'subscription_status_counts', reports.SUBSCRIPTION_STATUS_COUNTS_SQL, ()
+    yield 'total_revenue', 'total_revenue', reports.TOTAL_REVENUE_SQL, ()
+    yield 'top_rated_movies', 'top_rated_movies', reports.TOP_RATED_MOVIES_SQL, ()
+    yield ('top_movies_by_genre (all genres)', 'top_movies_by_genre',
+           reports.top_movies_by_genre_sql(False), (1, 5))
+    yield ('top_movies_by_genre (one genre)', 'top_movies_by_genre',
+           reports.top_movies_by_genre_sql(True), (1, genre, 5))
+    for source in reports.REVENUE_SOURCES:
+        start = today - datetime.timedelta(days=30)
+        yield f"revenue ({source})", 'revenue', reports.revenue_sql(source, False), (start, today)
+        yield f"revenue ({source}, one method)", 'revenue', reports.revenue_sql(source, True), (start, today, method)
+
+    yield 'facet_page_movies', 'facet_page_movies', facets.MOVIES_SQL + movies_in, movie_ids
+    yield 'profile_movie_titles', 'profile_movie_titles', profile.MOVIE_TITLES_SQL + movies_in, movie_ids
+
+    for name, resource in sorted(api.RESOURCES.items()):
+        sample = samples[resource['table']]
+        key = [sample[k] for k in resource['key']]
+        fields = resource['fields']
+        sql = api.by_ids_sql(resource, fields, 4)
+        yield f"api {name} (ids)", f"api_{name}", sql, key * 4
+        select = api.list_sql(resource, fields)
+        for seek in (False, True):
+            sql = page_sql(select, resource['key'], seek=seek)
+            params = (seek_params(key) if seek else []) + [10]
+            yield f"api {name} ({'after cursor' if seek else 'first page'})", f"api_{name}", sql, params
+
+
+def check_plans(samples, names=None):
+    """[(label, name, findings, unexpected)] for the statements (or those in names)."""
+    cursor = get_db().cursor()
+    results = []
+    try:
+        for label, name, sql, params in _cases(samples):
+            if names is not None and name not in names:
+                continue
+            cursor.execute("EXPLAIN FORMAT=JSON " + sql, tuple(params))
+            plan = json.loads(cursor.fetchall()[0][0])
+            findings = plan_findings(plan)
+            unexpected = [f for f in findings if f[0] not in EXPECTED.get(name, ())]
+            results.append((label, name, findings, unexpected))
+    finally:
+        cursor.close()
+    return results
+
+
+@click.command('plan-check')
+@click.option('--only', default=None, help='Comma separated statement names to check.')
+@click.option('--verbose', '-v', is_flag=True, help='List every statement, not only the failing ones.')
+def plan_check_command(only, verbose):
+    """EXPLAIN every registered statement; fail on full table scans and filesorts."""
+    names = {n.strip() for n in only.split(',')} if only else None
+    samples, _ = sample_data()
+    results = check_plans(samples, names)
+    failed = 0
+    for label, name, findings, unexpected in results:
+        if unexpected:
+            failed += 1
+            problems = ', '.join(f"{kind} on {table or 'the result'}" for kind, table in unexpected)
+            click.echo(f"FAIL {label}: {problems}")
+        elif verbose:
+            accepted = ', '.join(f"{kind} on {table or 'the result'} (expected)" for kind, table in findings)
+            click.echo(f"ok   {label}" + (f": {accepted}" if accepted else ""))
+    click.echo(f"{len(results)} plans checked, {failed} with full scans or filesorts.")
+    if failed:
+        raise click.ClickException(f"{failed} statement plan(s) read a whole table or use a filesort")
+
+
+def init_plancheck(app):
+    app.cli.add_command(plan_check_command)
@@ -0,0 +1,83 @@
+# profile.py
+#
+# User profile (/users/<id>): the account with its subscriptions, their
+# payments and its ratings with movie titles. Each section is paged on its own
+# cursor (?subscriptions_cursor=, ?payments_cursor=, ?ratings_cursor=), so a
+# user with years of history costs one page per section.
+#
+# load_profile runs the same five indexed queries however much history there is:
+#   1. the user by primary key, with a count of their subscriptions (userID index)
+#   2. a page of those subscriptions, newest first (userID index)
+#   3. a page of the payments of all of them, joined to subscriptions on the
+#      user (userID index, then the payments subscription_id index)
+#   4. a page of the user's ratings (primary key prefix userID)
+#   5. the titles of the movies on that page, one IN list (primary key)
+# instead of one query per subscription or rating.
+
+from .exporter import plain_value
+from .pagination import fetch_page
+from .queries import fetch_one, fetch_tuples, in_list, register, register_page
+
+SECTIONS = ('subscriptions', 'payments', 'ratings')
+
+# The titles of the rated movies on a page (an IN list appended, see plancheck.py)
+MOVIE_TITLES_SQL = "SELECT movieid, title FROM movies WHERE "
+
+# Secrets (users.password, payments.card_no) are not part of the profile
+register('profile_user', """
+    SELECT userID, userName, email, date_of_birth,
+           (SELECT COUNT(*) FROM subscriptions s WHERE s.userID = users.userID) AS subscription_count
+    FROM users WHERE userID = %s
+""")
+# The order takes keys from both tables, so MySQL sorts the user's payments
+# (a filesort of one user's rows, see plancheck.EXPECTED)
+register_page('profile_payments_page', """
+    SELECT p.payment_id, p.subscription_id, p.payment_amount, p.payment_date, p.payment_method
+    FROM payments p JOIN subscriptions s ON p.subscription_id = s.subscription_id
+""", ['s.subscription_id', 'p.payment_id'], descending=True)
+
+
+def movie_titles(movie_ids):
+    """{movieid: title} for movie_ids, in one primary-key lookup."""
+    if not movie_ids:
+        return {}
+    where, params = in_list('movieid', sorted(set(movie_ids)))
+    return dict(fetch_tuples(MOVIE_TITLES_SQL + where, params))
+
+
+def load_profile(user_id, tokens=None, limit=20):
+    """The profile of user_id, or None if there is no such user.
+
+    tokens maps a section name to its page cursor (None or '' for the first page).
+    """
+    tokens = tokens or {}
+    user = fetch_one('profile_user', (user_id,))
+    if user is None:
+        return None
+
+    subscriptions = fetch_page('subscriptions_page', descending=True, where="userID = %s", params=[user_id],
+                               token=tokens.get('subscriptions') or '', limit=limit)
+    payments = fetch_page('profile_payments_page', where="s.userID = %s", params=[user_id],
+                          token=tokens.get('payments') or '', limit=limit)
+    ratings = fetch_page('ratings_page', where="userID = %s", params=[user_id],
+                         token=tokens.get('ratings') or '', limit=limit)
+    titles = movie_titles([row.movieid for row in ratings.rows])
+    ratings.rows = [dict(row._asdict(), title=titles.get(row.movieid)) for row in ratings.rows]
+
+    return {
+        'user': user,
+        'subscriptions': subscriptions,
+        'payments': payments,
+        'ratings': ratings,
+    }
+
+
+def profile_json(profile):
+    def rows(page):
+        return [{k: plain_value(v) for k, v in (r if isinstance(r, dict) else r._asdict()).items()} for r in page.rows]
+
+    body = {'user': {k: plain_value(v) for k, v in profile['user']._asdict().items()}}
+    for section in SECTIONS:
+        page = profile[section]
+        body[section] = {'data': rows(page), 'next_cursor': page.next_cursor, 'prev_cursor': page.prev_cursor}
+    return body
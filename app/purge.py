@@ -0,0 +1,320 @@
+# purge.py
+#
+# Deleting users and subscriptions without long transactions.
+#
+# A user is removed bottom-up: ratings, then the payments of each subscription,
+# then the subscriptions, then the user row. Every step deletes at most
+# PURGE_BATCH_SIZE rows and commits, so row locks (and the per-row stats
+# triggers) are held only for one short batch instead of for the whole cascade.
+# If a concurrent writer adds a child row in the meantime, the final delete
+# fails on the foreign key and the cascade simply runs again.
+#
+# Bulk purges (`flask purge-users`) first record the users to delete in
+# purge_job_users (database/movie_streaming_purge.sql) and then work through
+# that list; an interrupted job continues with --resume.
+
+import datetime
+import time
+
+import click
+from flask import current_app
+from mysql.connector import errorcode, errors
+
+from .cache import invalidate
+from .db import get_db
+
+PURGED_TABLES = ('users', 'subscriptions', 'payments', 'ratings')
+
+# Errors after which the cascade is retried: a child row was added concurrently,
+# or a batch lost a lock wait or deadlock against another writer
+_RETRY_ERRNOS = (errorcode.ER_ROW_IS_REFERENCED_2, errorcode.ER_LOCK_WAIT_TIMEOUT, errorcode.ER_LOCK_DEADLOCK)
+
+
+class PurgeFailed(Exception):
+    pass
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def _delete_in_batches(db, cursor, sql, params, batch_size, pause):
+    # Repeat "DELETE ... LIMIT batch_size" until nothing is left, one commit per batch
+    total = 0
+    while True:
+        cursor.execute(sql + " LIMIT %s", (*params, batch_size))
+        deleted = cursor.rowcount
+        db.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+def _delete_subscriptions(db, cursor, subscription_ids, batch_size, pause):
+    payments = subscriptions = 0
+    for i in range(0, len(subscription_ids), batch_size):
+        chunk = subscription_ids[i:i + batch_size]
+        payments += _delete_in_batches(
+            db, cursor, f"DELETE FROM payments WHERE subscription_id IN ({_placeholders(chunk)})",
+            chunk, batch_size, pause)
+        cursor.execute(f"DELETE FROM subscriptions WHERE subscription_id IN ({_placeholders(chunk)})", chunk)
+        subscriptions += cursor.rowcount
+        db.commit()
+    return payments, subscriptions
+
+def _with_retries(db, attempts, cascade):
+    for attempt in range(attempts):
+        try:
+            return cascade()
+        except errors.DatabaseError as e:
+            db.rollback()
+            if e.errno not in _RETRY_ERRNOS or attempt == attempts - 1:
+                raise PurgeFailed(str(e)) from e
+            current_app.logger.warning("Purge interrupted by a concurrent write (%s); retrying", e.msg)
+
+
+def purge_user(user_id, batch_size=None, pause=0.0, attempts=3, job_id=None):
+    """Delete a user with their ratings, subscriptions and payments in short batches.
+
+    Returns the number of rows deleted per table. With job_id, the user's entry in
+    purge_job_users is removed and the job's counters updated together with the user.
+    """
+    db = get_db()
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+    counts = dict.fromkeys(PURGED_TABLES, 0)
+
+    def cascade():
+        cursor = db.cursor()
+        try:
+            counts['ratings'] += _delete_in_batches(
+                db, cursor, "DELETE FROM ratings WHERE userID = %s", (user_id,), batch_size, pause)
+
+            cursor.execute("SELECT subscription_id FROM subscriptions WHERE userID = %s", (user_id,))
+            subscription_ids = [row[0] for row in cursor.fetchall()]
+            payments, subscriptions = _delete_subscriptions(db, cursor, subscription_ids, batch_size, pause)
+            counts['payments'] += payments
+            counts['subscriptions'] += subscriptions
+
+            # The user row, its trigger_user log entries and its job entry go together
+            cursor.execute("DELETE FROM trigger_user WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM users WHERE userID = %s", (user_id,))
+            counts['users'] = cursor.rowcount
+            if job_id is not None:
+                cursor.execute("DELETE FROM purge_job_users WHERE job_id = %s AND userID = %s", (job_id, user_id))
+                cursor.execute("""
+                    UPDATE purge_jobs
+                    SET users_done = users_done + 1, subscriptions_deleted = subscriptions_deleted + %s,
+                        payments_deleted = payments_deleted + %s, ratings_deleted = ratings_deleted + %s
+                    WHERE job_id = %s
+                """, (counts['subscriptions'], counts['payments'], counts['ratings'], job_id))
+            db.commit()
+        finally:
+            cursor.close()
+
+    _with_retries(db, attempts, cascade)
+    return counts
+
+def purge_subscription(subscription_id, batch_size=None, pause=0.0, attempts=3):
+    """Delete a subscription and its payments in short batches."""
+    db = get_db()
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+
+    def cascade():
+        cursor = db.cursor()
+        try:
+            payments, subscriptions = _delete_subscriptions(db, cursor, [subscription_id], batch_size, pause)
+        finally:
+            cursor.close()
+        return {'subscriptions': subscriptions, 'payments': payments}
+
+    return _with_retries(db, attempts, cascade)
+
+
+# Bulk purge jobs
+
+def create_job(description, user_ids=None, inactive_before=None):
+    """Start a purge job for a list of user ids or for users inactive since a date."""
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute("INSERT INTO purge_jobs (description, inactive_before) VALUES (%s, %s)",
+                       (description, inactive_before))
+        job_id = cursor.lastrowid
+        if user_ids is not None:
+            # Ids that are not (or no longer) users are left out
+            user_ids = sorted(set(user_ids))
+            for i in range(0, len(user_ids), 1000):
+                chunk = user_ids[i:i + 1000]
+                cursor.execute(f"""
+                    INSERT INTO purge_job_users (job_id, userID)
+                    SELECT %s, userID FROM users WHERE userID IN ({_placeholders(chunk)})
+                """, (job_id, *chunk))
+            cursor.execute("""
+                UPDATE purge_jobs
+                SET status = 'running', users_total = (SELECT COUNT(*) FROM purge_job_users WHERE job_id = %s)
+                WHERE job_id = %s
+            """, (job_id, job_id))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+    return job_id
+
+def _select_inactive(job, window):
+    # Adds inactive users to the job one userID range at a time. A user is
+    # inactive if they have some activity on record but none since the cutoff:
+    # no active or open-ended subscription, no subscription ending, payment or
+    # rating on or after inactive_before.
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT MAX(userID) FROM users")
+        last_user = cursor.fetchone()[0] or 0
+        low, cutoff = job['selected_through'], job['inactive_before']
+        while low < last_user:
+            high = low + window
+            cursor.execute("""
+                INSERT IGNORE INTO purge_job_users (job_id, userID)
+                SELECT %s, u.userID
+                FROM users u
+                WHERE u.userID > %s AND u.userID <= %s
+                  AND (EXISTS (SELECT 1 FROM subscriptions s WHERE s.userID = u.userID)
+                       OR EXISTS (SELECT 1 FROM ratings r WHERE r.userID = u.userID))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM subscriptions s
+                      WHERE s.userID = u.userID
+                        AND (s.subscription_status = 'Active' OR s.end_Date IS NULL OR s.end_Date >= %s))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM subscriptions s JOIN payments p ON p.subscription_id = s.subscription_id
+                      WHERE s.userID = u.userID AND p.payment_date >= %s)
+                  AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.userID = u.userID AND r.ratingDate >= %s)
+            """, (job['job_id'], low, high, cutoff, cutoff, cutoff))
+            selected = cursor.rowcount
+            cursor.execute("""
+                UPDATE purge_jobs SET selected_through = %s, users_total = users_total + %s WHERE job_id = %s
+            """, (high, selected, job['job_id']))
+            db.commit()
+            low = high
+        cursor.execute("UPDATE purge_jobs SET status = 'running' WHERE job_id = %s", (job['job_id'],))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def get_job(job_id):
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute("SELECT * FROM purge_jobs WHERE job_id = %s", (job_id,))
+    job = cursor.fetchone()
+    cursor.close()
+    return job
+
+def run_job(job_id, batch_size=None, pause=0.0, on_progress=None, progress_interval=5.0):
+    """Select (if needed) and delete the users of a purge job; safe to call again after an interruption."""
+    db = get_db()
+    config = current_app.config
+    batch_size = batch_size or config['PURGE_BATCH_SIZE']
+    job = get_job(job_id)
+    if job is None:
+        raise PurgeFailed(f"No purge job {job_id}")
+    if job['status'] == 'selecting':
+        _select_inactive(job, config['PURGE_SELECT_WINDOW'])
+
+    reported = time.monotonic()
+    try:
+        while True:
+            cursor = db.cursor()
+            cursor.execute("SELECT userID FROM purge_job_users WHERE job_id = %s ORDER BY userID LIMIT 1000", (job_id,))
+            user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                purge_user(user_id, batch_size, pause, job_id=job_id)
+                if on_progress and time.monotonic() - reported >= progress_interval:
+                    invalidate(*PURGED_TABLES)
+                    on_progress(get_job(job_id))
+                    reported = time.monotonic()
+
+        cursor = db.cursor()
+        cursor.execute("UPDATE purge_jobs SET status = 'done' WHERE job_id = %s", (job_id,))
+        db.commit()
+        cursor.close()
+    finally:
+        # Users deleted before a failure (PurgeFailed, a lost connection) are gone too
+        invalidate(*PURGED_TABLES)
+    return get_job(job_id)
+
+
+def _describe(job):
+    return (f"job {job['job_id']} [{job['status']}]: {job['users_done']}/{job['users_total']} users, "
+            f"{job['subscriptions_deleted']} subscriptions, {job['payments_deleted']} payments, "
+            f"{job['ratings_deleted']} ratings deleted")
+
+def _read_ids(ids, ids_file):
+    values = list(ids)
+    if ids_file is not None:
+        values += [line.strip() for line in ids_file if line.strip()]
+    try:
+        return [int(value) for value in values]
+    except ValueError as e:
+        raise click.BadParameter(f"user ids must be integers ({e})")
+
+
+@click.command('purge-users')
+@click.argument('ids', nargs=-1)
+@click.option('--ids-file', type=click.File('r'), help='File with one user id per line.')
+@click.option('--inactive-years', type=int, help='Purge users with no activity in this many years.')
+@click.option('--resume', 'resume_job', type=int, help='Continue an interrupted purge job.')
+@click.option('--batch-size', type=int, default=None, help='Rows deleted per transaction.')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def purge_users_command(ids, ids_file, inactive_years, resume_job, batch_size, pause):
+    """Delete users with their subscriptions, payments and ratings in short batches."""
+    chosen = sum(1 for given in (ids or ids_file, inactive_years is not None, resume_job is not None) if given)
+    if chosen != 1:
+        raise click.UsageError("Give user ids (or --ids-file), --inactive-years or --resume")
+
+    if resume_job is not None:
+        job_id = resume_job
+    elif inactive_years is not None:
+        if inactive_years < 1:
+            raise click.BadParameter("must be at least 1", param_hint='--inactive-years')
+        today = datetime.date.today()
+        try:
+            cutoff = today.replace(year=today.year - inactive_years)
+        except ValueError:
+            cutoff = today.replace(year=today.year - inactive_years, day=28)    # 29 February
+        job_id = create_job(f"inactive since {cutoff}", inactive_before=cutoff)
+    else:
+        user_ids = _read_ids(ids, ids_file)
+        job_id = create_job(f"{len(user_ids)} listed users", user_ids=user_ids)
+    click.echo(f"Purge job {job_id} (resume with `flask purge-users --resume {job_id}`)")
+
+    try:
+        job = run_job(job_id, batch_size, pause, on_progress=lambda job: click.echo(_describe(job)))
+    except PurgeFailed as e:
+        raise click.ClickException(str(e))
+    click.echo(_describe(job))
+
+@click.command('purge-status')
+@click.argument('job_id', type=int, required=False)
+def purge_status_command(job_id):
+    """Show the progress of purge jobs (all unfinished ones by default)."""
+    cursor = get_db().cursor(dictionary=True)
+    if job_id is None:
+        cursor.execute("SELECT * FROM purge_jobs WHERE status <> 'done' ORDER BY job_id")
+    else:
+        cursor.execute("SELECT * FROM purge_jobs WHERE job_id = %s", (job_id,))
+    jobs = cursor.fetchall()
+    cursor.close()
+    if not jobs:
+        click.echo("No purge jobs.")
+    for job in jobs:
+        click.echo(f"{_describe(job)} - {job['description']}, updated {job['updated_at']}")
+
+def init_purge(app):
+    app.cli.add_command(purge_users_command)
+    app.cli.add_command(purge_status_command)
@@ -1,55 +1,334 @@
 # queries.py
+#
+# Data access layer used by the routes.
+#
+# Statements are registered once by name (see STATEMENTS below; other modules
+# add their own with register()). On each pooled connection every statement
+# gets its own server-side prepared cursor the first time it runs, and that
+# cursor is kept with the connection. Later runs only send the parameters
+# (COM_STMT_EXECUTE), so MySQL does not parse or plan the SQL again and no
+# new cursor is set up. The cache is bounded per connection
+# (PREPARED_STATEMENTS_PER_CONNECTION) and closing a connection frees its
+# statements.
+#
+# Rows come back as Row objects: tuples with named, read-only fields and no
+# per-row dict. row.title, row['title'] and row[1] all work, so templates and
+# the pagination code use them like the dict rows they replace. Use
+# row._asdict() where a real dict is needed (e.g. JSON objects).
+#
+# fetch_* calls are reads and go through get_read_db() (a replica when one can
+# serve the request, see db.py); execute() always runs on the primary.
+#
+# With PREPARED_STATEMENTS off, the same calls run as plain text-protocol
+# queries (for proxies that do not support the binary protocol).
 
-from .db import get_db
-
-def get_all_subscriptions():
-    db=get_db()
-    cursor=db.cursor(dictionary=True)
-    cursor.execute("""
-                   SELECT subscription_id FROM subscriptions""")
-    return cursor.fetchall()
-
-# Payment Queries
-def get_all_payments():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT p.payment_id, p.payment_amount, p.card_no, p.payment_date, p.payment_method, s.subscription_id
-        FROM payments p
-        JOIN subscriptions s ON p.subscription_id = s.subscription_id
-    """)
-    return cursor.fetchall()
-
-def add_payment(payment_amount, card_no, payment_date, payment_method, subscription_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("""
-        INSERT INTO payments (payment_amount, card_no, payment_date, payment_method, subscription_id)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (payment_amount, card_no, payment_date, payment_method, subscription_id))
-    db.commit()
-
-def get_payment_by_id(payment_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM payments WHERE payment_id = %s", (payment_id,))
-    return cursor.fetchone()
-
-def update_payment(payment_id, payment_amount, card_no, payment_date, payment_method, subscription_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        UPDATE payments
-        SET payment_amount = %s, card_no = %s, payment_date = %s, payment_method = %s, subscription_id = %s
-        WHERE payment_id = %s
-        """,
-        (payment_amount, card_no, payment_date, payment_method, subscription_id, payment_id)
-    )
-    db.commit()
-
-def delete_payment(payment_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM payments WHERE payment_id = %s", (payment_id,))
-    db.commit()
\ No newline at end of file
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+
+from flask import current_app
+
+from mysql.connector import errors
+
+from .db import get_db, get_read_db, is_replica, replica_failed
+
+STATEMENTS = {}
+PAGES = {}      # list page statement -> (sort keys, descending), see pagination.fetch_page
+
+def register(name, sql):
+    if name in STATEMENTS and STATEMENTS[name] != sql:
+        raise ValueError(f"Statement {name} is already registered")
+    STATEMENTS[name] = sql
+    return name
+
+def register_page(name, sql, keys, descending=False):
+    # A SELECT ... FROM without WHERE/ORDER BY/LIMIT, paged by the unique, indexed keys
+    PAGES[name] = (list(keys), descending)
+    return register(name, sql)
+
+
+class Row(tuple):
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return tuple.__getitem__(self, self._index[key])
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._fields
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return 'Row(' + ', '.join(f"{f}={v!r}" for f, v in zip(self._fields, self)) + ')'
+
+
+_row_types = {}
+_row_types_lock = threading.Lock()
+
+def row_type(fields):
+    # One Row subclass per column list, shared by every statement that returns it
+    fields = tuple(fields)
+    cls = _row_types.get(fields)
+    if cls is None:
+        namespace = {'__slots__': (), '_fields': fields, '_index': {f: i for i, f in enumerate(fields)}}
+        for i, field in enumerate(fields):
+            if field.isidentifier() and not hasattr(Row, field):
+                namespace[field] = property(itemgetter(i))
+        cls = type('Row', (Row,), namespace)
+        with _row_types_lock:
+            cls = _row_types.setdefault(fields, cls)
+    return cls
+
+
+class PreparedStatement:
+    __slots__ = ('sql', 'cursor', 'row_type')
+
+    def __init__(self, sql, cursor):
+        self.sql = sql          # the exact str object the cursor was prepared with
+        self.cursor = cursor
+        self.row_type = None
+
+
+class StatementCache:
+    # Prepared cursors of one connection, least recently used first
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()    # sql -> PreparedStatement
+
+    def get(self, db, sql):
+        statement = self.entries.get(sql)
+        if statement is not None:
+            self.entries.move_to_end(sql)
+            _counters['reused'] += 1
+            return statement
+        statement = PreparedStatement(sql, db.cursor(prepared=True))
+        self.entries[sql] = statement
+        _counters['prepared'] += 1
+        while len(self.entries) > self.size:
+            _, evicted = self.entries.popitem(last=False)
+            evicted.cursor.close()      # deallocates the statement on the server
+            _counters['evicted'] += 1
+        return statement
+
+    def discard(self, sql):
+        statement = self.entries.pop(sql, None)
+        if statement is not None:
+            try:
+                statement.cursor.close()
+            except errors.Error:
+                pass                    # the connection is already gone
+
+
+# Process-wide totals; approximate under concurrency, which is fine for stats
+_counters = {'prepared': 0, 'reused': 0, 'evicted': 0, 'text': 0}
+
+def statement_stats():
+    return dict(_counters, registered=len(STATEMENTS))
+
+
+def _statement_cache(db):
+    # Kept on the pooled connection itself (not the metrics wrapper), so it
+    # lives exactly as long as the connection
+    conn = getattr(db, 'wrapped', db)
+    cache = getattr(conn, '_statement_cache', None)
+    if cache is None:
+        cache = StatementCache(current_app.config.get('PREPARED_STATEMENTS_PER_CONNECTION', 64))
+        conn._statement_cache = cache
+    return cache
+
+def _run(statement, params, read=False):
+    # statement is a registered name or SQL text (e.g. built by pagination.py)
+    sql = STATEMENTS.get(statement, statement)
+    if not read:
+        return _run_on(get_db(), sql, params)
+    db = get_read_db()
+    try:
+        return _run_on(db, sql, params)
+    except (errors.OperationalError, errors.InterfaceError):
+        if not is_replica(db):
+            raise
+        # The replica went away mid-request: retry once on the primary
+        replica_failed()
+        return _run_on(get_db(), sql, params)
+
+def _run_on(db, sql, params):
+    if not current_app.config.get('PREPARED_STATEMENTS', True):
+        _counters['text'] += 1
+        cursor = db.cursor()
+        cursor.execute(sql, tuple(params))
+        return None, cursor
+
+    prepared = _statement_cache(db).get(db, sql)
+    try:
+        prepared.cursor.execute(prepared.sql, tuple(params))
+    except Exception:
+        # Leave no half-read or broken cursor behind for the next caller
+        _statement_cache(db).discard(sql)
+        raise
+    return prepared, prepared.cursor
+
+
+def _rows(prepared, cursor, raw):
+    if prepared is None:
+        cls = row_type(cursor.column_names)
+        cursor.close()
+    else:
+        if prepared.row_type is None:
+            prepared.row_type = row_type(cursor.column_names)
+        cls = prepared.row_type
+    make = tuple.__new__
+    return [make(cls, row) for row in raw]
+
+def fetch_all(statement, params=()):
+    """Run a SELECT and return all rows as Row objects."""
+    prepared, cursor = _run(statement, params, read=True)
+    return _rows(prepared, cursor, cursor.fetchall())
+
+def fetch_one(statement, params=()):
+    """Run a SELECT and return its first row, or None."""
+    # fetchall, not fetchone: the cursor is reused, so no rows may be left unread
+    rows = fetch_all(statement, params)
+    return rows[0] if rows else None
+
+def fetch_tuples(statement, params=()):
+    """Run a SELECT and return plain tuples (for callers that only index by position)."""
+    prepared, cursor = _run(statement, params, read=True)
+    rows = cursor.fetchall()
+    if prepared is None:
+        cursor.close()
+    return rows
+
+def padded(values):
+    """values for an IN (...) list, padded to the next power of two by repeating the last one.
+
+    Only a handful of distinct statements then get prepared, whatever the list length.
+    """
+    values = list(values)
+    return values + [values[-1]] * ((1 << (len(values) - 1).bit_length()) - len(values))
+
+def in_list(column, values):
+    """(condition, params) for `column IN (...)` over a non-empty list of values, padded."""
+    values = padded(values)
+    return f"{column} IN ({', '.join(['%s'] * len(values))})", values
+
+def execute(statement, params=()):
+    """Run an INSERT/UPDATE/DELETE and return the number of rows it changed.
+
+    The caller commits, as before; the statement joins the request's transaction.
+    """
+    prepared, cursor = _run(statement, params)
+    count = cursor.rowcount
+    if prepared is None:
+        cursor.close()
+    return count
+
+def insert(statement, params=()):
+    """Run an INSERT and return the AUTO_INCREMENT id it generated (the caller commits)."""
+    prepared, cursor = _run(statement, params)
+    row_id = cursor.lastrowid
+    if prepared is None:
+        cursor.close()
+    return row_id
+
+
+# Statements used by the routes (app/routes.py)
+
+# List pages, completed with WHERE/ORDER BY/LIMIT by pagination.fetch_page
+register_page('movies_page', "SELECT movieid, title, release_date, duration, description FROM movies",
+              ['movieid'])
+# Sorted by userID in descending order (newest first)
+register_page('users_page', "SELECT userid, userName, email, date_of_birth FROM users",
+              ['userid'], descending=True)
+register_page('genres_page', """
+    SELECT mg.movieid, m.title, mg.movie_genre
+    FROM movie_genre mg
+    JOIN movies m ON mg.movieid = m.movieid
+""", ['mg.movieid', 'mg.movie_genre'])
+register_page('subscriptions_page',
+              "SELECT subscription_id, userID, startdate, end_Date, subscription_status FROM subscriptions",
+              ['subscription_id'])
+register_page('payments_page', """
+    SELECT p.payment_id, p.payment_amount, p.card_no, p.payment_date, p.payment_method, s.subscription_id
+    FROM payments p
+    JOIN subscriptions s ON p.subscription_id = s.subscription_id
+""", ['p.payment_id'])
+register_page('ratings_page', "SELECT userID, movieid, ratingScore, review, ratingDate FROM ratings",
+              ['userID', 'movieid'])
+
+# Movies
+register('movie_by_id', "SELECT * FROM movies WHERE movieid = %s")
+register('insert_movie', "INSERT INTO movies (title, release_date, duration, description) VALUES (%s, %s, %s, %s)")
+register('update_movie',
+         "UPDATE movies SET title=%s, release_date=%s, duration=%s, description=%s WHERE movieid=%s")
+register('delete_movie', "DELETE FROM movies WHERE movieid=%s")
+
+# Users
+register('user_by_id', "SELECT * FROM users WHERE userID = %s")
+register('insert_user', "INSERT INTO users (userName, email, password, date_of_birth) VALUES (%s, %s, %s, %s)")
+register('update_user', """
+    UPDATE users
+    SET userName = %s, email = %s, password = %s, date_of_birth = %s
+    WHERE userID = %s
+""")
+
+# Genres
+register('genre_by_key', """
+    SELECT mg.movieid, m.title, mg.movie_genre
+    FROM movie_genre mg
+    JOIN movies m ON mg.movieid = m.movieid
+    WHERE mg.movieid=%s AND mg.movie_genre=%s
+""")
+register('insert_genre', "INSERT INTO movie_genre (movieid, movie_genre) VALUES (%s, %s)")
+register('update_genre', "UPDATE movie_genre SET movie_genre=%s WHERE movieid=%s AND movie_genre=%s")
+register('delete_genre', "DELETE FROM movie_genre WHERE movieid=%s AND movie_genre=%s")
+
+# Subscriptions
+register('subscription_by_id', "SELECT * FROM subscriptions WHERE subscription_id = %s")
+register('insert_subscription', """
+    INSERT INTO subscriptions (userID, startdate, end_Date, subscription_status)
+    VALUES (%s, %s, %s, %s)
+""")
+register('update_subscription', """
+    UPDATE subscriptions
+    SET userID = %s, startdate = %s, end_Date = %s, subscription_status = %s
+    WHERE subscription_id = %s
+""")
+
+# Payments
+register('payment_by_id', "SELECT * FROM payments WHERE payment_id = %s")
+register('insert_payment', """
+    INSERT INTO payments (payment_amount, card_no, payment_date, payment_method, subscription_id)
+    VALUES (%s, %s, %s, %s, %s)
+""")
+register('update_payment', """
+    UPDATE payments
+    SET payment_amount = %s, card_no = %s, payment_date = %s, payment_method = %s, subscription_id = %s
+    WHERE payment_id = %s
+""")
+register('delete_payment', "DELETE FROM payments WHERE payment_id = %s")
+
+# Ratings
+register('rating_by_key', "SELECT * FROM ratings WHERE movieid = %s AND userID = %s")
+register('insert_rating', """
+    INSERT INTO ratings (userID, movieID, ratingScore, review, ratingDate)
+    VALUES (%s, %s, %s, %s, %s)
+""")
+register('update_rating', """
+    UPDATE ratings
+    SET ratingScore = %s, review = %s, ratingDate = %s
+    WHERE movieid = %s AND userID = %s
+""")
+register('delete_rating', "DELETE FROM ratings WHERE movieid = %s AND userID = %s")
@@ -0,0 +1,453 @@
+# recommend.py
+#
+# "Similar movies" and per-user recommendations from the ratings table.
+#
+# `flask recommend-refresh` loads ratings(userID, movieid, ratingScore) into a
+# sparse user x movie matrix and computes item-item cosine similarity with
+# SciPy, a block of movies at a time, keeping the top K neighbours of each
+# movie. The index is three flat arrays saved as .npy files:
+#
+#   movie_ids  int32[M]       sorted ids of the movies that have ratings
+#   neighbors  int32[M, K]    ids of the most similar movies, best first (-1 = none)
+#   scores     float32[M, K]  their similarity
+#
+# Workers memory-map the files, so every process on a host shares one copy and
+# a request is a binary search plus a row read.
+#
+# The cosine similarity of two movies depends only on their two rating columns.
+# After the first build, a refresh therefore recomputes only the movies marked
+# in movie_rating_changes (see database/movie_streaming_recommend.sql) and
+# patches the neighbour lists of the other movies. A list that loses a
+# neighbour cannot get back the candidates that were cut off at K;
+# `--full` rebuilds everything.
+#
+# NumPy and SciPy are optional: only the refresh and the recommendation
+# routes need them.
+
+import datetime
+import json
+import os
+import shutil
+import time
+
+import click
+from flask import current_app
+
+from .bench import peak_rss_kb, percentile
+from .db import get_db, get_read_db
+
+try:
+    import numpy as np
+    import scipy.sparse as sparse
+except ImportError:
+    np = sparse = None
+
+MAX_SCORE = 5.0  # ratingScore is between 0 and 5
+
+
+class RecommendationsUnavailable(Exception):
+    pass
+
+def _require_numpy():
+    if np is None:
+        raise RecommendationsUnavailable("Recommendations need numpy and scipy (pip install numpy scipy)")
+
+
+class SimilarityIndex:
+    def __init__(self, movie_ids, neighbors, scores, meta=None):
+        self.movie_ids = movie_ids
+        self.neighbors = neighbors
+        self.scores = scores
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def nbytes(self):
+        return self.movie_ids.nbytes + self.neighbors.nbytes + self.scores.nbytes
+
+    def positions(self, ids):
+        # Row of each id, or -1 for ids that are not in the index
+        ids = np.asarray(ids, dtype=np.int32)
+        if not len(self.movie_ids):
+            return np.full(ids.shape, -1, dtype=np.intp)
+        pos = np.searchsorted(self.movie_ids, ids)
+        pos = np.minimum(pos, len(self.movie_ids) - 1)
+        return np.where(self.movie_ids[pos] == ids, pos, -1)
+
+    def similar(self, movie_id, limit=10):
+        """[(movieid, score), ...] best first; empty for unknown movies."""
+        pos = self.positions([movie_id])[0]
+        if pos < 0:
+            return []
+        neighbors, scores = self.neighbors[pos, :limit], self.scores[pos, :limit]
+        return [(int(n), float(s)) for n, s in zip(neighbors, scores) if n >= 0]
+
+    def recommend(self, rated, limit=10):
+        """Movies similar to the ones a user rated, weighted by their ratings.
+
+        rated is [(movieid, ratingScore), ...]; movies already rated are left out.
+        """
+        if not rated:
+            return []
+        ids = np.array([m for m, _ in rated], dtype=np.int32)
+        weights = np.array([s for _, s in rated], dtype=np.float32) / MAX_SCORE
+        pos = self.positions(ids)
+        found = pos >= 0
+        neighbors = self.neighbors[pos[found]].ravel()
+        scores = (self.scores[pos[found]] * weights[found, None]).ravel()
+
+        keep = (neighbors >= 0) & ~np.isin(neighbors, ids)
+        candidates, inverse = np.unique(neighbors[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=scores[keep])
+        best = np.argsort(-totals, kind='stable')[:limit]
+        return [(int(candidates[i]), float(totals[i])) for i in best]
+
+    def save(self, directory):
+        os.makedirs(directory)
+        np.save(os.path.join(directory, 'movie_ids.npy'), self.movie_ids)
+        np.save(os.path.join(directory, 'neighbors.npy'), self.neighbors)
+        np.save(os.path.join(directory, 'scores.npy'), self.scores)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(directory, 'movie_ids.npy'), mmap_mode=mode),
+            np.load(os.path.join(directory, 'neighbors.npy'), mmap_mode=mode),
+            np.load(os.path.join(directory, 'scores.npy'), mmap_mode=mode),
+            meta,
+        )
+
+
+# Index versions on disk: <path>/<version>/*.npy, with <path>/CURRENT naming the live one
+
+def current_version(path):
+    try:
+        with open(os.path.join(path, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def load_index(path, mmap=True):
+    version = current_version(path)
+    if version is None:
+        return None
+    return SimilarityIndex.load(os.path.join(path, version), mmap)
+
+def save_index(index, path, keep=2):
+    version = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+    index.meta['version'] = version
+    index.save(os.path.join(path, version))
+    # Switch atomically, then drop old versions (processes that still map
+    # their files keep reading them until they reload)
+    with open(os.path.join(path, 'CURRENT.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(path, 'CURRENT.tmp'), os.path.join(path, 'CURRENT'))
+    versions = sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return version
+
+
+def get_index(app=None):
+    # The process keeps the mapped index and looks for a newer version at most
+    # once every RECOMMEND_RELOAD_INTERVAL seconds
+    _require_numpy()
+    app = app or current_app._get_current_object()
+    state = app.extensions.setdefault('similarity_index', {'index': None, 'version': None, 'checked': None})
+    now = time.monotonic()
+    if state['checked'] is None or now - state['checked'] >= app.config.get('RECOMMEND_RELOAD_INTERVAL', 30):
+        state['checked'] = now
+        path = app.config['RECOMMEND_INDEX_PATH']
+        version = current_version(path)
+        if version is not None and version != state['version']:
+            state['index'] = SimilarityIndex.load(os.path.join(path, version))
+            state['version'] = version
+    if state['index'] is None:
+        raise RecommendationsUnavailable("The similar-movies index has not been built; run `flask recommend-refresh`")
+    return state['index']
+
+
+def recommend_limit(requested):
+    default = current_app.config.get('RECOMMEND_LIMIT', 10)
+    maximum = current_app.config.get('RECOMMEND_TOP_K', 50)
+    return max(1, min(requested or default, maximum))
+
+def _with_titles(pairs):
+    # One primary-key lookup for all titles
+    if not pairs:
+        return []
+    ids = [movie_id for movie_id, _ in pairs]
+    cursor = get_read_db().cursor()
+    cursor.execute(f"SELECT movieid, title FROM movies WHERE movieid IN ({', '.join(['%s'] * len(ids))})", tuple(ids))
+    titles = dict(cursor.fetchall())
+    cursor.close()
+    return [{'movieid': m, 'title': titles[m], 'score': round(s, 4)} for m, s in pairs if m in titles]
+
+def user_ratings(user_id):
+    cursor = get_read_db().cursor()
+    cursor.execute("SELECT movieid, ratingScore FROM ratings WHERE userID = %s AND ratingScore IS NOT NULL", (user_id,))
+    rated = cursor.fetchall()
+    cursor.close()
+    return rated
+
+def similar_movies(movie_id, limit=None):
+    return _with_titles(get_index().similar(movie_id, recommend_limit(limit)))
+
+def recommendations_for_user(user_id, limit=None):
+    return _with_titles(get_index().recommend(user_ratings(user_id), recommend_limit(limit)))
+
+
+# Building the index
+
+def load_ratings(fetch_size=100000):
+    # Stream the ratings into flat arrays instead of a list of row tuples
+    cursor = get_db().cursor(buffered=False)
+    cursor.execute("SELECT userID, movieid, ratingScore FROM ratings WHERE ratingScore IS NOT NULL")
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    cursor.close()
+    if not chunks:
+        return None
+    table = np.concatenate(chunks)
+    return table[:, 0].astype(np.int32), table[:, 1].astype(np.int32), table[:, 2].astype(np.float32)
+
+def rating_matrix(users, movies, scores):
+    # Columns are the distinct movie ids in ascending order
+    movie_ids, columns = np.unique(movies, return_inverse=True)
+    user_ids, rows = np.unique(users, return_inverse=True)
+    matrix = sparse.csr_matrix((scores, (rows, columns)), shape=(len(user_ids), len(movie_ids)), dtype=np.float32)
+    return movie_ids.astype(np.int32), matrix
+
+class _Similarity:
+    # Item-item cosine similarity, computed a block of movies at a time so memory
+    # stays at block_size x M dense floats whatever the catalogue size
+
+    def __init__(self, matrix, min_common, shrinkage):
+        self.by_movie = matrix.T.tocsr()                 # M x U
+        self.binary = self.by_movie.copy()
+        self.binary.data[:] = 1
+        self.norms = np.sqrt(np.asarray(self.by_movie.multiply(self.by_movie).sum(axis=1)).ravel())
+        self.min_common = min_common
+        self.shrinkage = shrinkage
+
+    def block(self, columns):
+        """Dense (len(columns), M) similarities of the given movie columns to every movie."""
+        dots = (self.by_movie[columns] @ self.by_movie.T).toarray()
+        common = (self.binary[columns] @ self.binary.T).toarray()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sims = dots / np.outer(self.norms[columns], self.norms)
+        np.nan_to_num(sims, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        # Pairs rated by few users in common are unreliable: shrink them towards zero
+        sims *= common / (common + self.shrinkage)
+        sims[common < self.min_common] = 0
+        sims[np.arange(len(columns)), columns] = 0
+        return sims
+
+def _top_k(sims, movie_ids, k):
+    n = min(k, sims.shape[1])
+    top = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+    top_scores = np.take_along_axis(sims, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    neighbors = np.full((len(sims), k), -1, dtype=np.int32)
+    scores = np.zeros((len(sims), k), dtype=np.float32)
+    positive = top_scores > 0
+    neighbors[:, :n] = np.where(positive, movie_ids[top], -1)
+    scores[:, :n] = np.where(positive, top_scores, 0)
+    return neighbors, scores
+
+def build_index(matrix, movie_ids, top_k, min_common, shrinkage, block_size):
+    similarity = _Similarity(matrix, min_common, shrinkage)
+    neighbors = np.full((len(movie_ids), top_k), -1, dtype=np.int32)
+    scores = np.zeros((len(movie_ids), top_k), dtype=np.float32)
+    for start in range(0, len(movie_ids), block_size):
+        columns = np.arange(start, min(start + block_size, len(movie_ids)))
+        neighbors[columns], scores[columns] = _top_k(similarity.block(columns), movie_ids, top_k)
+    return SimilarityIndex(movie_ids, neighbors, scores)
+
+def refresh_index(old, matrix, movie_ids, changed_ids, top_k, min_common, shrinkage, block_size):
+    """Recompute the changed movies and patch everyone else's neighbour lists.
+
+    Returns (index, number of movies recomputed).
+    """
+    similarity = _Similarity(matrix, min_common, shrinkage)
+    old_pos = old.positions(movie_ids) if old.neighbors.shape[1] == top_k else np.full(len(movie_ids), -1)
+    # Movies new to the index are computed like changed ones
+    changed = np.isin(movie_ids, changed_ids) | (old_pos < 0)
+    recompute = np.flatnonzero(changed)
+    keep = np.flatnonzero(~changed)
+
+    neighbors = np.full((len(movie_ids), top_k), -1, dtype=np.int32)
+    scores = np.zeros((len(movie_ids), top_k), dtype=np.float32)
+
+    # Unchanged movies start from their old lists, minus changed or vanished neighbours
+    kept_neighbors = np.array(old.neighbors[old_pos[keep]])
+    kept_scores = np.array(old.scores[old_pos[keep]])
+    stale = np.isin(kept_neighbors, changed_ids) | ~np.isin(kept_neighbors, movie_ids)
+    kept_neighbors[stale] = -1
+    kept_scores[stale] = 0
+    # A changed movie enters a full list only if it beats the weakest entry
+    threshold = kept_scores.min(axis=1) if len(keep) else np.zeros(0, dtype=np.float32)
+
+    rows = [np.repeat(np.arange(len(keep)), top_k)]
+    candidates = [kept_neighbors.ravel()]
+    candidate_scores = [kept_scores.ravel()]
+    for start in range(0, len(recompute), block_size):
+        columns = recompute[start:start + block_size]
+        sims = similarity.block(columns)
+        neighbors[columns], scores[columns] = _top_k(sims, movie_ids, top_k)
+        towards_kept = sims[:, keep]
+        hit_changed, hit_kept = np.nonzero(towards_kept > np.maximum(threshold, 0)[None, :])
+        rows.append(hit_kept)
+        candidates.append(movie_ids[columns[hit_changed]])
+        candidate_scores.append(towards_kept[hit_changed, hit_kept])
+
+    rows = np.concatenate(rows)
+    candidates = np.concatenate(candidates)
+    candidate_scores = np.concatenate(candidate_scores).astype(np.float32)
+    valid = candidates >= 0
+    rows, candidates, candidate_scores = rows[valid], candidates[valid], candidate_scores[valid]
+
+    # Best top_k candidates per kept row: sort by (row, -score), rank within each row
+    order = np.lexsort((-candidate_scores, rows))
+    rows, candidates, candidate_scores = rows[order], candidates[order], candidate_scores[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    best = rank < top_k
+    neighbors[keep[rows[best]], rank[best]] = candidates[best]
+    scores[keep[rows[best]], rank[best]] = candidate_scores[best]
+    return SimilarityIndex(movie_ids, neighbors, scores), len(recompute)
+
+
+@click.command('recommend-refresh')
+@click.option('--full', is_flag=True, help='Recompute every movie instead of only those whose ratings changed.')
+def refresh_command(full):
+    """Build or incrementally update the similar-movies index."""
+    try:
+        _require_numpy()
+    except RecommendationsUnavailable as e:
+        raise click.ClickException(str(e))
+    config = current_app.config
+    path = config['RECOMMEND_INDEX_PATH']
+    options = dict(top_k=config['RECOMMEND_TOP_K'], min_common=config['RECOMMEND_MIN_COMMON'],
+                   shrinkage=config['RECOMMEND_SHRINKAGE'], block_size=config['RECOMMEND_BLOCK_SIZE'])
+    started = time.perf_counter()
+
+    db = get_db()
+    cursor = db.cursor()
+    # Read the change marks before the ratings: a rating written during the
+    # refresh gets a newer mark, which the DELETE below leaves for the next run
+    cursor.execute("SELECT movieid, changed_at FROM movie_rating_changes")
+    marks = cursor.fetchall()
+    old = None if full else load_index(path, mmap=False)
+    if old is not None and not marks:
+        click.echo("No ratings changed since the last refresh")
+        return
+
+    loaded = load_ratings()
+    if loaded is None:
+        raise click.ClickException("There are no ratings to index")
+    users, movies, ratings = loaded
+    movie_ids, matrix = rating_matrix(users, movies, ratings)
+    load_seconds = time.perf_counter() - started
+
+    if old is None:
+        index = build_index(matrix, movie_ids, **options)
+        recomputed = len(movie_ids)
+    else:
+        changed_ids = np.array([m for m, _ in marks], dtype=np.int32)
+        index, recomputed = refresh_index(old, matrix, movie_ids, changed_ids, **options)
+
+    index.meta.update(options, built_at=datetime.datetime.now().isoformat(timespec='seconds'),
+                      ratings=int(matrix.nnz), users=int(matrix.shape[0]), movies=len(movie_ids),
+                      recomputed=recomputed, full=old is None)
+    os.makedirs(path, exist_ok=True)
+    version = save_index(index, path)
+
+    for start in range(0, len(marks), 1000):
+        cursor.executemany("DELETE FROM movie_rating_changes WHERE movieid = %s AND changed_at = %s",
+                           marks[start:start + 1000])
+        db.commit()
+    cursor.close()
+
+    click.echo(f"Index {version}: {len(movie_ids)} movies, {recomputed} recomputed, "
+               f"{matrix.nnz} ratings from {matrix.shape[0]} users")
+    click.echo(f"Loaded ratings in {load_seconds:.1f}s, total {time.perf_counter() - started:.1f}s, "
+               f"index {index.nbytes / 2**20:.1f} MiB, matrix {(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2**20:.1f} MiB, "
+               f"peak RSS {peak_rss_kb() / 1024:.0f} MiB")
+
+
+@click.command('recommend-bench')
+@click.option('--lookups', '-n', type=int, default=10000, show_default=True, help='Similar-movie lookups to time.')
+@click.option('--users', type=int, default=200, show_default=True, help='Per-user recommendations to time.')
+@click.option('--limit', type=int, default=10, show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help='Write the results as JSON.')
+def bench_command(lookups, users, limit, output):
+    """Measure the index's memory use and lookup latency."""
+    try:
+        _require_numpy()
+    except RecommendationsUnavailable as e:
+        raise click.ClickException(str(e))
+    rss_before = peak_rss_kb()
+    started = time.perf_counter()
+    index = load_index(current_app.config['RECOMMEND_INDEX_PATH'])
+    if index is None:
+        raise click.ClickException("The similar-movies index has not been built; run `flask recommend-refresh`")
+    load_ms = (time.perf_counter() - started) * 1000
+    rng = np.random.default_rng(0)
+
+    def timed(fn, args):
+        latencies = []
+        for arg in args:
+            started = time.perf_counter()
+            fn(arg)
+            latencies.append((time.perf_counter() - started) * 1e6)
+        latencies.sort()
+        return {'count': len(latencies), 'p50_us': round(percentile(latencies, 50), 1),
+                'p95_us': round(percentile(latencies, 95), 1), 'p99_us': round(percentile(latencies, 99), 1)}
+
+    results = {
+        'index': dict(index.meta, nbytes=index.nbytes, load_ms=round(load_ms, 2)),
+        'similar': timed(lambda m: index.similar(m, limit), rng.choice(index.movie_ids, lookups)),
+    }
+
+    # Users are sampled among the raters of random movies; their ratings are
+    # fetched first so the index lookup is timed on its own
+    sample = []
+    cursor = get_db().cursor()
+    for movie_id in rng.choice(index.movie_ids, users):
+        cursor.execute("SELECT userID FROM ratings WHERE movieid = %s LIMIT 1", (int(movie_id),))
+        row = cursor.fetchone()
+        if row:
+            started = time.perf_counter()
+            rated = user_ratings(row[0])
+            sample.append((rated, (time.perf_counter() - started) * 1e6))
+    cursor.close()
+    if sample:
+        results['recommend'] = timed(lambda rated: index.recommend(rated, limit), [rated for rated, _ in sample])
+        results['recommend']['mean_ratings_per_user'] = round(sum(len(r) for r, _ in sample) / len(sample), 1)
+        fetch = sorted(us for _, us in sample)
+        results['user_ratings_query'] = {'count': len(fetch), 'p50_us': round(percentile(fetch, 50), 1),
+                                         'p95_us': round(percentile(fetch, 95), 1), 'p99_us': round(percentile(fetch, 99), 1)}
+    results['peak_rss_kb'] = {'before_load': rss_before, 'after': peak_rss_kb()}
+
+    click.echo(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+def init_recommend(app):
+    app.cli.add_command(refresh_command)
+    app.cli.add_command(bench_command)
@@ -0,0 +1,183 @@
+# reports.py
+#
+# Queries behind the /reports page. Each report is cached (see cache.py) and
+# lists the tables it reads so that writes to those tables invalidate it.
+
+import datetime
+
+from mysql.connector import errorcode, errors
+
+from .cache import cached
+from .db import get_read_db
+
+REVENUE_PERIODS = ('day', 'week', 'month')
+REVENUE_SOURCES = ('rollup', 'payments')
+
+
+# The report SQL runs on plain dictionary cursors (the results are cached, see
+# cache.py); plancheck.py EXPLAINs these statements and builders as well.
+
+SUBSCRIPTION_STATUS_COUNTS_SQL = """
+    SELECT subscription_status, COUNT(*) AS total_users
+    FROM subscriptions
+    GROUP BY subscription_status
+"""
+
+# Sums the daily rollup (a few rows per day) rather than every payment
+TOTAL_REVENUE_SQL = "SELECT SUM(revenue) AS total_revenue FROM daily_revenue"
+
+# Walks the avg_rating index of movie_rating_stats from the top
+TOP_RATED_MOVIES_SQL = """
+    SELECT m.title, ROUND(s.avg_rating, 2) AS avg_rating, s.score_count AS total_ratings
+    FROM movie_rating_stats s
+    JOIN movies m ON m.movieid = s.movieid
+    WHERE s.score_count > 5
+    ORDER BY s.avg_rating DESC
+    LIMIT 10
+"""
+
+def top_movies_by_genre_sql(one_genre):
+    # Rank movies inside each genre in SQL so only n rows per genre leave the server.
+    # Per-movie averages come from movie_rating_stats, not from scanning ratings.
+    # Parameters: min_ratings, the genre if one_genre, n.
+    genre_filter = "WHERE mg.movie_genre = %s" if one_genre else ""
+    return f"""
+        SELECT movie_genre, title, avg_rating, total_ratings
+        FROM (
+            SELECT mg.movie_genre, m.title, a.avg_rating, a.total_ratings,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY mg.movie_genre
+                       ORDER BY a.avg_rating DESC, a.total_ratings DESC, m.movieid
+                   ) AS genre_rank
+            FROM (
+                SELECT movieid, ROUND(avg_rating, 2) AS avg_rating, score_count AS total_ratings
+                FROM movie_rating_stats
+                WHERE score_count >= %s
+            ) a
+            JOIN movie_genre mg ON mg.movieid = a.movieid
+            JOIN movies m ON m.movieid = a.movieid
+            {genre_filter}
+        ) ranked
+        WHERE genre_rank <= %s
+        ORDER BY movie_genre, genre_rank
+    """
+
+def revenue_sql(source, one_method):
+    # (day, payment_method, revenue, payments), one row per day and method.
+    # The rollup answers from its primary key; the payments path is a range scan
+    # of the covering payment_date index. Parameters: start, end, the method if one_method.
+    method_filter = "AND payment_method = %s" if one_method else ""
+    if source == 'rollup':
+        return f"""
+            SELECT day, payment_method, revenue, payments
+            FROM daily_revenue
+            WHERE day BETWEEN %s AND %s {method_filter}
+        """
+    return f"""
+        SELECT payment_date, COALESCE(payment_method, ''), SUM(payment_amount), COUNT(*)
+        FROM payments
+        WHERE payment_date BETWEEN %s AND %s AND payment_amount IS NOT NULL {method_filter}
+        GROUP BY 1, 2
+    """
+
+
+def _subscription_status_counts():
+    cursor = get_read_db().cursor(dictionary=True)
+    cursor.execute(SUBSCRIPTION_STATUS_COUNTS_SQL)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def _total_revenue():
+    cursor = get_read_db().cursor(dictionary=True)
+    cursor.execute(TOTAL_REVENUE_SQL)
+    total = cursor.fetchone()['total_revenue']
+    cursor.close()
+    return total
+
+def _top_rated_movies():
+    cursor = get_read_db().cursor(dictionary=True)
+    cursor.execute(TOP_RATED_MOVIES_SQL)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def _top_movies_by_genre(n, min_ratings, genre=None):
+    params = [min_ratings] + ([genre] if genre is not None else []) + [n]
+    cursor = get_read_db().cursor(dictionary=True)
+    cursor.execute(top_movies_by_genre_sql(genre is not None), params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    top_movies_by_genre = {}
+    for row in rows:
+        top_movies_by_genre.setdefault(row['movie_genre'], []).append({
+            'title': row['title'],
+            'avg_rating': row['avg_rating'],
+            'total_ratings': row['total_ratings'],
+        })
+    return top_movies_by_genre
+
+def _period_start(day, period):
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())   # weeks start on Monday
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+def _revenue_rows(cursor, source, start, end, method):
+    params = [start, end] + ([method] if method is not None else [])
+    cursor.execute(revenue_sql(source, method is not None), params)
+    return cursor.fetchall()
+
+def _revenue(start, end, period, method, source):
+    cursor = get_read_db().cursor()
+    try:
+        try:
+            rows = _revenue_rows(cursor, source, start, end, method)
+        except errors.ProgrammingError as e:
+            if source != 'rollup' or e.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            source = 'payments'    # rollup not installed yet
+            rows = _revenue_rows(cursor, source, start, end, method)
+    finally:
+        cursor.close()
+
+    buckets = {}
+    for day, payment_method, revenue, payments in rows:
+        bucket = buckets.setdefault(_period_start(day, period), {'revenue': 0, 'payments': 0, 'by_method': {}})
+        bucket['revenue'] += int(revenue)
+        bucket['payments'] += int(payments)
+        by_method = bucket['by_method']
+        key = payment_method or 'unknown'
+        by_method[key] = by_method.get(key, 0) + int(revenue)
+
+    series = [dict(bucket, period_start=period_start.isoformat())
+              for period_start, bucket in sorted(buckets.items())]
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'period': period,
+        'method': method,
+        'source': source,
+        'total_revenue': sum(b['revenue'] for b in series),
+        'total_payments': sum(b['payments'] for b in series),
+        'series': series,
+    }
+
+
+def subscription_status_counts():
+    return cached('subscription_status_counts', ('subscriptions',), _subscription_status_counts)
+
+def total_revenue():
+    return cached('total_revenue', ('payments',), _total_revenue)
+
+def top_rated_movies():
+    return cached('top_rated_movies', ('movies', 'ratings'), _top_rated_movies)
+
+def top_movies_by_genre(n, min_ratings, genre=None):
+    return cached('top_movies_by_genre', ('movie_genre', 'movies', 'ratings'),
+                  _top_movies_by_genre, n, min_ratings, genre)
+
+def revenue(start, end, period='day', method=None, source='rollup'):
+    return cached('revenue', ('payments',), _revenue, start, end, period, method, source)
@@ -1,48 +1,36 @@
-from flask import Blueprint, request, render_template, redirect, url_for
-from .db import get_db
+import datetime
+
+from flask import Blueprint, Response, current_app, request, render_template, redirect, url_for, jsonify, stream_with_context
+from .cache import invalidate, get_cache
+from .db import get_db, get_replicas
+from .expiry import expiry_status
+from . import facets
+from .exporter import export, FORMATS as EXPORT_FORMATS
+from .importer import import_csv, open_upload
+from .ingest import enqueue_rating, ingest_status
+from .pagination import fetch_page, page_limit
+from . import queries
+from .profile import SECTIONS as PROFILE_SECTIONS, load_profile, profile_json
+from .purge import PURGED_TABLES, purge_subscription, purge_user
+from .recommend import RecommendationsUnavailable, recommendations_for_user, similar_movies
+from . import reports as report_queries
+from .server import readiness
+from .search import search_movies, search_users, suggest_movies, suggest_subscriptions, suggest_users
+from .stats import get_dashboard_stats, get_movie_rating_stats
+from .versions import page_cache_stats, versioned_page
 
 main = Blueprint('main', __name__)
 
 @main.route('/')
 def dashboard():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
-    # Total Users
-    cursor.execute("SELECT COUNT(*) AS total_users FROM users")
-    total_users = cursor.fetchone()['total_users']
-
-    # Monthly Revenue
-    cursor.execute("""
-        SELECT SUM(payment_amount) AS monthly_revenue 
-        FROM payments 
-        WHERE MONTH(payment_date) = MONTH(CURDATE())
-    """)
-    monthly_revenue = cursor.fetchone()['monthly_revenue']
-
-    # Total Subscriptions
-    cursor.execute("SELECT COUNT(*) AS total_subscriptions FROM subscriptions")
-    total_subscriptions = cursor.fetchone()['total_subscriptions']
-
-    # Most Reviewed Movie
-    cursor.execute("""
-        SELECT m.title, COUNT(r.movieid) AS review_count
-        FROM movies m
-        JOIN ratings r ON m.movieid = r.movieid
-        GROUP BY m.movieid
-        ORDER BY review_count DESC
-        LIMIT 1
-    """)
-    most_reviewed_movie = cursor.fetchone()
-
-    cursor.close()
-    db.close()
+    # Metrics are maintained incrementally by triggers (see app/stats.py)
+    stats = get_dashboard_stats()
 
     return render_template('dashboard.html', 
-                           total_users=total_users, 
-                           monthly_revenue=monthly_revenue, 
-                           total_subscriptions=total_subscriptions,
-                           most_reviewed_movie=most_reviewed_movie)
+                           total_users=stats['total_users'], 
+                           monthly_revenue=stats['monthly_revenue'], 
+                           total_subscriptions=stats['total_subscriptions'],
+                           most_reviewed_movie=stats['most_reviewed_movie'])
 
 
 
@@ -50,11 +38,34 @@ def dashboard():
 # Movie Routes
 @main.route('/movies') 
 def list_movies():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT movieid, title, release_date, duration, description FROM movies")
-    movies = cursor.fetchall()
-    return render_template('movies.html', movies=movies)
+    # ?genre=, ?match=all|any, ?year= and ?min_rating= browse through the in-memory
+    # facet index (see facets.py); the plain list is a cached, versioned page
+    try:
+        filters = facets.parse_filters(request.args)
+    except ValueError as e:
+        return str(e), 400
+    if filters is None:
+        return _all_movies()
+
+    page, genre_counts, total = facets.browse_movies(filters, request.args.get('cursor'), page_limit())
+    selected = {g.casefold() for g in filters['genres']}
+    args = {k: v for k, v in request.args.items() if k in ('match', 'year', 'min_rating', 'limit') and v}
+
+    def toggle_url(genre):
+        # The current filters with this genre added or removed
+        genres = [g for g in filters['genres'] if g.casefold() != genre.casefold()]
+        if genre.casefold() not in selected:
+            genres.append(genre)
+        return url_for('main.list_movies', genre=genres, **args)
+
+    return render_template('movies.html', movies=page.rows, page=page, filters=filters, total=total,
+                           genre_counts=genre_counts, selected=selected, toggle_url=toggle_url,
+                           page_args=dict({k: v for k, v in args.items() if k != 'limit'}, genre=filters['genres']))
+
+@versioned_page('movies')
+def _all_movies():
+    page = fetch_page('movies_page')
+    return render_template('movies.html', movies=page.rows, page=page)
 
 @main.route('/movies/add', methods=['GET', 'POST'])
 def add_movie():
@@ -64,59 +75,47 @@ def add_movie():
         duration = request.form['duration']
         description = request.form['description']
 
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute(
-            "INSERT INTO movies (title, release_date, duration, description) VALUES (%s, %s, %s, %s)",
-            (title, release_date, duration, description)
-        )
-        db.commit()
+        movie_id = queries.insert('insert_movie', (title, release_date, duration, description))
+        get_db().commit()
+        invalidate('movies')
+        facets.movie_saved(movie_id, release_date)
         return redirect(url_for('main.list_movies'))
 
     return render_template('add_movie.html', title="Add Movie")
 
 @main.route('/movies/edit/<int:movie_id>', methods=['GET', 'POST'])
 def edit_movie(movie_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     if request.method == 'POST':
         title = request.form['title']
         release_date = request.form['release_date']
         duration = request.form['duration']
         description = request.form['description']
-        cursor.execute(
-            "UPDATE movies SET title=%s, release_date=%s, duration=%s, description=%s WHERE movieid=%s",
-            (title, release_date, duration, description, movie_id)
-        )
-        db.commit()
+        changed = queries.execute('update_movie', (title, release_date, duration, description, movie_id))
+        get_db().commit()
+        invalidate('movies')
+        if changed:
+            facets.movie_saved(movie_id, release_date)
         return redirect(url_for('main.list_movies'))
 
-    cursor.execute("SELECT * FROM movies WHERE movieid = %s", (movie_id,))
-    movie = cursor.fetchone()
+    movie = queries.fetch_one('movie_by_id', (movie_id,))
     return render_template('edit_movie.html', title="Edit Movie", movie=movie)
 
 @main.route('/movies/delete/<int:movie_id>', methods=['POST'])
 def delete_movie(movie_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM movies WHERE movieid=%s", (movie_id,))
-    db.commit()
+    deleted = queries.execute('delete_movie', (movie_id,))
+    get_db().commit()
+    invalidate('movies')
+    if deleted:
+        facets.movie_deleted(movie_id)
     return redirect(url_for('main.list_movies'))
 
 
 # User Routes
 @main.route('/users')
 def list_users():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT userid, userName, email, date_of_birth
-        FROM users
-        ORDER BY userid DESC;  -- Sort by userID in descending order (newest first)
-    """)
-    users = cursor.fetchall()
-    return render_template('users.html', title="Users", users=users)
+    # Sorted by userID in descending order (newest first), see queries.py
+    page = fetch_page('users_page')
+    return render_template('users.html', title="Users", users=page.rows, page=page)
 
 @main.route('/users/add', methods=['GET', 'POST'])
 def add_user():
@@ -126,29 +125,40 @@ def add_user():
         password = request.form['password']
         date_of_birth = request.form['date_of_birth']
 
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute(
-            "INSERT INTO users (userName, email, password, date_of_birth) VALUES (%s, %s, %s, %s)",
-            (userName, email, password, date_of_birth)
-        )
-        db.commit()
+        queries.execute('insert_user', (userName, email, password, date_of_birth))
+        get_db().commit()
+        invalidate('users')
         return redirect(url_for('main.list_users'))
 
     return render_template('add_user.html', title="Add User")
 
+@main.route('/users/<int:user_id>')
+def user_profile(user_id):
+    # Account, subscriptions, payments and ratings of one user in a fixed number of
+    # indexed queries (see profile.py); each section pages on its own cursor
+    limit = request.args.get('limit', current_app.config.get('PROFILE_PAGE_SIZE', 20), type=int)
+    limit = max(1, min(limit, current_app.config.get('PAGE_SIZE_MAX', 500)))
+    cursors = {s: request.args.get(f'{s}_cursor') for s in PROFILE_SECTIONS}
+    profile = load_profile(user_id, cursors, limit)
+    if profile is None:
+        return "User not found", 404
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify(profile_json(profile))
+
+    def page_url(section, cursor):
+        args = {f'{s}_cursor': c for s, c in cursors.items() if c and s != section}
+        args[f'{section}_cursor'] = cursor
+        if 'limit' in request.args:
+            args['limit'] = limit
+        return url_for('main.user_profile', user_id=user_id, **args)
+
+    return render_template('user_profile.html', title=f"User {profile['user'].userName}",
+                           profile=profile, page_url=page_url)
+
 @main.route('/users/edit/<int:user_id>', methods=['GET', 'POST'])
 def edit_user(user_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     # Fetch user data
-    cursor.execute("SELECT * FROM users WHERE userID = %s", (user_id,))
-    user = cursor.fetchone()
-
-    # Debugging output to verify fetched data
-    print(f"User ID from URL: {user_id}")
-    print(f"Fetched User from Database: {user}")
+    user = queries.fetch_one('user_by_id', (user_id,))
 
     # Handle case where the user is not found
     if not user:
@@ -166,15 +176,9 @@ def edit_user(user_id):
             return "All fields are required", 400
 
         # Update the user in the database
-        cursor.execute(
-            """
-            UPDATE users
-            SET userName = %s, email = %s, password = %s, date_of_birth = %s
-            WHERE userID = %s
-            """,
-            (userName, email, password, date_of_birth, user_id)
-        )
-        db.commit()
+        queries.execute('update_user', (userName, email, password, date_of_birth, user_id))
+        get_db().commit()
+        invalidate('users')
         return redirect(url_for('main.list_users'))
 
     return render_template('edit_user.html', title="Edit User", user=user)
@@ -183,102 +187,77 @@ def edit_user(user_id):
 
 @main.route('/users/delete/<int:user_id>', methods=['POST'])
 def delete_user(user_id):
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        # Delete associated ratings first
-        cursor.execute("DELETE FROM ratings WHERE userID = %s", (user_id,))
-
-        # Now delete the user
-        cursor.execute("DELETE FROM users WHERE userID = %s", (user_id,))
-        db.commit()
+        # Ratings, payments and subscriptions first, in short batches (see app/purge.py)
+        purge_user(user_id)
+        invalidate(*PURGED_TABLES)
 
         return redirect(url_for('main.list_users'))
-    except Exception as e:
-        db.rollback()
-        print(f"Error deleting user: {e}")
+    except Exception:
+        invalidate(*PURGED_TABLES)    # some batches may have been committed
+        current_app.logger.exception("Error deleting user")
         return "An error occurred while deleting the user.", 500
 
 
 
 # Genre Routes
 @main.route('/genres')
+@versioned_page('movie_genre', 'movies')
 def list_genres():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT mg.movieid, m.title, mg.movie_genre
-        FROM movie_genre mg
-        JOIN movies m ON mg.movieid = m.movieid
-    """)
-    genres = cursor.fetchall()
-    return render_template('genres.html', title="Genres", genres=genres)
+    page = fetch_page('genres_page')
+    return render_template('genres.html', title="Genres", genres=page.rows, page=page)
 
 
 @main.route('/genres/add', methods=['GET', 'POST'])
 def add_genre():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     if request.method == 'POST':
         movieid = request.form['movieid']
         movie_genre = request.form['movie_genre']
-        cursor.execute("INSERT INTO movie_genre (movieid, movie_genre) VALUES (%s, %s)", (movieid, movie_genre))
-        db.commit()
+        queries.execute('insert_genre', (movieid, movie_genre))
+        get_db().commit()
+        invalidate('movie_genre')
+        facets.genre_added(int(movieid), movie_genre)
         return redirect(url_for('main.list_genres'))
 
-    # Fetch movies for the dropdown
-    cursor.execute("SELECT movieid, title FROM movies")
-    movies = cursor.fetchall()
-    return render_template('add_genre.html', title="Add Genre", movies=movies)
+    # The movie is picked with /autocomplete/movies instead of a full dropdown
+    return render_template('add_genre.html', title="Add Genre")
 
 @main.route('/genres/edit/<int:movieid>/<string:movie_genre>', methods=['GET', 'POST'])
 def edit_genre(movieid, movie_genre):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     if request.method == 'POST':
         new_genre = request.form['movie_genre']
-        cursor.execute(
-            "UPDATE movie_genre SET movie_genre=%s WHERE movieid=%s AND movie_genre=%s",
-            (new_genre, movieid, movie_genre)
-        )
-        db.commit()
+        changed = queries.execute('update_genre', (new_genre, movieid, movie_genre))
+        get_db().commit()
+        invalidate('movie_genre')
+        # Only rows that exist go into the facet index
+        if changed:
+            facets.genre_removed(movieid, movie_genre)
+            facets.genre_added(movieid, new_genre)
         return redirect(url_for('main.list_genres'))
 
     # Fetch the current genre and movie details
-    cursor.execute("""
-        SELECT mg.movieid, m.title, mg.movie_genre
-        FROM movie_genre mg
-        JOIN movies m ON mg.movieid = m.movieid
-        WHERE mg.movieid=%s AND mg.movie_genre=%s
-    """, (movieid, movie_genre))
-    genre_entry = cursor.fetchone()
+    genre_entry = queries.fetch_one('genre_by_key', (movieid, movie_genre))
     return render_template('edit_genre.html', title="Edit Genre", genre_entry=genre_entry)
 
 
 
 @main.route('/genres/delete/<int:movieid>/<string:movie_genre>', methods=['POST'])
 def delete_genre(movieid, movie_genre):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM movie_genre WHERE movieid=%s AND movie_genre=%s", (movieid, movie_genre))
-    db.commit()
+    deleted = queries.execute('delete_genre', (movieid, movie_genre))
+    get_db().commit()
+    invalidate('movie_genre')
+    if deleted:
+        facets.genre_removed(movieid, movie_genre)
     return redirect(url_for('main.list_genres'))
 
 @main.route('/subscriptions')
 def list_subscriptions():  # Display a list of all Subscriptions.
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT subscription_id, userID, startdate, end_Date, subscription_status FROM subscriptions")
-    subscriptions = cursor.fetchall()
-    return render_template('subscriptions.html', subscriptions=subscriptions)
+    page = fetch_page('subscriptions_page')
+    return render_template('subscriptions.html', subscriptions=page.rows, page=page)
 
 @main.route('/subscriptions/add', methods=['GET', 'POST'])
 def add_subscription(): # add a new subscription to the database
     db = get_db()
-    cursor = db.cursor(dictionary=True)
 
     if request.method == 'POST':
         # Retrieve form data
@@ -289,34 +268,25 @@ def add_subscription(): # add a new subscription to the database
 
         try:
             # Insert the subscription into the database
-            cursor.execute("""
-                INSERT INTO subscriptions (userID, startdate, end_Date, subscription_status)
-                VALUES (%s, %s, %s, %s)
-            """, (userID, startdate, end_date, subscription_status))
+            queries.execute('insert_subscription', (userID, startdate, end_date, subscription_status))
             db.commit()
+            invalidate('subscriptions')
 
             # Redirect to the subscriptions list page after successful insertion
             return redirect(url_for('main.list_subscriptions'))
-        except Exception as e:
+        except Exception:
             db.rollback()
-            print(f"Error adding subscription: {e}")
+            current_app.logger.exception("Error adding subscription")
             return "An error occurred while adding the subscription.", 500
 
-    # Fetch users for the dropdown menu
-    cursor.execute("SELECT userID, userName FROM users")
-    users = cursor.fetchall()
-
-    # Render the add_subscription.html template for GET requests
-    return render_template('add_subscription.html', users=users)
+    # Render the add_subscription.html template for GET requests; the user is
+    # picked with /autocomplete/users instead of a full dropdown
+    return render_template('add_subscription.html')
 
 @main.route('/subscriptions/edit/<int:subscription_id>', methods=['GET', 'POST'])
 def edit_subscription(subscription_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     # Fetch subscription details
-    cursor.execute("SELECT * FROM subscriptions WHERE subscription_id = %s", (subscription_id,))
-    subscription = cursor.fetchone()
+    subscription = queries.fetch_one('subscription_by_id', (subscription_id,))
 
     if not subscription:
         return "Subscription not found", 404
@@ -327,59 +297,38 @@ def edit_subscription(subscription_id):
         end_date = request.form['end_Date']
         subscription_status = request.form['subscription_status']
 
-        cursor.execute(
-            """
-            UPDATE subscriptions
-            SET userID = %s, startdate = %s, end_Date = %s, subscription_status = %s
-            WHERE subscription_id = %s
-            """,
-            (userID, startdate, end_date, subscription_status, subscription_id)
-        )
-        db.commit()
+        queries.execute('update_subscription', (userID, startdate, end_date, subscription_status, subscription_id))
+        get_db().commit()
+        invalidate('subscriptions')
         return redirect(url_for('main.list_subscriptions'))
 
     return render_template('edit_subscription.html', title="Edit Subscription", subscription=subscription)
 
 @main.route('/subscriptions/delete/<int:subscription_id>', methods=['POST'])
 def delete_subscription(subscription_id):
-    db = get_db()
-    cursor = db.cursor()
-
     try:
-        # Delete related payments first
-        cursor.execute("DELETE FROM payments WHERE subscription_id = %s", (subscription_id,))
-        
-        # Now delete the subscription
-        cursor.execute("DELETE FROM subscriptions WHERE subscription_id = %s", (subscription_id,))
-        db.commit()
+        # Related payments first, in short batches (see app/purge.py)
+        purge_subscription(subscription_id)
+        invalidate('subscriptions', 'payments')
 
         return redirect(url_for('main.list_subscriptions'))
-    except Exception as e:
-        db.rollback()
-        print(f"Error deleting subscription: {e}")
+    except Exception:
+        invalidate('subscriptions', 'payments')
+        current_app.logger.exception("Error deleting subscription")
         return "An error occurred while deleting the subscription.", 500
 
 
 @main.route('/payments', methods=['GET', 'POST'])
 def list_payments(): # Display a list of payments from the database
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
-    # Fetch payment data
-    cursor.execute("""
-        SELECT p.payment_id, p.payment_amount, p.card_no, p.payment_date, p.payment_method, s.subscription_id
-        FROM payments p
-        JOIN subscriptions s ON p.subscription_id = s.subscription_id
-    """)
-    payments = cursor.fetchall()
+    # Fetch one page of payment data
+    page = fetch_page('payments_page')
 
     # Render the payments.html template
-    return render_template('payments.html', payments=payments)
+    return render_template('payments.html', payments=page.rows, page=page)
 
 @main.route('/payments/add', methods=['GET', 'POST'])
 def add_payment(): # Route to add a new payment to the database.
     db = get_db()
-    cursor = db.cursor(dictionary=True)
 
     if request.method == 'POST':
         # Get form data
@@ -391,34 +340,25 @@ def add_payment(): # Route to add a new payment to the database.
 
         try:
             # Insert data into the payments table
-            cursor.execute("""
-                INSERT INTO payments (payment_amount, card_no, payment_date, payment_method, subscription_id)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (payment_amount, card_no, payment_date, payment_method, subscription_id))
+            queries.execute('insert_payment', (payment_amount, card_no, payment_date, payment_method, subscription_id))
             db.commit()
+            invalidate('payments')
 
             # Redirect to the payments list page after success
             return redirect(url_for('main.list_payments'))
-        except Exception as e:
+        except Exception:
             db.rollback()
-            print(f"Error adding payment: {e}")
+            current_app.logger.exception("Error adding payment")
             return "An error occurred while adding the payment.", 500
 
-    # Fetch subscriptions for the dropdown menu
-    cursor.execute("SELECT subscription_id FROM subscriptions")
-    subscriptions = cursor.fetchall()
-
-    # Render the add_payment.html template for GET requests
-    return render_template('add_payment.html', subscriptions=subscriptions)
+    # Render the add_payment.html template for GET requests; the subscription
+    # is picked with /autocomplete/subscriptions instead of a full dropdown
+    return render_template('add_payment.html')
 
 @main.route('/payments/edit/<int:payment_id>', methods=['GET', 'POST'])
 def edit_payment(payment_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     # Fetch payment details
-    cursor.execute("SELECT * FROM payments WHERE payment_id = %s", (payment_id,))
-    payment = cursor.fetchone()
+    payment = queries.fetch_one('payment_by_id', (payment_id,))
 
     if not payment:
         return "Payment not found", 404
@@ -430,41 +370,30 @@ def edit_payment(payment_id):
         payment_method = request.form['payment_method']
         subscription_id = request.form['subscription_id']
 
-        cursor.execute(
-            """
-            UPDATE payments
-            SET payment_amount = %s, card_no = %s, payment_date = %s, payment_method = %s, subscription_id = %s
-            WHERE payment_id = %s
-            """,
-            (payment_amount, card_no, payment_date, payment_method, subscription_id, payment_id)
-        )
-        db.commit()
+        queries.execute('update_payment',
+                        (payment_amount, card_no, payment_date, payment_method, subscription_id, payment_id))
+        get_db().commit()
+        invalidate('payments')
         return redirect(url_for('main.list_payments'))
 
     return render_template('edit_payment.html', title="Edit Payment", payment=payment)
 
 @main.route('/payments/delete/<int:payment_id>', methods=['POST'])
 def delete_payment(payment_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM payments WHERE payment_id = %s", (payment_id,))
-    db.commit()
+    queries.execute('delete_payment', (payment_id,))
+    get_db().commit()
+    invalidate('payments')
     return redirect(url_for('main.list_payments'))
 
 
 @main.route('/ratings')
+@versioned_page('ratings')
 def list_ratings():  # Display a list of all ratings.
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT userID, movieid, ratingScore, review, ratingDate FROM ratings")
-
-    ratings = cursor.fetchall()
-    return render_template('ratings.html', ratings=ratings)
+    page = fetch_page('ratings_page')
+    return render_template('ratings.html', ratings=page.rows, page=page)
 
 @main.route('/ratings/add', methods=['GET', 'POST'])
 def add_rating(): # add new rating to the database.
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
 
     if request.method == 'POST':
         # Get form data
@@ -474,33 +403,24 @@ def add_rating(): # add new rating to the database.
         review = request.form['review']
         ratingDate = request.form['ratingDate']
 
-        # Insert data into the ratings table
-        cursor.execute("""
-            INSERT INTO ratings (userID, movieID, ratingScore, review, ratingDate)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (userID, movieID, ratingScore, review, ratingDate))
-        db.commit()
+        # Insert data into the ratings table, or leave it to the background
+        # writer in buffered ingestion mode (see ingest.py)
+        if not enqueue_rating(userID, movieID, ratingScore, review, ratingDate, insert=True):
+            queries.execute('insert_rating', (userID, movieID, ratingScore, review, ratingDate))
+            get_db().commit()
+            invalidate('ratings')
 
         # Redirect to the ratings list page
         return redirect(url_for('main.list_ratings'))
 
-    # Fetch users and movies for dropdowns
-    cursor.execute("SELECT userid, username FROM users")
-    users = cursor.fetchall()
-    cursor.execute("SELECT movieid, title FROM movies")
-    movies = cursor.fetchall()
-
-    # Render the add_rating.html template for GET requests
-    return render_template('add_rating.html', users=users, movies=movies)
+    # Render the add_rating.html template for GET requests; users and movies
+    # are picked with the /autocomplete endpoints instead of full dropdowns
+    return render_template('add_rating.html')
 
 @main.route('/ratings/edit/<int:movie_id>/<int:user_id>', methods=['GET', 'POST'])
 def edit_rating(movie_id, user_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
     # Fetch rating details
-    cursor.execute("SELECT * FROM ratings WHERE movieid = %s AND userID = %s", (movie_id, user_id))
-    rating = cursor.fetchone()
+    rating = queries.fetch_one('rating_by_key', (movie_id, user_id))
 
     if not rating:
         return "Rating not found", 404
@@ -510,15 +430,10 @@ def edit_rating(movie_id, user_id):
         review = request.form['review']
         ratingDate = request.form['ratingDate']
 
-        cursor.execute(
-            """
-            UPDATE ratings
-            SET ratingScore = %s, review = %s, ratingDate = %s
-            WHERE movieid = %s AND userID = %s
-            """,
-            (ratingScore, review, ratingDate, movie_id, user_id)
-        )
-        db.commit()
+        if not enqueue_rating(user_id, movie_id, ratingScore, review, ratingDate):
+            queries.execute('update_rating', (ratingScore, review, ratingDate, movie_id, user_id))
+            get_db().commit()
+            invalidate('ratings')
         return redirect(url_for('main.list_ratings'))
 
     return render_template('edit_rating.html', title="Edit Rating", rating=rating)
@@ -526,74 +441,201 @@ def edit_rating(movie_id, user_id):
 
 @main.route('/ratings/delete/<int:movie_id>/<int:user_id>', methods=['POST'])
 def delete_rating(movie_id, user_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM ratings WHERE movieid = %s AND userID = %s", (movie_id, user_id))
-    db.commit()
+    queries.execute('delete_rating', (movie_id, user_id))
+    get_db().commit()
+    invalidate('ratings')
     return redirect(url_for('main.list_ratings'))
 
 
 @main.route('/reports')
 def reports():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-
-    # Query for Active vs. Inactive Users
-    cursor.execute("""
-        SELECT subscription_status, COUNT(*) AS total_users
-        FROM subscriptions
-        GROUP BY subscription_status;
-    """)
-    active_inactive_users = cursor.fetchall()
-
-    # Query for Revenue from Subscriptions
-    cursor.execute("""
-        SELECT SUM(payment_amount) AS total_revenue
-        FROM payments;
-    """)
-    revenue_from_subscriptions = cursor.fetchone()['total_revenue']
-
-    # Query for Top-Rated Movies
-    cursor.execute("""
-        SELECT m.title, ROUND(AVG(r.ratingScore), 2) AS avg_rating, COUNT(r.ratingScore) AS total_ratings
-        FROM movies m
-        JOIN ratings r ON m.movieid = r.movieid
-        GROUP BY m.movieid
-        HAVING total_ratings > 5
-        ORDER BY avg_rating DESC
-        LIMIT 10;
-    """)
-    top_rated_movies = cursor.fetchall()
-
-    # Query for Top Movies by Genre (limit 5 per genre)
-    cursor.execute("""
-        SELECT mg.movie_genre, m.title, ROUND(AVG(r.ratingScore), 2) AS avg_rating
-        FROM movie_genre mg
-        JOIN movies m ON mg.movieid = m.movieid
-        JOIN ratings r ON m.movieid = r.movieid
-        GROUP BY mg.movie_genre, m.movieid
-        ORDER BY mg.movie_genre, avg_rating DESC;
-    """)
-    top_movies_by_genre_raw = cursor.fetchall()
-
-    # Organize and limit top movies by genre
-    top_movies_by_genre = {}
-    for row in top_movies_by_genre_raw:
-        genre = row['movie_genre']
-        movie = {'title': row['title'], 'avg_rating': row['avg_rating']}
-        if genre not in top_movies_by_genre:
-            top_movies_by_genre[genre] = []
-        if len(top_movies_by_genre[genre]) < 5:  # Limit to 5 movies per genre
-            top_movies_by_genre[genre].append(movie)
-
-    # Close connection
-    cursor.close()
-    db.close()
-
+    # Each report is served from the result cache until it expires or its tables change
     return render_template(
         'reports.html',
-        active_inactive_users=active_inactive_users,
-        revenue_from_subscriptions=revenue_from_subscriptions,
-        top_rated_movies=top_rated_movies,
-        top_movies_by_genre=top_movies_by_genre
+        active_inactive_users=report_queries.subscription_status_counts(),
+        revenue_from_subscriptions=report_queries.total_revenue(),
+        top_rated_movies=report_queries.top_rated_movies(),
+        top_movies_by_genre=report_queries.top_movies_by_genre(
+            current_app.config['REPORT_GENRE_TOP_N'],
+            current_app.config['REPORT_GENRE_MIN_RATINGS']
+        )
+    )
+
+@main.route('/reports/genres/top')
+def top_movies_by_genre():
+    # Per-genre top-N as JSON, e.g. /reports/genres/top?n=10&min_ratings=20&genre=Drama
+    n = request.args.get('n', current_app.config['REPORT_GENRE_TOP_N'], type=int)
+    min_ratings = request.args.get('min_ratings', current_app.config['REPORT_GENRE_MIN_RATINGS'], type=int)
+    genre = request.args.get('genre') or None
+
+    if n < 1 or n > current_app.config['REPORT_GENRE_TOP_N_MAX']:
+        return f"n must be between 1 and {current_app.config['REPORT_GENRE_TOP_N_MAX']}", 400
+    if min_ratings < 1:
+        return "min_ratings must be at least 1", 400
+
+    return jsonify(report_queries.top_movies_by_genre(n, min_ratings, genre))
+
+@main.route('/reports/revenue')
+def revenue_report():
+    # Revenue per day, week or month as JSON, e.g.
+    # /reports/revenue?start=2024-01-01&end=2024-03-31&period=week&method=VISA
+    # Served from the daily_revenue rollup; ?source=payments reads the payments table instead
+    config = current_app.config
+    try:
+        end = datetime.date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.date.today()
+        start = (datetime.date.fromisoformat(request.args['start']) if request.args.get('start')
+                 else end - datetime.timedelta(days=config['REPORT_REVENUE_DEFAULT_DAYS'] - 1))
+    except ValueError:
+        return "start and end must be dates (YYYY-MM-DD)", 400
+    period = request.args.get('period', 'day')
+    method = request.args.get('method') or None
+    source = request.args.get('source', 'rollup')
+
+    if start > end:
+        return "start must not be after end", 400
+    if (end - start).days + 1 > config['REPORT_REVENUE_MAX_DAYS']:
+        return f"The range may span at most {config['REPORT_REVENUE_MAX_DAYS']} days", 400
+    if period not in report_queries.REVENUE_PERIODS:
+        return f"period must be one of {', '.join(report_queries.REVENUE_PERIODS)}", 400
+    if source not in report_queries.REVENUE_SOURCES:
+        return f"source must be one of {', '.join(report_queries.REVENUE_SOURCES)}", 400
+
+    return jsonify(report_queries.revenue(start, end, period, method, source))
+
+@main.route('/reports/expiry')
+def subscription_expiry_status():
+    # Scheduler state and the stats of its recent runs in this process
+    return jsonify(expiry_status())
+
+@main.route('/reports/ingest')
+def rating_ingest_status():
+    # Rating write-behind queue depth and writer counters in this process
+    return jsonify(ingest_status())
+
+@main.route('/reports/facets')
+def facet_index_status():
+    # Size, build and update counters of the movie facet index in this process
+    return jsonify(facets.facet_stats())
+
+@main.route('/reports/replicas')
+def replica_status():
+    # Read routing counters, lag and state of each replica in this process
+    replicas = get_replicas()
+    return jsonify(replicas.stats() if replicas else {'replicas': 0})
+
+@main.route('/healthz')
+def healthz():
+    # Liveness: the worker process answers
+    return jsonify({'status': 'ok'})
+
+@main.route('/readyz')
+def readyz():
+    # Readiness: warmed up, not draining, and the database answers; 503 takes the worker out of rotation
+    ok, state = readiness(current_app._get_current_object())
+    return jsonify(state), 200 if ok else 503
+
+@main.route('/reports/cache')
+def report_cache_stats():
+    return jsonify(dict(get_cache().stats(), pages=page_cache_stats(), statements=queries.statement_stats()))
+
+
+# Search
+@main.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'all')
+    limit = request.args.get('limit', type=int)
+
+    movies = search_movies(q, limit) if q and search_type in ('all', 'movies') else []
+    users = search_users(q, limit) if q and search_type in ('all', 'users') else []
+    return render_template('search.html', title="Search", q=q, type=search_type, movies=movies, users=users)
+
+@main.route('/search/movies')
+def search_movies_json():
+    # e.g. /search/movies?q=star wa&limit=10, ordered by relevance
+    return jsonify(search_movies(request.args.get('q', ''), request.args.get('limit', type=int)))
+
+@main.route('/search/users')
+def search_users_json():
+    # e.g. /search/users?q=jwheel, matching the start of the user name or email
+    return jsonify(search_users(request.args.get('q', ''), request.args.get('limit', type=int)))
+
+
+
+@main.route('/movies/<int:movie_id>/stats')
+def movie_rating_stats_json(movie_id):
+    # Count, average, variance and latest rating date, kept current by triggers
+    return jsonify(get_movie_rating_stats(movie_id))
+
+
+# Recommendations, served from the index built by `flask recommend-refresh`
+@main.route('/movies/<int:movie_id>/similar')
+def similar_movies_json(movie_id):
+    # e.g. /movies/42/similar?limit=10, most similar first
+    try:
+        return jsonify(similar_movies(movie_id, request.args.get('limit', type=int)))
+    except RecommendationsUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+
+@main.route('/users/<int:user_id>/recommendations')
+def user_recommendations_json(user_id):
+    # Movies similar to the ones the user rated, weighted by their ratings
+    try:
+        return jsonify(recommendations_for_user(user_id, request.args.get('limit', type=int)))
+    except RecommendationsUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+
+
+# Typeahead for the add forms (see static/autocomplete.js)
+@main.route('/autocomplete/users')
+def autocomplete_users():
+    return jsonify(suggest_users(request.args.get('q', ''), request.args.get('limit', type=int)))
+
+@main.route('/autocomplete/movies')
+def autocomplete_movies():
+    return jsonify(suggest_movies(request.args.get('q', ''), request.args.get('limit', type=int)))
+
+@main.route('/autocomplete/subscriptions')
+def autocomplete_subscriptions():
+    return jsonify(suggest_subscriptions(request.args.get('q', ''), request.args.get('limit', type=int)))
+
+
+# Bulk import
+@main.route('/import/<string:table>', methods=['POST'])
+def import_table(table):
+    # Upload a CSV file (form field "file") to bulk insert into users, movies,
+    # subscriptions, payments or ratings; responds with the import report
+    upload = request.files.get('file')
+    if upload is None:
+        return "A CSV file is required", 400
+
+    try:
+        report = import_csv(table, open_upload(upload), request.form.get('batch_size', type=int))
+    except ValueError as e:
+        return str(e), 400
+    return jsonify(report.as_dict())
+
+
+# Streaming export
+@main.route('/export/<string:table>')
+def export_table(table):
+    # e.g. /export/ratings?format=ndjson&columns=userID,movieid,ratingScore&after=1200,57&gzip=1
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+    try:
+        chunks = export(
+            table, fmt,
+            columns=request.args.get('columns'),
+            after=request.args.get('after'),
+            upto=request.args.get('upto'),
+            compress=compress
+        )
+    except ValueError as e:
+        return str(e), 400
+
+    filename = f"{table}.{fmt}" + (".gz" if compress else "")
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
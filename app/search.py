@@ -0,0 +1,156 @@
+# search.py
+#
+# Search over movies and users, answered from indexes (see
+# database/movie_streaming_search.sql):
+#   - movies: FULLTEXT index on (title, description), ranked by relevance
+#   - users: B-tree indexes on userName and email, searched by prefix
+# Both kinds of index are maintained by InnoDB as rows are written.
+
+import re
+
+from flask import current_app
+
+from .queries import fetch_all, register
+
+
+def search_limit(requested):
+    default = current_app.config.get('SEARCH_LIMIT', 20)
+    maximum = current_app.config.get('SEARCH_LIMIT_MAX', 100)
+    return max(1, min(requested or default, maximum))
+
+
+def _boolean_query(text):
+    # Turn free text into a boolean-mode query where every word must match,
+    # the last one as a prefix so partially typed words still find results
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'+{w}' for w in words[:-1]] + [f'+{words[-1]}*']
+    return ' '.join(terms)
+
+register('search_movies', """
+    SELECT movieid, title, release_date, description,
+           MATCH(title, description) AGAINST (%s IN BOOLEAN MODE) AS relevance
+    FROM movies
+    WHERE MATCH(title, description) AGAINST (%s IN BOOLEAN MODE)
+    ORDER BY relevance DESC, movieid
+    LIMIT %s
+""")
+
+def search_movies(text, limit=None):
+    query = _boolean_query(text)
+    if query is None:
+        return []
+    rows = fetch_all('search_movies', (query, query, search_limit(limit)))
+    return [row._asdict() for row in rows]
+
+
+def _like_prefix(text):
+    # Escape LIKE wildcards so user input is matched literally
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+# Each branch is a bounded range scan on its own index; exact matches rank first
+register('search_users', """
+    (SELECT userID, userName, email, IF(userName = %s, 3, 2) AS relevance
+     FROM users WHERE userName LIKE %s ORDER BY userName LIMIT %s)
+    UNION ALL
+    (SELECT userID, userName, email, IF(email = %s, 3, 1) AS relevance
+     FROM users WHERE email LIKE %s ORDER BY email LIMIT %s)
+""")
+
+def search_users(text, limit=None):
+    text = text.strip()
+    if not text:
+        return []
+    limit = search_limit(limit)
+    prefix = _like_prefix(text)
+
+    rows = fetch_all('search_users', (text, prefix, limit, text, prefix, limit))
+
+    # A user can match on both name and email; keep their best score
+    best = {}
+    for row in rows:
+        current = best.get(row['userID'])
+        if current is None or row['relevance'] > current['relevance']:
+            best[row['userID']] = row
+    ranked = sorted(best.values(), key=lambda r: (-r['relevance'], r['userName'], r['userID']))
+    return [row._asdict() for row in ranked[:limit]]
+
+
+# Typeahead for the add forms. Every query is a LIMIT-bounded range scan on an
+# index (or a primary-key lookup for numeric input), so the work per keystroke
+# does not grow with the table. Results are [{'id': ..., 'label': ...}, ...].
+
+def autocomplete_limit(requested):
+    default = current_app.config.get('AUTOCOMPLETE_LIMIT', 10)
+    maximum = current_app.config.get('AUTOCOMPLETE_LIMIT_MAX', 50)
+    return max(1, min(requested or default, maximum))
+
+register('suggest_users', """
+    (SELECT userID, userName, 0 AS exact FROM users WHERE userID = %s)
+    UNION ALL
+    (SELECT userID, userName, 1 AS exact FROM users WHERE userName LIKE %s ORDER BY userName LIMIT %s)
+""")
+register('suggest_movies', """
+    (SELECT movieid, title, release_date, 0 AS exact FROM movies WHERE movieid = %s)
+    UNION ALL
+    (SELECT movieid, title, release_date, 1 AS exact FROM movies WHERE title LIKE %s ORDER BY title LIMIT %s)
+""")
+register('suggest_subscriptions', """
+    (SELECT s.subscription_id, s.subscription_status, s.end_Date, u.userName, 0 AS exact
+     FROM subscriptions s LEFT JOIN users u ON u.userID = s.userID
+     WHERE s.subscription_id = %s)
+    UNION ALL
+    (SELECT s.subscription_id, s.subscription_status, s.end_Date, u.userName, 1 AS exact
+     FROM (SELECT userID, userName FROM users WHERE userName LIKE %s ORDER BY userName LIMIT %s) u
+     JOIN subscriptions s ON s.userID = u.userID
+     ORDER BY u.userName, s.subscription_id DESC
+     LIMIT %s)
+""")
+
+def _exact_id(text):
+    # Only ASCII digits: "²".isdigit() is true but int("²") fails
+    return int(text) if text.isascii() and text.isdigit() else None
+
+def suggest_users(text, limit=None):
+    text = text.strip()
+    if not text:
+        return []
+    limit = autocomplete_limit(limit)
+    rows = fetch_all('suggest_users', (_exact_id(text), _like_prefix(text), limit))
+    return _suggestions(rows, 'userID', lambda r: f"{r['userName']} (#{r['userID']})", limit)
+
+def suggest_movies(text, limit=None):
+    text = text.strip()
+    if not text:
+        return []
+    limit = autocomplete_limit(limit)
+    rows = fetch_all('suggest_movies', (_exact_id(text), _like_prefix(text), limit))
+
+    def label(row):
+        year = f" ({row['release_date'].year})" if row['release_date'] else ""
+        return f"{row['title']}{year} #{row['movieid']}"
+    return _suggestions(rows, 'movieid', label, limit)
+
+def suggest_subscriptions(text, limit=None):
+    # By subscription id, or by the start of the subscriber's user name
+    text = text.strip()
+    if not text:
+        return []
+    limit = autocomplete_limit(limit)
+    rows = fetch_all('suggest_subscriptions',
+                     (_exact_id(text), _like_prefix(text), limit, limit))
+
+    def label(row):
+        return f"#{row['subscription_id']} {row['userName'] or ''} ({row['subscription_status']}, ends {row['end_Date']})"
+    return _suggestions(rows, 'subscription_id', label, limit)
+
+def _suggestions(rows, key, label, limit):
+    # Exact id matches first, each id once
+    seen = set()
+    suggestions = []
+    for row in sorted(rows, key=lambda r: r['exact']):
+        if row[key] not in seen:
+            seen.add(row[key])
+            suggestions.append({'id': row[key], 'label': label(row)})
+    return suggestions[:limit]
@@ -0,0 +1,141 @@
+# server.py
+#
+# Worker lifecycle for the production server (gunicorn, configured by
+# gunicorn.conf.py at the top of the repository). The master process binds the
+# socket and forks the workers; each worker then
+#
+#   - drops any database pools inherited from the master (preload mode), so
+#     every process opens its own connections,
+#   - warms up before it accepts connections: compiles every template, opens
+#     its pool's connections and requests WEB_WARMUP_PATHS once, which fills
+#     the prepared statements, table versions and report/page caches and
+#     starts the expiry scheduler,
+#   - on SIGTERM (graceful stop, or the old generation during a HUP reload)
+#     reports not ready on /readyz, keeps serving for WEB_DRAIN_DELAY seconds
+#     so load balancers can take it out, then finishes its requests and exits,
+#   - on exit flushes the rating write-behind queue and closes its connections.
+#
+# Nothing here runs under `python run.py`; /healthz and /readyz work there too.
+
+import os
+import signal
+import threading
+import time
+
+from mysql.connector import errors
+
+from .db import forget_pools, get_db, get_pool, get_replicas
+
+
+def _state(app):
+    return app.extensions.setdefault('server', {
+        'pid': os.getpid(), 'started_at': time.time(), 'warmed_up': False,
+        'warmup_seconds': None, 'draining': False, 'managed': False,
+    })
+
+
+def warm_up(app, paths=('/',), connections=1):
+    """Compile the templates, open `connections` pooled connections and GET `paths` once."""
+    state = _state(app)
+    started = time.monotonic()
+    for name in app.jinja_env.list_templates():
+        if name.endswith('.html'):
+            app.jinja_env.get_template(name)
+
+    with app.app_context():
+        pool = get_pool(app)
+        opened = []
+        try:
+            for _ in range(min(connections, pool.size)):
+                opened.append(pool.checkout())
+        except errors.Error as e:
+            app.logger.warning("Warm-up could not open database connections: %s", e)
+        finally:
+            for conn in opened:
+                pool.checkin(conn)
+
+    client = app.test_client()
+    for path in paths:
+        try:
+            response = client.get(path)
+            if response.status_code >= 400:
+                app.logger.warning("Warm-up request %s answered %s", path, response.status_code)
+        except Exception:
+            # A worker that cannot warm up still serves; /readyz tells whether the database is there
+            app.logger.exception("Warm-up request %s failed", path)
+
+    state['warmed_up'] = True
+    state['warmup_seconds'] = round(time.monotonic() - started, 3)
+    return state['warmup_seconds']
+
+
+def _drain_on_sigterm(app, delay):
+    # Chain in front of the worker's own SIGTERM handler, which stops accepting
+    # and lets the running requests finish
+    state = _state(app)
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle(signum, frame):
+        state['draining'] = True
+        if not callable(previous):
+            return
+        if delay > 0:
+            threading.Timer(delay, previous, (signum, frame)).start()
+        else:
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle)
+
+
+def start_worker(app, threads=1):
+    """Called in each worker after the fork, before it accepts connections."""
+    state = _state(app)
+    state.update(pid=os.getpid(), started_at=time.time(), warmed_up=False, draining=False, managed=True)
+    forget_pools(app)
+
+    if app.config.get('MYSQL_POOL_SIZE', 10) < threads:
+        app.logger.warning("MYSQL_POOL_SIZE (%s) is smaller than the %s threads per worker; "
+                           "requests will wait for connections", app.config.get('MYSQL_POOL_SIZE', 10), threads)
+    _drain_on_sigterm(app, float(os.environ.get('WEB_DRAIN_DELAY', 0)))
+
+    paths = [p.strip() for p in os.environ.get('WEB_WARMUP_PATHS', '/,/movies,/genres').split(',') if p.strip()]
+    seconds = warm_up(app, paths, connections=threads)
+    app.logger.info("Worker %s ready in %.2fs", os.getpid(), seconds)
+
+
+def stop_worker(app):
+    """Called in each worker when it exits: flush queued ratings, stop threads, close connections."""
+    writer = app.extensions.get('rating_writer')
+    if writer is not None:
+        writer.stop()
+    scheduler = app.extensions.get('subscription_expiry')
+    if scheduler is not None:
+        scheduler.stop()
+    pool = app.extensions.get('mysql_pool')
+    if pool is not None:
+        pool.close()
+    replicas = app.extensions.get('mysql_replicas')
+    if replicas is not None:
+        for replica in replicas.replicas:
+            replica.pool.close()
+
+
+def readiness(app):
+    """(ok, details): False while draining, before warm-up ends, or when the primary database does not answer."""
+    state = dict(_state(app))
+    # Under `python run.py` there is no warm-up to wait for
+    ok = not state['draining'] and (state['warmed_up'] or not state['managed'])
+    try:
+        cursor = get_db().cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        state['database'] = 'ok'
+    except errors.Error as e:
+        ok = False
+        state['database'] = str(e)
+    replicas = get_replicas() if state['database'] == 'ok' else None
+    if replicas is not None:
+        state['replicas_up'] = sum(1 for r in replicas.replicas if r.down_until <= time.monotonic())
+    state['ready'] = ok
+    return ok, state
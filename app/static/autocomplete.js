@@ -0,0 +1,91 @@
+// autocomplete.js
+//
+// Typeahead for text inputs marked with data-autocomplete="<url>". Typing waits
+// for a short pause before asking the server, cancels the previous request, and
+// remembers answers already received. Choosing a suggestion writes its id into
+// the hidden input named by data-target, which is what the form submits.
+(function () {
+    var DELAY_MS = 250;
+
+    function setup(input) {
+        var target = document.getElementById(input.dataset.target);
+        var menu = input.parentNode.querySelector('.autocomplete-menu');
+        var timer = null;
+        var controller = null;
+        var cache = {};
+
+        function clear() {
+            menu.innerHTML = '';
+        }
+
+        function choose(item) {
+            target.value = item.id;
+            input.value = item.label;
+            input.setCustomValidity('');
+            clear();
+        }
+
+        function render(items) {
+            clear();
+            if (!items.length) {
+                var empty = document.createElement('div');
+                empty.className = 'list-group-item text-muted';
+                empty.textContent = 'No matches';
+                menu.appendChild(empty);
+                return;
+            }
+            items.forEach(function (item) {
+                var button = document.createElement('button');
+                button.type = 'button';
+                button.className = 'list-group-item list-group-item-action';
+                button.textContent = item.label;
+                // mousedown fires before the input loses focus and hides the menu
+                button.addEventListener('mousedown', function (event) {
+                    event.preventDefault();
+                    choose(item);
+                });
+                menu.appendChild(button);
+            });
+        }
+
+        function lookup(q) {
+            if (cache.hasOwnProperty(q)) {
+                render(cache[q]);
+                return;
+            }
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(q), { signal: controller.signal })
+                .then(function (response) { return response.json(); })
+                .then(function (items) {
+                    cache[q] = items;
+                    if (input.value.trim() === q) {
+                        render(items);
+                    }
+                })
+                .catch(function (error) {
+                    if (error.name !== 'AbortError') {
+                        clear();
+                    }
+                });
+        }
+
+        input.addEventListener('input', function () {
+            // Typed text only counts once a suggestion is picked
+            target.value = '';
+            input.setCustomValidity(input.value ? 'Choose one of the suggestions' : '');
+            clearTimeout(timer);
+            var q = input.value.trim();
+            if (!q) {
+                clear();
+                return;
+            }
+            timer = setTimeout(function () { lookup(q); }, DELAY_MS);
+        });
+        input.addEventListener('blur', clear);
+    }
+
+    document.querySelectorAll('input[data-autocomplete]').forEach(setup);
+})();
@@ -0,0 +1,228 @@
+# stats.py
+#
+# Dashboard metrics and per-movie rating aggregates. The numbers live in the
+# app_stats, daily_revenue and movie_rating_stats tables
+# (database/movie_streaming_stats.sql), which are maintained by triggers on
+# every insert/update/delete, so reading them is a handful of primary-key or
+# index lookups instead of full-table aggregates.
+
+import datetime
+import math
+
+import click
+from flask import current_app
+
+from .cache import invalidate
+from .db import get_db
+from .queries import fetch_one, fetch_tuples, register
+
+
+register('dashboard_counters', """
+    SELECT stat_key, stat_value
+    FROM app_stats
+    WHERE stat_key IN ('total_users', 'total_subscriptions')
+""")
+register('dashboard_revenue', """
+    SELECT COALESCE(SUM(revenue), 0) AS revenue
+    FROM daily_revenue
+    WHERE day >= %s AND day < %s
+""")
+register('dashboard_most_reviewed', """
+    SELECT m.title, s.rating_count AS review_count
+    FROM movie_rating_stats s
+    JOIN movies m ON m.movieid = s.movieid
+    WHERE s.rating_count > 0
+    ORDER BY s.rating_count DESC, s.movieid DESC
+    LIMIT 1
+""")
+register('movie_rating_stats', """
+    SELECT rating_count, score_count, score_sum, score_sum_sq, last_rating_date
+    FROM movie_rating_stats
+    WHERE movieid = %s
+""")
+
+
+def get_dashboard_stats():
+    counters = dict(fetch_tuples('dashboard_counters'))
+
+    # Revenue for the current calendar month (of the current year)
+    # (a primary-key range over at most 31 days x payment methods)
+    month_start = datetime.date.today().replace(day=1)
+    next_month = (month_start + datetime.timedelta(days=31)).replace(day=1)
+    monthly_revenue = fetch_tuples('dashboard_revenue', (month_start, next_month))[0][0]
+
+    # Most reviewed movie, read from the top of the rating_count index
+    most_reviewed_movie = fetch_one('dashboard_most_reviewed')
+
+    return {
+        'total_users': counters.get('total_users', 0),
+        'total_subscriptions': counters.get('total_subscriptions', 0),
+        'monthly_revenue': monthly_revenue,
+        'most_reviewed_movie': most_reviewed_movie,
+    }
+
+
+def get_movie_rating_stats(movie_id):
+    # One primary-key read; average and variance come from the running sums
+    row = fetch_one('movie_rating_stats', (movie_id,))
+
+    stats = {'movieid': movie_id, 'rating_count': 0, 'score_count': 0, 'avg_rating': None,
+             'variance': None, 'stddev': None, 'last_rating_date': None}
+    if row is None:
+        return stats
+    stats.update(rating_count=row['rating_count'], score_count=row['score_count'],
+                 last_rating_date=row['last_rating_date'])
+    n = row['score_count']
+    if n:
+        mean = row['score_sum'] / n
+        variance = max(0.0, row['score_sum_sq'] / n - mean * mean)  # population variance
+        stats.update(avg_rating=round(mean, 2), variance=round(variance, 4), stddev=round(math.sqrt(variance), 4))
+    return stats
+
+
+_REBUILD_DAILY_REVENUE = """
+    INSERT INTO daily_revenue (day, payment_method, revenue, payments)
+    SELECT payment_date, COALESCE(payment_method, ''), SUM(payment_amount), COUNT(*)
+    FROM payments
+"""
+
+def _snapshot(cursor):
+    cursor.execute("SELECT stat_key, stat_value FROM app_stats")
+    snapshot = {('app_stats', k): v for k, v in cursor.fetchall()}
+    cursor.execute("SELECT day, payment_method, revenue, payments FROM daily_revenue")
+    snapshot.update({('daily_revenue', f"{day} {method}".rstrip()): (revenue, payments)
+                     for day, method, revenue, payments in cursor.fetchall()})
+    cursor.execute("""
+        SELECT movieid, rating_count, score_count, score_sum, score_sum_sq, last_rating_date
+        FROM movie_rating_stats
+    """)
+    snapshot.update({('movie_rating_stats', row[0]): row[1:] for row in cursor.fetchall()})
+    return snapshot
+
+def reconcile():
+    # Rebuild every metric from the base tables in one transaction.
+    # Returns the entries whose stored value had drifted as {key: (old, new)}.
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        before = _snapshot(cursor)
+
+        cursor.execute("DELETE FROM app_stats WHERE stat_key IN ('total_users', 'total_subscriptions')")
+        cursor.execute("""
+            INSERT INTO app_stats (stat_key, stat_value)
+            SELECT 'total_users', COUNT(*) FROM users
+            UNION ALL
+            SELECT 'total_subscriptions', COUNT(*) FROM subscriptions
+        """)
+
+        cursor.execute("DELETE FROM daily_revenue")
+        cursor.execute(_REBUILD_DAILY_REVENUE + """
+            WHERE payment_date IS NOT NULL AND payment_amount IS NOT NULL
+            GROUP BY 1, 2
+        """)
+
+        cursor.execute("DELETE FROM movie_rating_stats")
+        cursor.execute("""
+            INSERT INTO movie_rating_stats
+                (movieid, rating_count, score_count, score_sum, score_sum_sq, last_rating_date)
+            SELECT movieid, COUNT(*), COUNT(ratingScore), COALESCE(SUM(ratingScore), 0),
+                   COALESCE(SUM(ratingScore * ratingScore), 0), MAX(ratingDate)
+            FROM ratings
+            GROUP BY movieid
+        """)
+
+        after = _snapshot(cursor)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    drift = {}
+    for key in before.keys() | after.keys():
+        old, new = before.get(key, 0), after.get(key, 0)
+        if old != new:
+            drift[key] = (old, new)
+    return drift
+
+
+@click.command('stats-reconcile')
+def reconcile_command():
+    """Rebuild the dashboard metrics from the base tables."""
+    drift = reconcile()
+    for (table, key), (old, new) in sorted(drift.items(), key=str):
+        click.echo(f"{table}[{key}]: {old} -> {new}")
+    click.echo(f"Reconciled dashboard metrics ({len(drift)} drifted entries).")
+
+
+
+def backfill_daily_revenue(start, end, days_per_batch):
+    # Rebuild daily_revenue for start..end (inclusive) from payments, one short
+    # transaction per batch of days. INSERT ... SELECT locks the payment_date
+    # range it reads, so payments written meanwhile wait for the batch to commit
+    # and their triggers then apply on top of the rebuilt rows.
+    # Yields (batch_start, batch_end, rows written) after each batch.
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        day = start
+        while day <= end:
+            last = min(end, day + datetime.timedelta(days=days_per_batch - 1))
+            cursor.execute("DELETE FROM daily_revenue WHERE day BETWEEN %s AND %s", (day, last))
+            cursor.execute(_REBUILD_DAILY_REVENUE + """
+                WHERE payment_date BETWEEN %s AND %s AND payment_amount IS NOT NULL
+                GROUP BY 1, 2
+            """, (day, last))
+            written = cursor.rowcount
+            db.commit()
+            yield day, last, written
+            day = last + datetime.timedelta(days=1)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _revenue_date_range():
+    # First and last day that has a payment or a rollup row
+    cursor = get_db().cursor()
+    cursor.execute("""
+        SELECT LEAST(COALESCE(p.first_day, r.first_day), COALESCE(r.first_day, p.first_day)),
+               GREATEST(COALESCE(p.last_day, r.last_day), COALESCE(r.last_day, p.last_day))
+        FROM (SELECT MIN(payment_date) AS first_day, MAX(payment_date) AS last_day FROM payments) p,
+             (SELECT MIN(day) AS first_day, MAX(day) AS last_day FROM daily_revenue) r
+    """)
+    first, last = cursor.fetchone()
+    cursor.close()
+    return first, last
+
+
+@click.command('revenue-backfill')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='First day to rebuild (default: earliest payment).')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Last day to rebuild (default: latest payment).')
+@click.option('--batch-days', type=int, default=None, help='Days rebuilt per transaction.')
+def revenue_backfill_command(start, end, batch_days):
+    """Rebuild the daily revenue rollup from payments."""
+    batch_days = batch_days or current_app.config['REVENUE_BACKFILL_DAYS']
+    if batch_days < 1:
+        raise click.BadParameter("must be at least 1", param_hint='--batch-days')
+    first, last = _revenue_date_range()
+    start = start.date() if start else first
+    end = end.date() if end else last
+    if start is None or end is None:
+        click.echo("No payments to backfill.")
+        return
+    if start > end:
+        raise click.BadParameter("must not be after --end", param_hint='--start')
+
+    total = 0
+    for batch_start, batch_end, written in backfill_daily_revenue(start, end, batch_days):
+        total += written
+        click.echo(f"{batch_start} .. {batch_end}: {written} rows")
+    invalidate('payments')
+    click.echo(f"Backfilled daily revenue from {start} to {end} ({total} rows).")
+
+def init_stats(app):
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(revenue_backfill_command)
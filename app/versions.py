@@ -0,0 +1,211 @@
+# versions.py
+#
+# Conditional GET and rendered-page caching for list pages.
+#
+# Each table has a change version in table_versions
+# (database/movie_streaming_versions.sql), bumped by invalidate() after every
+# committed write. A page decorated with @versioned_page('movies', ...) derives
+# its ETag and Last-Modified from the versions of the tables it reads:
+#   - a client whose copy is current (If-None-Match with the same ETag) gets
+#     304 Not Modified. If-Modified-Since alone is not enough: Last-Modified
+#     has one-second resolution, so a change later in the same second would
+#     go unnoticed;
+#   - otherwise the rendered HTML is served from a byte-bounded LRU keyed by
+#     the same ETag, and the view runs only on a miss.
+# Versions are re-read from the database at most every TABLE_VERSIONS_POLL_INTERVAL
+# seconds (and right after this process writes), so repeat views of unchanged
+# data cost no query and no template rendering. Writes made by another process
+# show up within one poll interval.
+
+import functools
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+from flask import current_app, request
+from mysql.connector import errors
+
+from .db import get_db, get_read_db, get_replicas, is_replica, read_from_replica, reads_pinned_to_primary
+
+
+class TableVersions:
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._versions = {}        # table -> (version, changed_at as epoch seconds)
+        self._fetched_at = None
+        self.from_replica = False  # whether the last poll read a replica
+        self.polls = 0
+
+    def get(self, tables):
+        """[(version, changed_at), ...] for tables, or None if any is unknown."""
+        with self._lock:
+            fresh = self._fetched_at is not None and time.monotonic() - self._fetched_at < self.poll_interval
+        if not fresh:
+            self._poll()
+        with self._lock:
+            versions = [self._versions.get(t) for t in tables]
+        return None if None in versions else versions
+
+    def _poll(self):
+        # Read from the same server as the page data, so with replicas a page is
+        # never cached under versions newer than what it shows
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT table_name, version, UNIX_TIMESTAMP(changed_at) FROM table_versions")
+        rows = cursor.fetchall()
+        cursor.close()
+        with self._lock:
+            self.from_replica = is_replica(db)
+            self._versions = {name: (version, float(changed_at)) for name, version, changed_at in rows}
+            self._fetched_at = time.monotonic()
+            self.polls += 1
+
+    def bump(self, tables):
+        # Own short transaction after the caller's commit, so the version row is not
+        # locked for the length of the write
+        db = get_db()
+        cursor = db.cursor()
+        try:
+            cursor.executemany("""
+                INSERT INTO table_versions (table_name, version, changed_at) VALUES (%s, 1, CURRENT_TIMESTAMP(6))
+                ON DUPLICATE KEY UPDATE version = version + 1, changed_at = CURRENT_TIMESTAMP(6)
+            """, [(t,) for t in tables])
+            db.commit()
+        except errors.Error:
+            # The write itself has already been committed; don't fail it
+            db.rollback()
+            current_app.logger.exception("Could not bump table versions for %s", ', '.join(tables))
+        finally:
+            cursor.close()
+        with self._lock:
+            self._fetched_at = None    # this process sees its own writes immediately
+
+
+class PageCache:
+    # LRU of rendered pages, bounded by the total size of the bodies
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # etag -> body (bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0, 'uncacheable': 0}
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+def _etag(tables, versions):
+    # Same page (endpoint, view args, query string) and same table versions -> same ETag
+    parts = [request.endpoint, repr(sorted(request.view_args.items())), repr(sorted(request.args.items(multi=True)))]
+    parts += [f"{t}={v}" for t, (v, _) in zip(tables, versions)]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+def _is_current(etag):
+    return bool(request.if_none_match) and request.if_none_match.contains(etag)
+
+def versioned_page(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            app = current_app
+            versions_store, pages = app.extensions.get('table_versions'), app.extensions.get('page_cache')
+            if versions_store is None:
+                return view(*args, **kwargs)
+            if get_replicas() is not None and reads_pinned_to_primary():
+                # Read-your-writes: render from the primary, bypassing versions
+                # and cache, which follow the replicas
+                pages.count('uncacheable')
+                return view(*args, **kwargs)
+            try:
+                # Read the versions before the view reads any data, so a cached page
+                # is never older than the versions in its key
+                versions = versions_store.get(tables)
+            except errors.Error:
+                app.logger.exception("Could not read table versions; serving uncached")
+                versions = None
+            if versions is None:
+                pages.count('uncacheable')
+                return view(*args, **kwargs)
+
+            etag = _etag(tables, versions)
+            last_modified = max(changed_at for _, changed_at in versions)
+            headers = {
+                'ETag': f'"{etag}"',
+                # Rounded up: never earlier than the change itself
+                'Last-Modified': formatdate(math.ceil(last_modified), usegmt=True),
+                'Cache-Control': 'no-cache',   # the browser may keep a copy but must revalidate it
+            }
+            if _is_current(etag):
+                pages.count('not_modified')
+                return app.response_class(status=304, headers=headers)
+
+            body = pages.get(etag)
+            if body is None:
+                result = view(*args, **kwargs)
+                if not isinstance(result, str):
+                    # Redirects, errors and other responses are passed through unchanged
+                    pages.count('uncacheable')
+                    return result
+                body = result.encode('utf-8')
+                if read_from_replica() and not versions_store.from_replica:
+                    # Versions from the primary, data from a replica that may be
+                    # behind them: serve the page without keeping it or its ETag
+                    pages.count('uncacheable')
+                    return app.response_class(body, mimetype='text/html')
+                pages.set(etag, body)
+                pages.count('misses')
+            else:
+                pages.count('hits')
+            return app.response_class(body, mimetype='text/html', headers=headers)
+        return wrapper
+    return decorator
+
+
+def bump_versions(tables):
+    versions = current_app.extensions.get('table_versions')
+    if versions is not None:
+        versions.bump(tables)
+
+def page_cache_stats():
+    pages = current_app.extensions.get('page_cache')
+    versions = current_app.extensions.get('table_versions')
+    if pages is None:
+        return None
+    return dict(pages.stats(), version_polls=versions.polls)
+
+def init_versions(app):
+    if not app.config.get('PAGE_CACHE_ENABLED', True):
+        return
+    app.extensions['table_versions'] = TableVersions(app.config.get('TABLE_VERSIONS_POLL_INTERVAL', 1.0))
+    app.extensions['page_cache'] = PageCache(app.config.get('PAGE_CACHE_MAX_BYTES', 32 * 2**20))
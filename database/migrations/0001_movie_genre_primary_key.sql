@@ -0,0 +1,23 @@
+-- movie_genre has no primary key: duplicate (movie, genre) rows are possible and
+-- edit/delete by (movieid, movie_genre) has nothing to look rows up by.
+-- Drops incomplete and duplicate rows, then makes (movieid, movie_genre) the
+-- primary key (which also serves the movies foreign key, so the old movieid
+-- index goes) and adds (movie_genre, movieid) for per-genre lookups.
+-- Skipped when movie_genre already has a primary key: re-running it would add
+-- the scratch column migration_row_id again and leave it behind.
+-- skip-if: SELECT COUNT(*) FROM information_schema.table_constraints WHERE table_schema = DATABASE() AND table_name = 'movie_genre' AND constraint_type = 'PRIMARY KEY';
+
+DELETE FROM movie_genre WHERE movieid IS NULL OR movie_genre IS NULL;
+
+-- Duplicates cannot be told apart without a key, so number the rows first
+ALTER TABLE movie_genre ADD COLUMN migration_row_id int NOT NULL AUTO_INCREMENT, ADD UNIQUE KEY migration_row_id (migration_row_id);
+DELETE a FROM movie_genre a
+  JOIN movie_genre b ON a.movieid = b.movieid AND a.movie_genre = b.movie_genre AND a.migration_row_id > b.migration_row_id;
+
+ALTER TABLE movie_genre
+  DROP COLUMN migration_row_id,
+  MODIFY movie_genre varchar(255) NOT NULL,
+  MODIFY movieid int NOT NULL,
+  ADD PRIMARY KEY (movieid, movie_genre),
+  DROP INDEX movieid,
+  ADD INDEX genre_movieid (movie_genre, movieid);
@@ -0,0 +1,6 @@
+-- Revenue by day and method (dashboard, /reports/revenue, revenue-backfill)
+-- reads a date range; the index also covers method and amount so those
+-- queries never touch the rows. Already present if an older copy of
+-- movie_streaming_stats.sql was loaded.
+
+ALTER TABLE payments ADD INDEX payment_date (payment_date, payment_method, payment_amount);
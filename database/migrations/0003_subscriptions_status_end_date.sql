@@ -0,0 +1,5 @@
+-- Status counts on /reports and the expiry job's scan for Active subscriptions
+-- past their end date. Already present if the former
+-- movie_streaming_expiry.sql was loaded.
+
+ALTER TABLE subscriptions ADD INDEX status_end_date (subscription_status, end_Date);
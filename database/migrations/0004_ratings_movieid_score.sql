@@ -0,0 +1,6 @@
+-- Per-movie rating aggregates (top rated movies, top movies per genre,
+-- stats-reconcile) read only movieid and ratingScore; with this index they
+-- are answered from the index alone. It replaces the movieid index that
+-- served the movies foreign key.
+
+ALTER TABLE ratings ADD INDEX movieid_score (movieid, ratingScore), DROP INDEX movieid;
@@ -0,0 +1,37 @@
+CREATE DATABASE  IF NOT EXISTS `movie_streaming` /*!40100 DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci */ /*!80016 DEFAULT ENCRYPTION='N' */;
+USE `movie_streaming`;
+
+--
+-- Bulk user purges (app/purge.py).
+-- `flask purge-users` records the users it is going to delete in
+-- purge_job_users, then removes them one at a time: ratings, payments and
+-- subscriptions in bounded batches, each in its own short transaction, and
+-- finally the user row together with its queue entry. An interrupted job is
+-- picked up where it stopped with `flask purge-users --resume <job_id>`.
+--
+
+DROP TABLE IF EXISTS `purge_job_users`;
+DROP TABLE IF EXISTS `purge_jobs`;
+CREATE TABLE `purge_jobs` (
+  `job_id` int NOT NULL AUTO_INCREMENT,
+  `description` varchar(255) NOT NULL,
+  `status` enum('selecting','running','done') NOT NULL DEFAULT 'selecting',
+  `inactive_before` date DEFAULT NULL,
+  `selected_through` int NOT NULL DEFAULT '0',
+  `users_total` int NOT NULL DEFAULT '0',
+  `users_done` int NOT NULL DEFAULT '0',
+  `subscriptions_deleted` int NOT NULL DEFAULT '0',
+  `payments_deleted` int NOT NULL DEFAULT '0',
+  `ratings_deleted` int NOT NULL DEFAULT '0',
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`job_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- Users still to be deleted; a row is removed in the same transaction as its user
+CREATE TABLE `purge_job_users` (
+  `job_id` int NOT NULL,
+  `userID` int NOT NULL,
+  PRIMARY KEY (`job_id`,`userID`),
+  CONSTRAINT `purge_job_users_ibfk_1` FOREIGN KEY (`job_id`) REFERENCES `purge_jobs` (`job_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -0,0 +1,39 @@
+CREATE DATABASE  IF NOT EXISTS `movie_streaming` /*!40100 DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci */ /*!80016 DEFAULT ENCRYPTION='N' */;
+USE `movie_streaming`;
+
+--
+-- Change log for the similar-movies index (app/recommend.py).
+-- Every rating insert, update or delete marks its movie here, and
+-- `flask recommend-refresh` recomputes only the marked movies, then clears the
+-- marks it consumed. Load this file after movie_streaming_ratings.sql.
+--
+
+DROP TABLE IF EXISTS `movie_rating_changes`;
+CREATE TABLE `movie_rating_changes` (
+  `movieid` int NOT NULL,
+  `changed_at` timestamp(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  PRIMARY KEY (`movieid`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+DROP TRIGGER IF EXISTS `recommend_ratings_insert`;
+DROP TRIGGER IF EXISTS `recommend_ratings_update`;
+DROP TRIGGER IF EXISTS `recommend_ratings_delete`;
+
+DELIMITER ;;
+CREATE TRIGGER `recommend_ratings_insert` AFTER INSERT ON `ratings` FOR EACH ROW BEGIN
+ INSERT INTO movie_rating_changes (movieid, changed_at) VALUES (NEW.movieid, CURRENT_TIMESTAMP(6))
+ ON DUPLICATE KEY UPDATE changed_at = CURRENT_TIMESTAMP(6);
+END ;;
+CREATE TRIGGER `recommend_ratings_update` AFTER UPDATE ON `ratings` FOR EACH ROW BEGIN
+ IF NEW.movieid <> OLD.movieid OR NEW.userID <> OLD.userID OR NOT (NEW.ratingScore <=> OLD.ratingScore) THEN
+  INSERT INTO movie_rating_changes (movieid, changed_at) VALUES (NEW.movieid, CURRENT_TIMESTAMP(6))
+  ON DUPLICATE KEY UPDATE changed_at = CURRENT_TIMESTAMP(6);
+  INSERT INTO movie_rating_changes (movieid, changed_at) VALUES (OLD.movieid, CURRENT_TIMESTAMP(6))
+  ON DUPLICATE KEY UPDATE changed_at = CURRENT_TIMESTAMP(6);
+ END IF;
+END ;;
+CREATE TRIGGER `recommend_ratings_delete` AFTER DELETE ON `ratings` FOR EACH ROW BEGIN
+ INSERT INTO movie_rating_changes (movieid, changed_at) VALUES (OLD.movieid, CURRENT_TIMESTAMP(6))
+ ON DUPLICATE KEY UPDATE changed_at = CURRENT_TIMESTAMP(6);
+END ;;
+DELIMITER ;
@@ -34,11 +34,16 @@ USE `movie_streaming`;
 /*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
 /*!50003 SET sql_mode              = 'ONLY_FULL_GROUP_BY,STRICT_TRANS_TABLES,NO_ZERO_IN_DATE,NO_ZERO_DATE,ERROR_FOR_DIVISION_BY_ZERO,NO_ENGINE_SUBSTITUTION' */ ;
 DELIMITER ;;
-CREATE DEFINER=`root`@`localhost` FUNCTION `get_usercount`(movieName VARCHAR(50)) RETURNS int
-    DETERMINISTIC
+CREATE DEFINER=`root`@`localhost` FUNCTION `get_usercount`(movie_title VARCHAR(255)) RETURNS int
+    READS SQL DATA
 BEGIN 
+-- Number of ratings of the movie(s) with this title, read from the per-movie
+-- counters in movie_rating_stats (movie_streaming_stats.sql) by the title index
 DECLARE countuser INT;
-SELECT count(*) into countuser FROM ratings WHERE movieName=movieName;
+SELECT COALESCE(SUM(s.rating_count), 0) INTO countuser
+FROM movies m
+JOIN movie_rating_stats s ON s.movieid = m.movieid
+WHERE m.title = movie_title;
 RETURN countuser;
 END ;;
 DELIMITER ;
@@ -0,0 +1,19 @@
+CREATE DATABASE  IF NOT EXISTS `movie_streaming` /*!40100 DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci */ /*!80016 DEFAULT ENCRYPTION='N' */;
+USE `movie_streaming`;
+
+--
+-- Search indexes used by /search (app/search.py).
+-- InnoDB maintains both kinds of index inside each transaction, so rows written
+-- by the add/edit/delete routes are searchable as soon as they are committed.
+-- Load this file after movie_streaming_movies.sql and movie_streaming_users.sql.
+--
+
+-- Relevance-ranked word search over movie titles and descriptions
+ALTER TABLE `movies` ADD FULLTEXT INDEX `ft_title_description` (`title`, `description`);
+
+-- Exact title lookups (the get_usercount function)
+ALTER TABLE `movies` ADD INDEX `title` (`title`);
+
+-- Prefix (LIKE 'abc%') search over user names and emails
+ALTER TABLE `users` ADD INDEX `userName` (`userName`);
+ALTER TABLE `users` ADD INDEX `email` (`email`);
@@ -0,0 +1,174 @@
+CREATE DATABASE  IF NOT EXISTS `movie_streaming` /*!40100 DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci */ /*!80016 DEFAULT ENCRYPTION='N' */;
+USE `movie_streaming`;
+
+--
+-- Precomputed dashboard metrics.
+-- The tables below are kept current by the triggers at the end of this file,
+-- so every writer (web routes, imports, maintenance jobs) updates them in the
+-- same transaction as the row change. Rebuild them with `flask stats-reconcile`.
+-- Load this file after the users, movies, subscriptions, payments and ratings tables.
+--
+
+DROP TABLE IF EXISTS `app_stats`;
+CREATE TABLE `app_stats` (
+  `stat_key` varchar(64) NOT NULL,
+  `stat_value` bigint NOT NULL DEFAULT '0',
+  PRIMARY KEY (`stat_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- Revenue rollup by day and payment method. Weekly, monthly and other range
+-- totals are sums over at most a few rows per day. payment_method is '' for
+-- payments without one.
+DROP TABLE IF EXISTS `monthly_revenue`;
+DROP TABLE IF EXISTS `daily_revenue`;
+CREATE TABLE `daily_revenue` (
+  `day` date NOT NULL,
+  `payment_method` varchar(16) NOT NULL DEFAULT '',
+  `revenue` bigint NOT NULL DEFAULT '0',
+  `payments` int NOT NULL DEFAULT '0',
+  PRIMARY KEY (`day`,`payment_method`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- The fallback for /reports/revenue when the rollup is missing or being
+-- backfilled reads the payments.payment_date index, which comes from
+-- `flask migrate` (database/migrations/0002_payments_payment_date.sql)
+
+-- Per-movie rating aggregates. Average and variance come from the running sums
+-- (variance = sum_sq / n - avg^2), so reading them never touches ratings.
+-- rating_count counts every rating row; score_count only those with a score.
+DROP TABLE IF EXISTS `movie_review_counts`;
+DROP TABLE IF EXISTS `movie_rating_stats`;
+CREATE TABLE `movie_rating_stats` (
+  `movieid` int NOT NULL,
+  `rating_count` int NOT NULL DEFAULT '0',
+  `score_count` int NOT NULL DEFAULT '0',
+  `score_sum` double NOT NULL DEFAULT '0',
+  `score_sum_sq` double NOT NULL DEFAULT '0',
+  `last_rating_date` date DEFAULT NULL,
+  `avg_rating` double GENERATED ALWAYS AS (`score_sum` / NULLIF(`score_count`, 0)) STORED,
+  PRIMARY KEY (`movieid`),
+  KEY `rating_count` (`rating_count`,`movieid`),
+  KEY `avg_rating` (`avg_rating`,`score_count`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+INSERT INTO `app_stats` (`stat_key`, `stat_value`)
+SELECT 'total_users', COUNT(*) FROM `users`
+UNION ALL
+SELECT 'total_subscriptions', COUNT(*) FROM `subscriptions`;
+
+INSERT INTO `daily_revenue` (`day`, `payment_method`, `revenue`, `payments`)
+SELECT `payment_date`, COALESCE(`payment_method`, ''), SUM(`payment_amount`), COUNT(*)
+FROM `payments`
+WHERE `payment_date` IS NOT NULL AND `payment_amount` IS NOT NULL
+GROUP BY 1, 2;
+
+INSERT INTO `movie_rating_stats` (`movieid`, `rating_count`, `score_count`, `score_sum`, `score_sum_sq`, `last_rating_date`)
+SELECT `movieid`, COUNT(*), COUNT(`ratingScore`), COALESCE(SUM(`ratingScore`), 0),
+       COALESCE(SUM(`ratingScore` * `ratingScore`), 0), MAX(`ratingDate`)
+FROM `ratings` GROUP BY `movieid`;
+
+--
+-- Adding and removing one payment or rating (used by the triggers below)
+--
+
+DROP PROCEDURE IF EXISTS `daily_revenue_add`;
+DROP PROCEDURE IF EXISTS `movie_rating_stats_add`;
+DROP PROCEDURE IF EXISTS `movie_rating_stats_remove`;
+
+DELIMITER ;;
+CREATE PROCEDURE `daily_revenue_add`(IN p_day DATE, IN p_method VARCHAR(16), IN p_amount INT, IN p_payments INT)
+BEGIN
+ -- p_amount and p_payments are negative when a payment is removed
+ IF p_day IS NOT NULL AND p_amount IS NOT NULL THEN
+  INSERT INTO daily_revenue (day, payment_method, revenue, payments)
+  VALUES (p_day, IFNULL(p_method, ''), p_amount, p_payments)
+  ON DUPLICATE KEY UPDATE revenue = revenue + p_amount, payments = payments + p_payments;
+ END IF;
+END ;;
+CREATE PROCEDURE `movie_rating_stats_add`(IN p_movieid INT, IN p_score FLOAT, IN p_date DATE)
+BEGIN
+ INSERT INTO movie_rating_stats (movieid, rating_count, score_count, score_sum, score_sum_sq, last_rating_date)
+ VALUES (p_movieid, 1, p_score IS NOT NULL, IFNULL(p_score, 0), IFNULL(p_score * p_score, 0), p_date)
+ ON DUPLICATE KEY UPDATE
+  rating_count = rating_count + 1,
+  score_count = score_count + (p_score IS NOT NULL),
+  score_sum = score_sum + IFNULL(p_score, 0),
+  score_sum_sq = score_sum_sq + IFNULL(p_score * p_score, 0),
+  last_rating_date = IF(last_rating_date IS NULL OR p_date > last_rating_date, p_date, last_rating_date);
+END ;;
+CREATE PROCEDURE `movie_rating_stats_remove`(IN p_movieid INT, IN p_score FLOAT, IN p_date DATE)
+BEGIN
+ -- Assignments run left to right, so the sums see the decremented score_count
+ -- and are reset exactly once no score is left. The latest date is only looked
+ -- up again (on the movieid index) when the removed rating was the latest one.
+ UPDATE movie_rating_stats
+ SET rating_count = rating_count - 1,
+     score_count = score_count - (p_score IS NOT NULL),
+     score_sum = IF(score_count = 0, 0, score_sum - IFNULL(p_score, 0)),
+     score_sum_sq = IF(score_count = 0, 0, score_sum_sq - IFNULL(p_score * p_score, 0)),
+     last_rating_date = IF(p_date <=> last_rating_date,
+                           (SELECT MAX(ratingDate) FROM ratings WHERE movieid = p_movieid),
+                           last_rating_date)
+ WHERE movieid = p_movieid;
+END ;;
+DELIMITER ;
+
+--
+-- Triggers
+--
+
+DROP TRIGGER IF EXISTS `stats_users_insert`;
+DROP TRIGGER IF EXISTS `stats_users_delete`;
+DROP TRIGGER IF EXISTS `stats_subscriptions_insert`;
+DROP TRIGGER IF EXISTS `stats_subscriptions_delete`;
+DROP TRIGGER IF EXISTS `stats_payments_insert`;
+DROP TRIGGER IF EXISTS `stats_payments_update`;
+DROP TRIGGER IF EXISTS `stats_payments_delete`;
+DROP TRIGGER IF EXISTS `stats_ratings_insert`;
+DROP TRIGGER IF EXISTS `stats_ratings_update`;
+DROP TRIGGER IF EXISTS `stats_ratings_delete`;
+
+DELIMITER ;;
+CREATE TRIGGER `stats_users_insert` AFTER INSERT ON `users` FOR EACH ROW BEGIN
+ INSERT INTO app_stats (stat_key, stat_value) VALUES ('total_users', 1)
+ ON DUPLICATE KEY UPDATE stat_value = stat_value + 1;
+END ;;
+CREATE TRIGGER `stats_users_delete` AFTER DELETE ON `users` FOR EACH ROW BEGIN
+ UPDATE app_stats SET stat_value = stat_value - 1 WHERE stat_key = 'total_users';
+END ;;
+
+CREATE TRIGGER `stats_subscriptions_insert` AFTER INSERT ON `subscriptions` FOR EACH ROW BEGIN
+ INSERT INTO app_stats (stat_key, stat_value) VALUES ('total_subscriptions', 1)
+ ON DUPLICATE KEY UPDATE stat_value = stat_value + 1;
+END ;;
+CREATE TRIGGER `stats_subscriptions_delete` AFTER DELETE ON `subscriptions` FOR EACH ROW BEGIN
+ UPDATE app_stats SET stat_value = stat_value - 1 WHERE stat_key = 'total_subscriptions';
+END ;;
+
+CREATE TRIGGER `stats_payments_insert` AFTER INSERT ON `payments` FOR EACH ROW BEGIN
+ CALL daily_revenue_add(NEW.payment_date, NEW.payment_method, NEW.payment_amount, 1);
+END ;;
+CREATE TRIGGER `stats_payments_update` AFTER UPDATE ON `payments` FOR EACH ROW BEGIN
+ IF NOT (NEW.payment_date <=> OLD.payment_date AND NEW.payment_method <=> OLD.payment_method
+         AND NEW.payment_amount <=> OLD.payment_amount) THEN
+  CALL daily_revenue_add(OLD.payment_date, OLD.payment_method, -OLD.payment_amount, -1);
+  CALL daily_revenue_add(NEW.payment_date, NEW.payment_method, NEW.payment_amount, 1);
+ END IF;
+END ;;
+CREATE TRIGGER `stats_payments_delete` AFTER DELETE ON `payments` FOR EACH ROW BEGIN
+ CALL daily_revenue_add(OLD.payment_date, OLD.payment_method, -OLD.payment_amount, -1);
+END ;;
+
+CREATE TRIGGER `stats_ratings_insert` AFTER INSERT ON `ratings` FOR EACH ROW BEGIN
+ CALL movie_rating_stats_add(NEW.movieid, NEW.ratingScore, NEW.ratingDate);
+END ;;
+CREATE TRIGGER `stats_ratings_update` AFTER UPDATE ON `ratings` FOR EACH ROW BEGIN
+ IF NOT (NEW.movieid <=> OLD.movieid AND NEW.ratingScore <=> OLD.ratingScore AND NEW.ratingDate <=> OLD.ratingDate) THEN
+  CALL movie_rating_stats_remove(OLD.movieid, OLD.ratingScore, OLD.ratingDate);
+  CALL movie_rating_stats_add(NEW.movieid, NEW.ratingScore, NEW.ratingDate);
+ END IF;
+END ;;
+CREATE TRIGGER `stats_ratings_delete` AFTER DELETE ON `ratings` FOR EACH ROW BEGIN
+ CALL movie_rating_stats_remove(OLD.movieid, OLD.ratingScore, OLD.ratingDate);
+END ;;
+DELIMITER ;
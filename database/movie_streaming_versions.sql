@@ -0,0 +1,21 @@
+CREATE DATABASE  IF NOT EXISTS `movie_streaming` /*!40100 DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci */ /*!80016 DEFAULT ENCRYPTION='N' */;
+USE `movie_streaming`;
+
+--
+-- Per-table change versions for conditional GET (app/versions.py).
+-- invalidate() bumps a table's row after every committed write (routes, imports,
+-- maintenance commands), once per write rather than once per changed row, so
+-- the row is only locked briefly. The version and time stamp become the ETag
+-- and Last-Modified of the pages built from the table.
+--
+
+DROP TABLE IF EXISTS `table_versions`;
+CREATE TABLE `table_versions` (
+  `table_name` varchar(64) NOT NULL,
+  `version` bigint NOT NULL DEFAULT '0',
+  `changed_at` timestamp(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  PRIMARY KEY (`table_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+INSERT INTO `table_versions` (`table_name`, `version`) VALUES
+  ('users', 1), ('movies', 1), ('movie_genre', 1), ('subscriptions', 1), ('payments', 1), ('ratings', 1);
@@ -0,0 +1,49 @@
+# gunicorn.conf.py
+#
+# Production server (pip install gunicorn). From this directory:
+#
+#     MYSQL_PASSWORD=... gunicorn
+#
+# The master binds WEB_BIND and forks WEB_WORKERS processes (default: one per
+# core) of WEB_THREADS threads each. Workers build the app after the fork
+# (run:app), so connection pools, caches, the rating writer and the expiry
+# scheduler belong to one process, and warm up before accepting connections
+# (see app/server.py). Keep MYSQL_POOL_SIZE >= WEB_THREADS, and
+# WEB_WORKERS * MYSQL_POOL_SIZE below the server's max_connections.
+#
+#     kill -HUP <master pid>    reload: new workers with the new code and config
+#                               start, the old ones drain and exit
+#     kill -TERM <master pid>   stop: workers drain for up to WEB_GRACEFUL_TIMEOUT seconds
+#     kill -TTIN / -TTOU        one worker more / fewer
+
+import multiprocessing
+import os
+
+wsgi_app = 'run:app'
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS') or multiprocessing.cpu_count())
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))                     # seconds before a stuck worker is restarted
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))   # seconds a stopping worker may finish requests
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))            # recycle workers after this many requests; 0: never
+max_requests_jitter = max_requests // 10
+# WEB_PRELOAD=1 imports the app once in the master and shares its memory with
+# the workers, but then HUP no longer reloads the code (restart instead)
+preload_app = os.environ.get('WEB_PRELOAD', '0') == '1'
+proc_name = 'movie-streaming'
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # After the fork and the app import, before the worker accepts connections
+    from app.server import start_worker
+    start_worker(worker.wsgi, threads=worker.cfg.threads)
+
+
+def worker_exit(server, worker):
+    from app.server import stop_worker
+    if getattr(worker, 'wsgi', None) is not None:
+        stop_worker(worker.wsgi)
@@ -1,5 +1,6 @@
 from app import create_app
 
+# Development server; in production gunicorn imports `app` from here (see gunicorn.conf.py)
 app = create_app()
 
 if __name__ == '__main__':
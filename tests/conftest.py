@@ -0,0 +1,59 @@
+# Tests run from the repository root with `python -m pytest`.
+#
+# The unit tests need nothing else. Tests that take the `mysql_app` fixture
+# run against the database in MYSQL_HOST/PORT/USER/PASSWORD/DATABASE (loaded
+# with `flask seed-data` and migrated) and are skipped when it cannot be
+# reached; the replica tests also need MYSQL_TEST_REPLICA (see test_replicas.py).
+
+import os
+
+import mysql.connector
+import pytest
+from mysql.connector import errors
+
+from app import create_app
+
+
+def reachable(**connect_args):
+    try:
+        conn = mysql.connector.connect(connection_timeout=2, **connect_args)
+    except errors.Error:
+        return False
+    conn.close()
+    return True
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def mysql_app(app):
+    if not reachable(host=app.config['MYSQL_HOST'], port=app.config['MYSQL_PORT'], user=app.config['MYSQL_USER'],
+                     password=app.config['MYSQL_PASSWORD'], database=app.config['MYSQL_DATABASE']):
+        pytest.skip(f"MySQL at {app.config['MYSQL_HOST']}:{app.config['MYSQL_PORT']} is not reachable")
+    yield app
+    for pool in filter(None, [app.extensions.get('mysql_pool')]):
+        pool.close()
+
+
+@pytest.fixture
+def replica_app(mysql_app):
+    # A second local MySQL as the only replica: MYSQL_TEST_REPLICA=host:port
+    replica = os.environ.get('MYSQL_TEST_REPLICA')
+    if not replica:
+        pytest.skip("MYSQL_TEST_REPLICA is not set")
+    host, _, port = replica.partition(':')
+    port = int(port or 3306)
+    if not reachable(host=host, port=port, user=mysql_app.config['MYSQL_USER'],
+                     password=mysql_app.config['MYSQL_PASSWORD'], database=mysql_app.config['MYSQL_DATABASE']):
+        pytest.skip(f"Replica {replica} is not reachable")
+    mysql_app.config['MYSQL_REPLICAS'] = [{'host': host, 'port': port}]
+    yield mysql_app
+    replicas = mysql_app.extensions.get('mysql_replicas')
+    if replicas is not None:
+        for r in replicas.replicas:
+            r.pool.close()
@@ -0,0 +1,35 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app.facets import bitmap, ids_after, ids_before, parse_filters
+
+
+def test_bitmap():
+    assert bitmap([]) == 0
+    assert bitmap([0, 3, 9]) == 0b1000001001
+    assert bitmap(iter([9, 3, 3])) == 0b1000001000
+
+def test_ids_after_walks_up_from_the_cursor():
+    bits = bitmap([1, 4, 8, 20, 64])
+    assert ids_after(bits, -1, 10) == [1, 4, 8, 20, 64]
+    assert ids_after(bits, 4, 2) == [8, 20]
+    assert ids_after(bits, 64, 10) == []
+    assert ids_after(0, -1, 10) == []
+
+def test_ids_before_walks_down_from_the_cursor():
+    bits = bitmap([1, 4, 8, 20, 64])
+    assert ids_before(bits, 20, 10) == [8, 4, 1]
+    assert ids_before(bits, 65, 2) == [64, 20]
+    assert ids_before(bits, 1, 10) == []
+
+def test_ids_before_ignores_out_of_range_positions():
+    bits = bitmap([1, 4])
+    assert ids_before(bits, 10 ** 12, 10) == [4, 1]
+    assert ids_before(bits, -5, 10) == []
+
+
+def test_min_rating_must_be_a_finite_rating():
+    assert parse_filters(MultiDict({'min_rating': '3.5'}))['min_rating'] == 3.5
+    for value in ('nan', 'inf', '-inf', '-1', '5.5', 'abc'):
+        with pytest.raises(ValueError):
+            parse_filters(MultiDict({'min_rating': value}))
@@ -0,0 +1,39 @@
+from app.migrate import Migration, load_migrations
+
+
+def _migration(tmp_path, sql, file_name='0001_test.sql'):
+    path = tmp_path / file_name
+    path.write_text(sql, encoding='utf-8')
+    return Migration(1, 'test', str(path))
+
+
+def test_statements_split_at_line_ending_semicolons_and_drop_comments(tmp_path):
+    migration = _migration(tmp_path, (
+        "-- a comment; not a statement;\n"
+        "ALTER TABLE a\n"
+        "  ADD INDEX b (c);\n"
+        "\n"
+        "UPDATE a SET d = 'x;y' WHERE e = 1;\n"
+    ))
+    assert migration.statements() == ["ALTER TABLE a\n  ADD INDEX b (c)", "UPDATE a SET d = 'x;y' WHERE e = 1"]
+
+def test_skip_if(tmp_path):
+    migration = _migration(tmp_path, "-- skip-if: SELECT COUNT(*) FROM t;\nALTER TABLE t ADD COLUMN c int;\n")
+    assert migration.skip_if() == "SELECT COUNT(*) FROM t"
+    assert migration.statements() == ["ALTER TABLE t ADD COLUMN c int"]
+    assert _migration(tmp_path, "ALTER TABLE t ADD COLUMN c int;\n").skip_if() is None
+
+def test_checksum_changes_with_the_file(tmp_path):
+    first = _migration(tmp_path, "ALTER TABLE t ADD INDEX i (c);\n").checksum
+    assert _migration(tmp_path, "ALTER TABLE t ADD INDEX i (c, d);\n").checksum != first
+
+
+def test_shipped_migrations_are_numbered_in_order():
+    migrations = load_migrations()
+    assert [m.version for m in migrations] == list(range(1, len(migrations) + 1))
+    assert all(m.statements() for m in migrations)
+
+def test_movie_genre_primary_key_is_skipped_once_present():
+    # Re-running it on a keyed table would add the scratch column again
+    first = load_migrations()[0]
+    assert 'information_schema' in first.skip_if()
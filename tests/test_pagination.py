@@ -0,0 +1,32 @@
+import datetime
+
+from app.pagination import decode_cursor, encode_cursor, page_sql, seek_condition, seek_params
+
+
+def test_cursor_round_trip():
+    token = encode_cursor('next', [5, 'Drama'])
+    assert '=' not in token
+    assert decode_cursor(token) == ('next', [5, 'Drama'])
+
+def test_cursor_values_that_json_cannot_hold_become_strings():
+    token = encode_cursor('prev', [datetime.date(2024, 2, 29)])
+    assert decode_cursor(token) == ('prev', ['2024-02-29'])
+
+def test_malformed_cursors_are_ignored():
+    for token in (None, '', '!!!', encode_cursor('sideways', [1]), 'WzEsMl0', 'eyJhIjoxfQ'):
+        assert decode_cursor(token) is None
+
+
+def test_seek_condition_expands_the_row_comparison():
+    assert seek_condition(['a'], '>') == "((a > %s))"
+    assert seek_condition(['a', 'b'], '<') == "((a < %s) OR (a = %s AND b < %s))"
+    assert seek_condition(['a', 'b'], '>', inclusive=True) == "((a > %s) OR (a = %s AND b >= %s))"
+
+def test_seek_params_follow_the_condition():
+    assert seek_params([1, 2, 3]) == [1, 1, 2, 1, 2, 3]
+
+
+def test_page_sql():
+    sql = page_sql("SELECT * FROM t", ['a', 'b'], reverse_scan=True, where="c = %s", seek=True)
+    assert sql == ("SELECT * FROM t WHERE c = %s AND ((a < %s) OR (a = %s AND b < %s))"
+                   " ORDER BY a DESC, b DESC LIMIT %s")
@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+from app.bench import sample_data
+from app.plancheck import EXPECTED, _built_cases, _guess_params, check_plans, plan_findings
+
+
+def test_plan_findings_reports_full_scans_and_filesorts():
+    plan = {'query_block': {
+        'ordering_operation': {
+            'using_filesort': True,
+            'nested_loop': [
+                {'table': {'table_name': 'users', 'access_type': 'ALL'}},
+                {'table': {'table_name': 'subscriptions', 'access_type': 'ref'}},
+            ],
+        },
+    }}
+    assert sorted(plan_findings(plan), key=str) == [('filesort', None), ('full scan', 'users')]
+
+def test_plan_findings_of_an_index_lookup_is_empty():
+    plan = {'query_block': {'table': {'table_name': 'movies', 'access_type': 'const'}}}
+    assert plan_findings(plan) == []
+
+
+def test_guess_params_matches_placeholders_to_sample_columns():
+    samples = {'users': {'userID': 7, 'userName': 'ann'}, 'movies': {'movieid': 3, 'title': 'Alien Nation'}}
+    sql = ("SELECT * FROM users u JOIN movies m ON m.movieid = %s "
+           "WHERE u.userID = %s AND u.userName LIKE %s LIMIT %s")
+    assert _guess_params(sql, samples) == [3, 7, 'an%', 10]
+
+def test_guess_params_for_full_text_dates_and_unknown_columns():
+    samples = {'movies': {'title': 'Alien Nation'}}
+    sql = "SELECT * FROM movies WHERE MATCH (title) AGAINST (%s IN BOOLEAN MODE) AND release_date >= %s AND x = %s"
+    assert _guess_params(sql, samples) == ['+Alien*', datetime.date.today(), 1]
+
+
+def test_no_registered_statement_reads_a_whole_table_or_filesorts(mysql_app):
+    with mysql_app.app_context():
+        samples, _ = sample_data()
+        results = check_plans(samples)
+    assert results
+    failures = {label: unexpected for label, _, _, unexpected in results if unexpected}
+    assert failures == {}
+
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_expected_findings_are_still_needed(mysql_app, name):
+    # An accepted finding that no longer shows up should be removed from EXPECTED
+    with mysql_app.app_context():
+        samples, _ = sample_data()
+        results = check_plans(samples, {name})
+    assert any(findings for _, _, findings, _ in results)
+
+
+def test_built_statements_get_one_param_per_placeholder():
+    samples = {
+        'users': {'userID': 7}, 'movies': {'movieid': 3}, 'subscriptions': {'subscription_id': 4},
+        'payments': {'payment_id': 9, 'payment_method': 'Card'}, 'ratings': {'userID': 7, 'movieid': 3},
+        'movie_genre': {'movieid': 3, 'movie_genre': 'Drama'},
+    }
+    cases = list(_built_cases(samples))
+    names = {name for _, name, _, _ in cases}
+    assert {'top_movies_by_genre', 'revenue', 'facet_page_movies', 'profile_movie_titles', 'api_ratings'} <= names
+    for label, _, sql, params in cases:
+        assert sql.count('%s') == len(params), label
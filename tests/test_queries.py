@@ -0,0 +1,34 @@
+import pytest
+
+from app.queries import in_list, padded, row_type
+
+
+def test_padded_repeats_the_last_value_up_to_a_power_of_two():
+    assert padded([1]) == [1]
+    assert padded([1, 2]) == [1, 2]
+    assert padded([1, 2, 3]) == [1, 2, 3, 3]
+    assert padded(range(5)) == [0, 1, 2, 3, 4, 4, 4, 4]
+
+def test_in_list():
+    assert in_list('movieid', [4, 9, 2]) == ("movieid IN (%s, %s, %s, %s)", [4, 9, 2, 2])
+
+
+def test_row_fields_by_name_index_and_attribute():
+    Row = row_type(('movieid', 'title'))
+    row = Row((3, 'Alien Nation'))
+    assert row.title == row['title'] == row[1] == 'Alien Nation'
+    assert row.get('missing') is None
+    assert row.keys() == ('movieid', 'title')
+    assert row._asdict() == {'movieid': 3, 'title': 'Alien Nation'}
+    assert tuple(row) == (3, 'Alien Nation')
+    with pytest.raises(KeyError):
+        row['missing']
+
+def test_rows_with_the_same_columns_share_a_type():
+    assert row_type(['a', 'b']) is row_type(('a', 'b'))
+    assert row_type(('a', 'b')) is not row_type(('b', 'a'))
+
+def test_columns_that_shadow_row_methods_are_only_reachable_by_name():
+    row = row_type(('keys', 'n'))(('k', 1))
+    assert row['keys'] == 'k'
+    assert row.keys() == ('keys', 'n')
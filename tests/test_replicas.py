@@ -0,0 +1,63 @@
+# Read routing (db.py) against two servers: the primary from MYSQL_* and a
+# second local MySQL in MYSQL_TEST_REPLICA ('host:port', same user, password
+# and database; it need not actually replicate, a server that is not a
+# replica counts as 0 seconds behind).
+
+import time
+
+from flask import g
+
+from app.db import READ_YOUR_WRITES_COOKIE, get_db, get_read_db, get_replicas, is_replica, mark_written
+
+
+def _port(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT @@port")
+    port = cursor.fetchall()[0][0]
+    cursor.close()
+    return port
+
+
+def test_get_requests_read_from_the_replica(replica_app):
+    with replica_app.test_request_context('/movies'):
+        db = get_read_db()
+        assert is_replica(db)
+        assert get_read_db() is db
+        assert _port(db) == replica_app.config['MYSQL_REPLICAS'][0]['port']
+    assert get_replicas(replica_app).replicas[0].counters['reads'] == 1
+
+def test_other_methods_read_from_the_primary(replica_app):
+    with replica_app.test_request_context('/movies/add', method='POST'):
+        assert get_read_db() is get_db()
+
+def test_reads_after_a_write_in_the_request_use_the_primary(replica_app):
+    with replica_app.test_request_context('/movies'):
+        primary = get_db()
+        assert get_read_db() is primary
+
+def test_clients_that_just_wrote_read_from_the_primary(replica_app):
+    cookie = f"{READ_YOUR_WRITES_COOKIE}={time.time() + 60:.3f}"
+    with replica_app.test_request_context('/movies', headers={'Cookie': cookie}):
+        assert get_read_db() is get_db()
+    assert get_replicas(replica_app).counters['primary_reads'] == 1
+
+def test_a_write_sets_the_read_your_writes_cookie(replica_app):
+    @replica_app.route('/test-write')
+    def write():
+        mark_written()
+        return ''
+
+    response = replica_app.test_client().get('/test-write')
+    assert READ_YOUR_WRITES_COOKIE in response.headers.get('Set-Cookie', '')
+
+
+def test_an_unreachable_replica_falls_back_to_the_primary(mysql_app):
+    # Nothing listens on port 1
+    mysql_app.config['MYSQL_REPLICAS'] = ['127.0.0.1:1']
+    with mysql_app.test_request_context('/movies'):
+        db = get_read_db()
+        assert db is get_db()
+        assert 'replica' not in g
+    replicas = get_replicas(mysql_app)
+    assert replicas.counters['fallbacks'] == 1
+    assert replicas.replicas[0].down_until > time.monotonic()